@@ -1,7 +1,10 @@
-from apistar.frameworks.wsgi import WSGIApp as App
+import os
+
+from apistar.frameworks.wsgi import WSGIApp
 from apistar import Component
 from apistar import Settings
 
+from project.commands import commands
 from project.routes import routes
 from project.mongo_db import Database, init_database
 
@@ -14,6 +17,12 @@ settings = Settings({
     'MONGO_COUNTRY_COLL': 'world_countries',
     'MONGO_REPORTS_COLL': 'rapporter',
     'MONGO_USERS_COLL': 'users',
+    # per worker process, see gunicorn.conf.py
+    'MONGO_MAX_POOL_SIZE': int(os.environ.get('MONGO_MAX_POOL_SIZE', 20)),
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': 2000,
+    'MONGO_CONNECT_TIMEOUT_MS': 5000,
+    'MONGO_SOCKET_TIMEOUT_MS': 30000,
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': 5000,
     'LOCALHOST': False
 })
 
@@ -22,10 +31,10 @@ components = [
     Component(Database, init=init_database, preload=True),
 ]
 
-
-app = App(
+app = WSGIApp(
     settings=settings,
     routes=routes,
+    commands=commands,
     components=components
     )
 
@@ -0,0 +1,282 @@
+"""
+Latency and mongo round trips of every Database method and route on synthetic data.
+
+    python -m benchmarks.run --universities 1000 10000 --uri mongodb://localhost:27017
+    python -m benchmarks.run --universities 1000 --mongomock
+
+The data is loaded into the database --db (gib_benchmark) and replaced on every run.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from urllib.parse import quote
+
+from pymongo import monitoring
+
+from benchmarks.synthetic import generate, load
+from project.query_plans import explain
+
+
+class RoundTrips(monitoring.CommandListener):
+    """Counts the commands sent to mongo"""
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    position = (len(values) - 1) * p
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def measure(funk, repeat: int, round_trips: RoundTrips, reset=None) -> dict:
+    """
+    :param funk: called repeat + 1 times, the first call is reported as cold
+    :param reset: called before every call if the in-process caches should be cold on every call
+    :return: latencies in ms and mean round trips per call
+    """
+    latencies = []
+    trips = []
+    for _ in range(repeat + 1):
+        if reset:
+            reset()
+        before = round_trips.count
+        start = time.perf_counter()
+        funk()
+        latencies.append((time.perf_counter() - start) * 1000)
+        trips.append(round_trips.count - before)
+    cold, warm = latencies[0], latencies[1:] or latencies
+    return {
+        'cold_ms': round(cold, 3),
+        'p50_ms': round(percentile(warm, 0.5), 3),
+        'p90_ms': round(percentile(warm, 0.9), 3),
+        'p99_ms': round(percentile(warm, 0.99), 3),
+        'max_ms': round(max(warm), 3),
+        'cold_round_trips': trips[0],
+        'round_trips': round(statistics.mean(trips[1:] or trips), 2),
+    }
+
+
+def method_cases(db, data: dict, rnd: random.Random) -> list:
+    """(name, callable) for every Database method that serves the api"""
+    unis = data['uni']
+    uni_id = str(max(unis, key=lambda u: u['rapporter_antall'])['_id'])
+    some_id = lambda: str(rnd.choice(unis)['_id'])
+    country = rnd.choice(data['world_countries'])['properties']['name']
+    user = data['users'][0]['_id'] if data['users'] else 'student0@stud.ntnu.no'
+    word = unis[0]['by']
+
+    def cart():
+        uni = some_id()
+        db.add_uni_to_cart(user, uni)
+        db.remove_uni_from_cart(user, uni)
+
+    def note():
+        db.add_uni_to_cart(user, uni_id)
+        added = db.add_link_or_note(user, uni_id, 'head', 'note', None)
+        db.remove_link_or_note(user, uni_id, added['added']['notes'][0][0], None)
+
+    def report():
+        report_id = db.insert_report(some_id(), {'Vil du anbefale andre å reise til studiestedet?': 'ja'})
+        db.update_report(report_id, {'Hvordan vil du rangere den sosiale opplevelsen?': '4'})
+
+    return [
+        ('ping', db.ping),
+        ('get_university_by_id', lambda: db.get_university_by_id(some_id())),
+        ('get_university_geojson_by_id', lambda: db.get_university_geojson_by_id(uni_id)),
+        ('list_all_uni', db.list_all_uni),
+        ('list_all_uni_payload', db.list_all_uni_payload),
+        ('search_by_all', lambda: db.search_by_all(word)),
+        ('advanced_search', lambda: db.advanced_search({'land': [country], 'min_reports': 1})),
+        ('get_country_list', lambda: db.get_country_list(country)),
+        ('get_fagomraader', lambda: db.get_fagomraader('tek')),
+        ('get_reports_for_university', lambda: db.get_reports_for_university(uni_id)),
+        ('search_universities', lambda: db.search_universities(word[:3])),
+        ('get_raw_html', lambda: db.get_raw_html(some_id())),
+        ('get_or_create_user', lambda: db.get_or_create_user(user)),
+        ('add_and_remove_uni_from_cart', cart),
+        ('add_and_remove_link_or_note', note),
+        ('insert_and_update_report', report),
+        ('get_university_and_score', db.get_university_and_score),
+        ('get_choropleth_countries', db.get_choropleth_countries),
+        ('get_money_for_uni', lambda: db.get_money_for_uni(uni_id)),
+        ('get_money_for_uni_all', lambda: db.get_money_for_uni(None)),
+        ('get_money_for_countries', db.get_money_for_countries),
+        ('get_top_stared_universities', lambda: db.get_top_stared_universities(4)),
+        ('refresh_weather', db.refresh_weather),
+    ]
+
+
+def route_cases(client, data: dict, rnd: random.Random) -> list:
+    """(name, callable) for every route that reads, through the WSGI app"""
+    unis = data['uni']
+    uni_id = str(max(unis, key=lambda u: u['rapporter_antall'])['_id'])
+    country = quote(rnd.choice(data['world_countries'])['properties']['name'])
+    user = data['users'][0]['_id'] if data['users'] else 'student0@stud.ntnu.no'
+    word = quote(unis[0]['by'])
+    paths = [
+        '/ping_database',
+        f'/get_university_by_id/{uni_id}',
+        f'/get_university_geojson_by_id/{uni_id}',
+        '/list_all_uni_as_geo_json',
+        f'/search_by_all/{word}',
+        f'/advanced_search?land={country}&min_reports=1',
+        f'/uni_in_country/{country}',
+        '/get_fagomraader/tek',
+        f'/get_reports_for_university/{uni_id}',
+        f'/search_universities/{word[:3]}',
+        f'/get_raw_html/{uni_id}',
+        f'/create_or_get_user/{user}',
+        '/get_university_and_score',
+        '/get_choropleth_countries',
+        f'/get_money_for_uni/{uni_id}',
+        '/get_money_for_countries',
+        '/get_top_stared_universities/?k=4',
+    ]
+    return [(path, lambda path=path: client.get(path)) for path in paths]
+
+
+def reset_caches(db):
+    """drops the in-process caches so every call pays for its reads"""
+    def reset():
+        db._memo.clear()
+        db._derived.clear()
+        db._top_stars.clear()
+    return reset
+
+
+def run(universities: int, args, round_trips: RoundTrips) -> dict:
+    import pymongo
+    from apistar import Component, Settings
+    from apistar.frameworks.wsgi import WSGIApp
+    from apistar.test import TestClient
+
+    from project import mongo_db
+    from project.routes import routes
+    from project.weather_job import StubWeatherProvider
+
+    client = pymongo.MongoClient(args.uri) if not args.mongomock else mongo_db.MongoClient(args.uri)
+    data = generate(universities, countries_count=args.countries, seed=args.seed, mean_reports=args.reports)
+    loaded = load(client[args.db], data)
+
+    settings = Settings({
+        'MONGO_URI': args.uri,
+        'MONGO_DB': args.db,
+        'MONGO_UNI_COLL': 'uni',
+        'MONGO_COUNTRY_COLL': 'world_countries',
+        'MONGO_REPORTS_COLL': 'rapporter',
+        'MONGO_USERS_COLL': 'users',
+    })
+    # not init_database, its startup thread would bootstrap the same collections as the calls below
+    db = mongo_db.Database(settings['MONGO_URI'], settings['MONGO_DB'], settings['MONGO_UNI_COLL'],
+                           settings['MONGO_COUNTRY_COLL'], settings['MONGO_REPORTS_COLL'], settings['MONGO_USERS_COLL'])
+    db._weather_provider = StubWeatherProvider()
+    db.ensure_indexes()
+    db.rebuild_report_stats()
+    db.assign_countries()
+    db.move_cold_fields()
+
+    rnd = random.Random(args.seed)
+    reset = reset_caches(db) if args.cold else None
+    results = {'collections': loaded, 'methods': {}, 'routes': {}}
+    for name, funk in method_cases(db, data, rnd):
+        results['methods'][name] = safe_measure(funk, args.repeat, round_trips, reset)
+        if args.explain:
+            results['methods'][name]['plans'] = safe_explain(db, funk)
+
+    app = WSGIApp(settings=settings, routes=routes,
+                  components=[Component(mongo_db.Database, init=lambda: db, preload=True)])
+    test_client = TestClient(app)
+    for name, funk in route_cases(test_client, data, rnd):
+        results['routes'][name] = safe_measure(funk, args.repeat, round_trips, reset)
+    return results
+
+
+def safe_measure(funk, repeat, round_trips, reset) -> dict:
+    try:
+        return measure(funk, repeat, round_trips, reset)
+    except Exception as e:
+        # e.g. $text or $geoNear on mongomock
+        return {'error': f'{type(e).__name__}: {e}'}
+
+
+def safe_explain(db, funk) -> list:
+    """plans of the queries funk sends with cold in-process caches"""
+    reset_caches(db)()
+    try:
+        with db._queries.capture() as commands:
+            funk()
+        return [explain(db._mongo[database], command) for database, command in commands]
+    except Exception as e:
+        return [{'error': f'{type(e).__name__}: {e}'}]
+
+
+def print_table(universities: int, results: dict) -> None:
+    print(f'\n{universities} universities, ' +
+          ', '.join(f'{count} {name}' for name, count in results['collections'].items()))
+    columns = ('cold_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'cold_round_trips', 'round_trips')
+    print(f'{"":45}' + ''.join(f'{column:>17}' for column in columns))
+    for group in ('methods', 'routes'):
+        for name, result in results[group].items():
+            if 'error' in result:
+                print(f'{name[:45]:45} {result["error"]}')
+            else:
+                print(f'{name[:45]:45}' + ''.join(f'{result[column]:>17}' for column in columns))
+            for plan in result.get('plans', []):
+                if plan.get('flags') or 'error' in plan:
+                    print(f'    {plan}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--universities', type=int, nargs='+', default=[1000],
+                        help='scales to run, e.g. 1000 10000 100000')
+    parser.add_argument('--countries', type=int, default=150)
+    parser.add_argument('--reports', type=float, default=2.0, help='mean number of reports per university')
+    parser.add_argument('--repeat', type=int, default=20, help='calls per method after the cold call')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--db', default='gib_benchmark')
+    parser.add_argument('--mongomock', action='store_true',
+                        help='run against the in-memory mongomock instead of a mongod, '
+                             'round trips are not counted and some queries are not supported')
+    parser.add_argument('--cold', action='store_true', help='clear the in-process caches before every call')
+    parser.add_argument('--explain', action='store_true',
+                        help='explain the queries of every method and print the COLLSCANs, '
+                             'high examined to returned ratios and slow queries')
+    parser.add_argument('--json', help='write the results to this file, e.g. to compare runs')
+    args = parser.parse_args(argv)
+
+    round_trips = RoundTrips()
+    monitoring.register(round_trips)
+    if args.mongomock:
+        import mongomock
+        from project import mongo_db
+        server = mongomock.MongoClient()
+        mongo_db.MongoClient = lambda *a, **k: server
+
+    results = {}
+    for universities in args.universities:
+        results[universities] = run(universities, args, round_trips)
+        print_table(universities, results[universities])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
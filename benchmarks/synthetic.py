@@ -0,0 +1,167 @@
+"""
+Seeded synthetic data for the uni, rapporter, world_countries and users collections,
+shaped like the scraped data so every Database method has something realistic to work on.
+"""
+import math
+import random
+
+from bson import ObjectId
+
+from project.report_stats import ACADEMIC, MONEY, RECOMMEND, SOCIAL
+
+SUBJECTS = ['Teknologi', 'Realfag', 'Økonomi og administrasjon', 'Samfunnsvitenskap', 'Humaniora', 'Medisin',
+            'Jus', 'Arkitektur', 'Kunst og design', 'Idrett', 'Lærerutdanning', 'Psykologi', 'Informatikk',
+            'Bioteknologi', 'Marin teknologi', 'Petroleum', 'Språk', 'Historie', 'Musikk', 'Sykepleie']
+WORDS = ['University', 'Technical', 'Institute', 'College', 'School', 'State', 'National', 'Royal',
+         'Polytechnic', 'Academy', 'Business', 'Science', 'Arts', 'Applied', 'Universität', 'Université']
+SYLLABLES = ['an', 'ber', 'co', 'da', 'el', 'for', 'gra', 'ha', 'in', 'jo', 'ka', 'lo', 'ma', 'no', 'ø',
+             'pe', 'ri', 'sa', 'to', 'ul', 've', 'wa', 'yo', 'zu', 'å', 'æ']
+# money key -> (typical answer, spread)
+MONEY_ANSWERS = {'skolepenger': (40000, 1.0), 'boligutgifter': (6000, 0.5), 'ekstra': (60000, 0.8)}
+
+
+def _name(rnd: random.Random, syllables: int) -> str:
+    return ''.join(rnd.choice(SYLLABLES) for _ in range(syllables)).capitalize()
+
+
+def _polygon(rnd: random.Random, x0: float, y0: float, width: float, height: float, points: int) -> list:
+    """closed ring with jittered edges inside the cell, points per edge"""
+    ring = []
+    corners = [(x0, y0), (x0 + width, y0), (x0 + width, y0 + height), (x0, y0 + height)]
+    for (ax, ay), (bx, by) in zip(corners, corners[1:] + corners[:1]):
+        for i in range(points):
+            t = i / points
+            jitter = 0 if i == 0 else rnd.uniform(-0.05, 0.05) * min(width, height)
+            # jitter points inwards so neighbouring countries do not overlap
+            dx, dy = (by - ay, ax - bx)
+            length = math.hypot(dx, dy) or 1
+            ring.append([ax + (bx - ax) * t - abs(jitter) * dx / length,
+                         ay + (by - ay) * t - abs(jitter) * dy / length])
+    ring.append(ring[0])
+    return ring
+
+
+def countries(rnd: random.Random, count: int, points: int = 40) -> list:
+    """
+    count countries on a grid covering the world, a third of them with an island as a MultiPolygon
+    :param points: points per edge of a country polygon
+    """
+    columns = math.ceil(math.sqrt(count * 2))
+    rows = math.ceil(count / columns)
+    width, height = 360 / columns, 160 / rows
+    docs = []
+    names = set()
+    for i in range(count):
+        x0, y0 = -180 + (i % columns) * width, -80 + (i // columns) * height
+        name = _name(rnd, 3)
+        while name in names:
+            name = _name(rnd, 3)
+        names.add(name)
+        main = _polygon(rnd, x0 + width * 0.05, y0 + height * 0.05, width * 0.7, height * 0.9, points)
+        if i % 3 == 0:
+            island = _polygon(rnd, x0 + width * 0.8, y0 + height * 0.1, width * 0.15, height * 0.2, points // 4 or 1)
+            geometry = {'type': 'MultiPolygon', 'coordinates': [[main], [island]]}
+        else:
+            geometry = {'type': 'Polygon', 'coordinates': [main]}
+        docs.append({'_id': ObjectId(), 'type': 'Feature', 'properties': {'name': name}, 'geometry': geometry,
+                     # the cell of the main polygon, used to place the universities
+                     '_cell': (x0 + width * 0.1, y0 + height * 0.1, width * 0.6, height * 0.8)})
+    return docs
+
+
+def _money(rnd: random.Random, key: str) -> str:
+    typical, spread = MONEY_ANSWERS[key]
+    roll = rnd.random()
+    if roll < 0.15:
+        return ''
+    if roll < 0.2:
+        return rnd.choice(['vet ikke', 'ca. 5000', '-'])
+    amount = int(typical * rnd.lognormvariate(0, spread)) // 100 * 100
+    return rnd.choice([f'{amount}', f'{amount:,} kr'.replace(',', ' '), f'{amount},-', f'{amount:_}'])
+
+
+def report(rnd: random.Random) -> dict:
+    doc = {
+        '_id': ObjectId(),
+        RECOMMEND: rnd.choices(['ja', 'nei', ''], [0.8, 0.15, 0.05])[0],
+        SOCIAL: str(rnd.randint(1, 5)),
+        ACADEMIC: str(rnd.randint(1, 5)),
+        'Hva var det beste med oppholdet?': ' '.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(5, 60))),
+    }
+    for key, question in MONEY.items():
+        doc[question] = _money(rnd, key)
+    return doc
+
+
+def generate(universities: int = 1000, countries_count: int = 150, users: int = None, seed: int = 1,
+             mean_reports: float = 2.0, raw_html: int = 2000) -> dict:
+    """
+    :param universities: number of universities
+    :param countries_count: number of countries
+    :param users: number of users, universities // 10 if None
+    :param seed: same seed, same data
+    :param mean_reports: mean number of reports per university, the fan-out is skewed,
+        most universities have none and a few have many
+    :param raw_html: length of the scraped html of every university
+    :return: {'uni': [...], 'rapporter': [...], 'world_countries': [...], 'users': [...]}
+    """
+    rnd = random.Random(seed)
+    country_docs = countries(rnd, countries_count)
+    # a few countries get most of the universities, like the real exchange destinations
+    weights = [1 / (rank + 1) for rank in range(len(country_docs))]
+    cities = {country['properties']['name']: [_name(rnd, 2) for _ in range(rnd.randint(1, 8))]
+              for country in country_docs}
+
+    unis, reports = [], []
+    for i in range(universities):
+        country = rnd.choices(country_docs, weights)[0]
+        x0, y0, width, height = country['_cell']
+        city = rnd.choice(cities[country['properties']['name']])
+        # geometric fan-out with the given mean
+        count = int(math.log(1 - rnd.random()) / math.log(mean_reports / (1 + mean_reports))) if mean_reports else 0
+        uni_reports = [report(rnd) for _ in range(count)]
+        reports += uni_reports
+        uni = {
+            '_id': ObjectId(),
+            'universitet': f'{rnd.choice(WORDS)} {city} {rnd.choice(WORDS)} {i}',
+            'land': country['properties']['name'],
+            'by': city,
+            'Fagområde': rnd.sample(SUBJECTS, rnd.randint(1, 4)),
+            'geometry': {'type': 'Point', 'coordinates': [round(x0 + rnd.random() * width, 6),
+                                                          round(y0 + rnd.random() * height, 6)]},
+            'rapporter': [r['_id'] for r in uni_reports],
+            'rapporter_antall': count,
+            'raw_html': '<html>' + 'x' * raw_html + '</html>',
+        }
+        if rnd.random() < 0.3:
+            uni['star_count'] = int(rnd.paretovariate(1.5))
+        unis.append(uni)
+
+    user_docs = []
+    for i in range(universities // 10 if users is None else users):
+        saved = rnd.sample(unis, min(len(unis), rnd.randint(0, 8)))
+        user_docs.append({
+            '_id': f'student{i}@stud.ntnu.no',
+            'last_modified': '2018-04-01T12:00:00',
+            'my_universities': {str(uni['_id']): {
+                'notes': {'0': {'head': 'Husk', 'note': 'søknadsfrist'}} if rnd.random() < 0.5 else {},
+                'links': {}} for uni in saved},
+        })
+
+    for country in country_docs:
+        del country['_cell']
+    return {'uni': unis, 'rapporter': reports, 'world_countries': country_docs, 'users': user_docs}
+
+
+def load(db, data: dict) -> dict:
+    """
+    Replaces the collections in db with the data
+    :param db: pymongo database
+    :param data: from generate()
+    :return: collection -> number of documents
+    """
+    for name, docs in data.items():
+        db[name].drop()
+        for i in range(0, len(docs), 1000):
+            db[name].insert_many(docs[i:i + 1000])
+    return {name: len(docs) for name, docs in data.items()}
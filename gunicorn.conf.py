@@ -0,0 +1,27 @@
+"""
+Prefork production server, used by the Procfile:
+    gunicorn app:app -c gunicorn.conf.py
+Every worker process imports app.py after the fork and so creates its own Database and mongo
+connection pool, pymongo clients must not be shared across fork(). Keep preload_app off.
+"""
+import multiprocessing
+import os
+
+bind = f'0.0.0.0:{os.environ.get("PORT", "8080")}'
+# one per core, WEB_CONCURRENCY is set by heroku for the dyno size
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# threads per worker, every thread can hold a mongo connection so keep it below MONGO_MAX_POOL_SIZE
+threads = int(os.environ.get('WEB_THREADS', 8))
+worker_class = 'gthread' if threads > 1 else 'sync'
+preload_app = False
+
+# recycle workers after a number of requests, with jitter so they do not restart at the same time
+max_requests = int(os.environ.get('MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER', 500))
+# seconds a request can take before the worker is killed, and a recycled worker gets to finish its requests
+timeout = int(os.environ.get('WORKER_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
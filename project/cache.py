@@ -0,0 +1,213 @@
+"""
+Cache for expensive aggregates, stored in the mongo cache collection.
+
+An entry is fresh while it is younger than its ttl and the versions of the datasets it was
+computed from are unchanged. Write paths bump the dataset versions with Cache.bump.
+Stale entries are still returned while a background thread recomputes them
+(stale-while-revalidate), so only the very first request for a key waits for the computation.
+Computations are single-flight: one per key in a process, and one per key across worker
+processes through a lease document in the cache collection.
+"""
+import datetime
+import os
+import socket
+import threading
+import time
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+
+# datasets that cached values can depend on, bumped by the write paths
+UNIVERSITIES = 'uni'
+# universitet, land, by and Fagområde, the words the search indexes are built from
+NAMES = 'names'
+REPORTS = 'reports'
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs one computation per key at a time in this process,
+    concurrent callers for the same key wait for the result of the running one
+    """
+
+    def __init__(self) -> None:
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, compute):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+        try:
+            call.result = compute()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class Lease:
+    """
+    Lease documents in the cache collection, {_id: 'lease:<key>', owner, expires},
+    so only one worker process computes a key at a time
+    """
+
+    def __init__(self, collection, ttl: int = 5 * 60) -> None:
+        """
+        :param collection: the mongo cache collection
+        :param ttl: seconds before a lease from a crashed worker can be taken over
+        """
+        self.collection = collection
+        self.ttl = ttl
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}'
+
+    def acquire(self, key: str) -> bool:
+        now = datetime.datetime.utcnow()
+        try:
+            # matches an expired lease or inserts a new one, a live lease gives a duplicate _id
+            self.collection.update_one({'_id': f'lease:{key}', 'expires': {'$lt': now}},
+                                       {'$set': {'owner': self.owner,
+                                                 'expires': now + datetime.timedelta(seconds=self.ttl)}},
+                                       upsert=True)
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def release(self, key: str) -> None:
+        self.collection.delete_one({'_id': f'lease:{key}', 'owner': self.owner})
+
+    def held(self, key: str) -> bool:
+        return bool(self.collection.find_one({'_id': f'lease:{key}',
+                                              'expires': {'$gte': datetime.datetime.utcnow()}}, {'_id': 1}))
+
+
+class Cache:
+    VERSIONS_ID = 'dataset_versions'
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, collection, default_ttl: int = 24 * 60 * 60) -> None:
+        """
+        :param collection: the mongo cache collection
+        :param default_ttl: seconds before an entry is refreshed even if no dataset changed
+        """
+        self.collection = collection
+        self.default_ttl = default_ttl
+        self._flight = SingleFlight()
+        self._lease = Lease(collection)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def versions(self) -> dict:
+        doc = self.collection.find_one({'_id': self.VERSIONS_ID}) or {}
+        return doc.get('versions', {})
+
+    def bump(self, *datasets) -> None:
+        """Marks every entry computed from any of the datasets as stale"""
+        self.collection.update_one({'_id': self.VERSIONS_ID},
+                                   {'$inc': {f'versions.{dataset}': 1 for dataset in datasets}},
+                                   upsert=True)
+
+    def set(self, key: str, value, ttl: int = None, versions: dict = None) -> None:
+        now = datetime.datetime.utcnow()
+        self.collection.replace_one({'_id': key}, {
+            '_id': key,
+            'value': value,
+            'created': now,
+            'expires': now + datetime.timedelta(seconds=ttl or self.default_ttl),
+            'versions': versions or {},
+        }, upsert=True)
+
+    def delete(self, key: str) -> None:
+        self.collection.delete_one({'_id': key})
+
+    def stats(self) -> dict:
+        """stale hits are counted as hits too"""
+        return {'hits': self.hits + self.stale_hits, 'stale_hits': self.stale_hits, 'misses': self.misses}
+
+    def get_or_compute(self, key: str, compute, datasets=(), ttl: int = None):
+        """
+        Returns the cached value for key, computing it if there is none.
+        A stale value is returned as is and refreshed in the background
+        :param key: _id of the entry
+        :param compute: callable returning the value, must be storable in mongo
+        :param datasets: datasets the value is computed from
+        :param ttl: seconds the entry is fresh, default_ttl if None
+        :return: the value
+        """
+        # the entry and the dataset versions in one round trip
+        docs = {doc['_id']: doc for doc in self.collection.find({'_id': {'$in': [key, self.VERSIONS_ID]}})}
+        versions = docs.get(self.VERSIONS_ID, {}).get('versions', {})
+        versions = {dataset: versions.get(dataset, 0) for dataset in datasets}
+        entry = docs.get(key)
+        if not entry or 'value' not in entry:
+            self.misses += 1
+            return self._compute(key, compute, ttl, versions)
+        if entry.get('versions') != versions or entry['expires'] <= datetime.datetime.utcnow():
+            self.stale_hits += 1
+            self._refresh_in_background(key, compute, ttl, versions)
+        else:
+            self.hits += 1
+        return entry['value']
+
+    def _compute(self, key, compute, ttl, versions):
+        """computes a missing entry, once per key across threads and worker processes"""
+        def compute_once():
+            while True:
+                if self._lease.acquire(key):
+                    try:
+                        value = compute()
+                        self.set(key, value, ttl, versions)
+                        return value
+                    finally:
+                        self._lease.release(key)
+                # another worker is computing it, wait for its result or for the lease to go away
+                while True:
+                    entry = self.collection.find_one({'_id': key})
+                    if entry and 'value' in entry:
+                        return entry['value']
+                    if not self._lease.held(key):
+                        break
+                    time.sleep(self.POLL_INTERVAL)
+
+        return self._flight.do(key, compute_once)
+
+    def _refresh_in_background(self, key, compute, ttl, versions) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                # skipped if another worker is already refreshing it
+                if self._lease.acquire(key):
+                    try:
+                        self.set(key, compute(), ttl, versions)
+                    finally:
+                        self._lease.release(key)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name=f'cache-refresh-{key}', daemon=True).start()
@@ -0,0 +1,57 @@
+import json
+
+from apistar import Command
+
+from project.mongo_db import Database
+
+
+def rebuild_report_stats(db: Database):
+    """
+    Recomputes the materialized report aggregates for every university,
+    run after importing reports outside of the api
+    """
+    count = db.rebuild_report_stats()
+    return f'rebuilt report stats for {count} universities'
+
+
+def move_cold_fields(db: Database):
+    """
+    Moves raw_html and the other cold scraped fields out of the university documents,
+    run after scraping
+    """
+    count = db.move_cold_fields()
+    return f'moved cold fields of {count} universities'
+
+
+def assign_countries(db: Database):
+    """
+    Stores the country of every university, run after scraping or changing world_countries
+    """
+    count = db.assign_countries()
+    return f'assigned a country to {count} universities'
+
+
+def update_weather(db: Database):
+    """
+    Updates the weather today for every university, e.g. from a daily cron job
+    """
+    count = db.refresh_weather()
+    return f'updated weather for {count} universities'
+
+
+def indexes(db: Database):
+    """
+    Creates the missing indexes and lists the missing, unregistered and unused ones
+    """
+    created = db.ensure_indexes()
+    report = db.index_report()
+    return json.dumps({**created, **report}, indent=2)
+
+
+commands = [
+    Command('rebuild_report_stats', rebuild_report_stats),
+    Command('move_cold_fields', move_cold_fields),
+    Command('assign_countries', assign_countries),
+    Command('update_weather', update_weather),
+    Command('indexes', indexes),
+]
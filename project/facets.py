@@ -0,0 +1,190 @@
+"""
+Faceted search over the universities with an in-memory bitmap index.
+Every facet value and every minimum of a number field has a bitmap, a python int
+with bit n set for university n, so filters and facet counts are a few and/or/popcounts.
+"""
+import bisect
+import threading
+
+from project.search_index import fold
+
+
+def popcount(bits: int) -> int:
+    return bin(bits).count('1')
+
+
+class NumberIndex:
+    """Bitmaps of the universities with a value >= every distinct value of a number field"""
+
+    def __init__(self, values: list) -> None:
+        """
+        :param values: value of every university, None counts as 0
+        """
+        values = [value or 0 for value in values]
+        self._thresholds = sorted(set(values))
+        by_value = {}
+        for doc, value in enumerate(values):
+            by_value[value] = by_value.get(value, 0) | 1 << doc
+        self._at_least = []
+        bits = 0
+        for value in reversed(self._thresholds):
+            bits |= by_value[value]
+            self._at_least.append(bits)
+        self._at_least.reverse()
+
+    def at_least(self, minimum) -> int:
+        i = bisect.bisect_left(self._thresholds, minimum)
+        return self._at_least[i] if i < len(self._at_least) else 0
+
+    def update(self, doc: int, old, new) -> None:
+        """moves doc from value old to new"""
+        old, new = old or 0, new or 0
+        i = bisect.bisect_left(self._thresholds, new)
+        if i == len(self._thresholds) or self._thresholds[i] != new:
+            self._thresholds.insert(i, new)
+            self._at_least.insert(i, self._at_least[i] if i < len(self._at_least) else 0)
+        bit = 1 << doc
+        # only the thresholds in (lower, higher] change
+        lower, higher = sorted((old, new))
+        for j in range(bisect.bisect_right(self._thresholds, lower), bisect.bisect_right(self._thresholds, higher)):
+            self._at_least[j] = self._at_least[j] | bit if new > old else self._at_least[j] & ~bit
+
+
+class FacetIndex:
+    """
+    Filters on Fagområde, land and by (any of the given values, matched folded),
+    minimum rapporter_antall and star_count, all combined with and.
+    Facet counts of a dimension ignore the filter on that dimension, so the other values can still be picked.
+    Star counts are updated in place by set_stars, the other fields need a new index
+    """
+    DIMENSIONS = ('Fagområde', 'land', 'by')
+    MINIMUMS = {'min_reports': 'rapporter_antall', 'min_stars': 'star_count'}
+    # sort name -> (field, descending)
+    SORTS = {
+        'rapporter_antall': ('rapporter_antall', True),
+        'star_count': ('star_count', True),
+        'universitet': ('universitet', False),
+    }
+
+    def __init__(self, unis, version=None) -> None:
+        """
+        :param unis: universities with universitet, geometry, rapporter_antall, star_count and DIMENSIONS
+        :param version: version of the university data the index was built from
+        """
+        self.version = version
+        unis = list(unis)
+        self.all = (1 << len(unis)) - 1
+        self._lock = threading.Lock()
+        self._docs = {str(uni['_id']): doc for doc, uni in enumerate(unis)}
+        self._features = []
+        self._facets = {dimension: {} for dimension in self.DIMENSIONS}  # folded value -> bitmap
+        self._names = {dimension: {} for dimension in self.DIMENSIONS}  # folded value -> value shown
+        for doc, uni in enumerate(unis):
+            self._features.append({
+                'type': 'Feature',
+                'properties': {
+                    'university': uni.get('universitet'),
+                    '_id': str(uni['_id']),
+                    'rapporter_antall': uni.get('rapporter_antall'),
+                    'star_count': uni.get('star_count', 0),
+                },
+                'geometry': uni.get('geometry'),
+            })
+            for dimension in self.DIMENSIONS:
+                values = uni.get(dimension)
+                for value in values if isinstance(values, list) else [values]:
+                    folded = fold(value)
+                    if folded:
+                        self._facets[dimension][folded] = self._facets[dimension].get(folded, 0) | 1 << doc
+                        self._names[dimension].setdefault(folded, value)
+        self._numbers = {name: NumberIndex([uni.get(field) for uni in unis]) for name, field in self.MINIMUMS.items()}
+        self._orders = {}  # sort -> (sort keys, docs) in sorted order
+        for sort, (field, descending) in self.SORTS.items():
+            keyed = sorted((self._sort_key(uni.get(field), descending, self._features[doc]['properties']['_id']), doc)
+                           for doc, uni in enumerate(unis))
+            self._orders[sort] = ([key for key, _ in keyed], [doc for _, doc in keyed])
+
+    @staticmethod
+    def _sort_key(value, descending: bool, uni_id: str) -> list:
+        if descending:
+            return [-(value or 0), uni_id]
+        return [fold(value), uni_id]
+
+    def set_stars(self, uni_id: str, star_count: int) -> None:
+        """
+        Updates the star_count of a university without rebuilding the index
+        :param uni_id: str, hex
+        :param star_count: the new star_count
+        """
+        doc = self._docs.get(uni_id)
+        if doc is None:
+            return
+        with self._lock:
+            feature = self._features[doc]
+            old = feature['properties']['star_count']
+            # a new feature, the old one may be in a response being serialized
+            self._features[doc] = {**feature, 'properties': {**feature['properties'], 'star_count': star_count}}
+            self._numbers['min_stars'].update(doc, old, star_count)
+            keys, docs = self._orders['star_count']
+            i = bisect.bisect_left(keys, self._sort_key(old, True, uni_id))
+            del keys[i], docs[i]
+            key = self._sort_key(star_count, True, uni_id)
+            i = bisect.bisect_left(keys, key)
+            keys.insert(i, key)
+            docs.insert(i, doc)
+
+    def _dimension_bits(self, dimension: str, values: list):
+        """bitmap of the universities with any of values, None if there is no filter on the dimension"""
+        if not values:
+            return None
+        bits = 0
+        for value in values:
+            bits |= self._facets[dimension].get(fold(value), 0)
+        return bits
+
+    def search(self, filters: dict, sort: str = 'rapporter_antall', limit: int = 50, after: list = None) -> dict:
+        """
+        :param filters: dimension -> list of values, and min_reports / min_stars -> int
+        :param sort: one of SORTS
+        :param limit: max number of results
+        :param after: sort key of the last result on the previous page, from 'next'
+        :return: {'features': list of geojson features, 'facets': {dimension: [{'value', 'count'}]},
+                  'total': number of matches, 'next': sort key of the last result or None on the last page}
+        """
+        with self._lock:
+            return self._search(filters, sort, limit, after)
+
+    def _search(self, filters: dict, sort: str, limit: int, after: list) -> dict:
+        base = self.all
+        for name, numbers in self._numbers.items():
+            if filters.get(name):
+                base &= numbers.at_least(filters[name])
+        selected = {dimension: self._dimension_bits(dimension, filters.get(dimension))
+                    for dimension in self.DIMENSIONS}
+        matches = base
+        for bits in selected.values():
+            if bits is not None:
+                matches &= bits
+
+        facets = {}
+        for dimension in self.DIMENSIONS:
+            others = base
+            for other, bits in selected.items():
+                if other != dimension and bits is not None:
+                    others &= bits
+            counts = [(popcount(bits & others), folded) for folded, bits in self._facets[dimension].items()]
+            facets[dimension] = [{'value': self._names[dimension][folded], 'count': count}
+                                 for count, folded in sorted(counts, key=lambda c: (-c[0], c[1])) if count]
+
+        keys, docs = self._orders[sort]
+        start = bisect.bisect_right(keys, after) if after else 0
+        features = []
+        next_key = None
+        for i in range(start, len(docs)):
+            if matches >> docs[i] & 1:
+                if len(features) == limit:
+                    next_key = keys[last]
+                    break
+                features.append(self._features[docs[i]])
+                last = i
+        return {'features': features, 'facets': facets, 'total': popcount(matches), 'next': next_key}
@@ -0,0 +1,101 @@
+import threading
+import time
+
+from pymongo import monitoring
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for the mongo connection.
+    closed: calls go through, open: calls fail fast,
+    half_open: the reset timeout has passed and one trial call is let through.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 10.0) -> None:
+        """
+        :param failure_threshold: consecutive failures before the circuit opens
+        :param reset_timeout: seconds the circuit stays open before a trial call is allowed
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """
+        Returns True if a call to mongo should be attempted
+        :return: Bool
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                # let one trial call through, the next ones wait for its result
+                self._state = self.HALF_OPEN
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._open()
+
+    def trip(self) -> None:
+        """Opens the circuit right away"""
+        with self._lock:
+            self._open()
+
+    def _open(self) -> None:
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+
+
+class MongoHealth(monitoring.ServerHeartbeatListener):
+    """
+    Shared health state for mongo. pymongo already checks the server in a
+    background thread (every heartbeatFrequencyMS), this listener feeds those
+    heartbeats into a circuit breaker so no request has to pay for a ping.
+    """
+
+    def __init__(self, breaker: CircuitBreaker = None) -> None:
+        self.breaker = breaker or CircuitBreaker()
+        self.last_heartbeat = None
+
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        self.last_heartbeat = time.time()
+        self.breaker.record_success()
+
+    def failed(self, event) -> None:
+        # pymongo has already retried the check once when this is called
+        self.breaker.trip()
+
+    def is_available(self) -> bool:
+        return self.breaker.allow()
+
+    def record_success(self) -> None:
+        self.breaker.record_success()
+
+    def record_failure(self) -> None:
+        self.breaker.record_failure()
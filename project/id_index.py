@@ -0,0 +1,53 @@
+import threading
+import time
+
+
+class UniversityIdIndex:
+    """
+    Hashed set of every university id (as str) so existence checks do not need mongo.
+    Loaded on start and reloaded by a background thread every refresh_interval seconds.
+    The api never creates or deletes universities, they come from the scraper,
+    so a new or deleted university is seen by every worker within refresh_interval.
+    """
+
+    def __init__(self, load, refresh_interval: float = 60.0) -> None:
+        """
+        :param load: callable returning an iterable of every university id
+        :param refresh_interval: seconds between reloads, 0 disables the background thread
+        """
+        self._load = load
+        self.refresh_interval = refresh_interval
+        self._ids = None
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self) -> None:
+        """Starts the thread that loads and refreshes the index, does not block on mongo"""
+        if self.refresh_interval and not self._thread:
+            self._thread = threading.Thread(target=self._refresh_forever, name='uni-id-index', daemon=True)
+            self._thread.start()
+
+    def refresh(self) -> None:
+        ids = frozenset(str(i) for i in self._load())
+        with self._lock:
+            self._ids = ids
+            self.loaded_at = time.time()
+
+    def _refresh_forever(self) -> None:
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                pass  # keep serving the last loaded ids, or load on first lookup
+            time.sleep(self.refresh_interval)
+
+    def __contains__(self, uni_id) -> bool:
+        ids = self._ids
+        if ids is None:
+            self.refresh()
+            ids = self._ids
+        return uni_id in ids
+
+    def __len__(self) -> int:
+        return len(self._ids or ())
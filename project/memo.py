@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from apistar.http import Response
+
+
+class LRUCache:
+    """
+    Bounded in-process cache with least recently used eviction.
+    Entries are tagged with the datasets they were read from so writes can invalidate them.
+    Invalidation only reaches the cache of the process that wrote: with several gunicorn workers
+    the other workers keep serving their entry until it expires, so a write can take up to
+    ttl seconds to show up everywhere. Structures that must be current across workers check
+    the dataset versions in the mongo cache collection instead (Database._rebuild_if_changed).
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 60.0) -> None:
+        """
+        :param maxsize: max number of entries
+        :param ttl: seconds an entry is used
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires, tags, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: (True, value) on a hit, (False, None) on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[2]
+
+    def set(self, key, value, tags=()) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, frozenset(tags), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *tags) -> None:
+        """drops every entry tagged with any of the tags"""
+        tags = set(tags)
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[1] & tags]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+
+def memoize(*tags):
+    """
+    Decorator that caches the result of a Database method in self._memo,
+    keyed by method and arguments. 503/404 Responses are not cached.
+    The cached object is shared, callers must not mutate it
+    :param tags: datasets the method reads from
+    """
+    def decorator(funk):
+        @wraps(funk)
+        def wrapper(self, *args, **kwargs):
+            key = (funk.__name__, args, tuple(sorted(kwargs.items())))
+            found, value = self._memo.get(key)
+            if found:
+                return value
+            value = funk(self, *args, **kwargs)
+            if not isinstance(value, Response):
+                self._memo.set(key, value, tags)
+            return value
+        return wrapper
+    return decorator
+
+
+def invalidates(*tags):
+    """
+    Decorator for Database methods that write, drops the memoized results of the datasets in this process,
+    the other worker processes see the write when their entries expire, see LRUCache
+    :param tags: datasets the method writes to
+    """
+    def decorator(funk):
+        @wraps(funk)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return funk(self, *args, **kwargs)
+            finally:
+                self._memo.invalidate(*tags)
+        return wrapper
+    return decorator
@@ -0,0 +1,151 @@
+"""
+Process wide metrics in the Prometheus text format, served by /metrics.
+Views are timed by the measured decorator, mongo commands by MongoMetrics,
+a pymongo command listener given to the MongoClient.
+"""
+import threading
+import time
+from functools import wraps
+
+from apistar.http import Response
+from pymongo import monitoring
+
+# seconds, the Prometheus client defaults
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Counts of observations per bucket, with the sum and count of every label set"""
+
+    def __init__(self, name: str, help_text: str, labels: tuple, buckets: tuple = BUCKETS) -> None:
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self._series.items())
+        for label_values, (counts, total, count) in series:
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name: str, help_text: str, labels: tuple) -> None:
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        lines += [f'{self.name}{{{_labels(self.labels, key)}}} {value}' for key, value in values]
+        return lines
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+REQUEST_SECONDS = Histogram('gib_request_duration_seconds', 'Latency of the views', ('route', 'status'))
+MONGO_SECONDS = Histogram('gib_mongo_command_duration_seconds', 'Latency of the mongo commands',
+                          ('collection', 'command'))
+MONGO_COMMANDS = Counter('gib_mongo_commands_total', 'Mongo commands', ('collection', 'command', 'outcome'))
+
+
+def measured(func):
+    """
+    Decorator that records the latency and status of the view in REQUEST_SECONDS
+    :param func: the view function to be called
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        status = 500
+        try:
+            data = func(*args, **kwargs)
+            status = data.status if isinstance(data, Response) else 200
+            return data
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, func.__name__, status)
+    return wrapper
+
+
+class MongoMetrics(monitoring.CommandListener):
+    """Counts and times every mongo command by collection and command name"""
+
+    def __init__(self) -> None:
+        self._collections = {}  # (request_id, connection) -> collection, the collection is only in started
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        with self._lock:
+            self._collections[event.request_id, event.connection_id] = \
+                collection if isinstance(collection, str) else ''
+
+    def _finished(self, event, outcome: str) -> None:
+        with self._lock:
+            collection = self._collections.pop((event.request_id, event.connection_id), '')
+        MONGO_COMMANDS.inc(collection, event.command_name, outcome)
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, collection, event.command_name)
+
+    def succeeded(self, event):
+        self._finished(event, 'succeeded')
+
+    def failed(self, event):
+        self._finished(event, 'failed')
+
+
+def _gauges(name: str, help_text: str, labels: tuple, values: dict) -> list:
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+    lines += [f'{name}{{{_labels(labels, key)}}} {value}' for key, value in sorted(values.items())]
+    return lines
+
+
+def render(caches: dict) -> str:
+    """
+    :param caches: cache name -> {'hits': int, 'misses': int, ...} from the stats() of the caches
+    :return: every metric in the Prometheus text format
+    """
+    lines = REQUEST_SECONDS.render() + MONGO_SECONDS.render() + MONGO_COMMANDS.render()
+    for stat in ('hits', 'misses'):
+        lines += [f'# HELP gib_cache_{stat}_total Cache {stat}', f'# TYPE gib_cache_{stat}_total counter']
+        lines += [f'gib_cache_{stat}_total{{{_labels(("cache",), (cache,))}}} {stats.get(stat, 0)}'
+                  for cache, stats in sorted(caches.items())]
+    lines += _gauges('gib_cache_entries', 'Entries in the in-process caches', ('cache',),
+                     {(cache,): stats['size'] for cache, stats in caches.items() if 'size' in stats})
+    return '\n'.join(lines) + '\n'
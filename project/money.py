@@ -0,0 +1,130 @@
+"""
+Cost statistics from the money answers of the reports, computed for every university
+and country at once with NumPy.
+"""
+import numpy as np
+
+# answers outside (lower, upper) are treated as typos and left out, overridden by MONEY_LIMITS in settings
+DEFAULT_LIMITS = {
+    'skolepenger': (0, 300000),
+    'boligutgifter': (0, 15001),
+    'ekstra': (0, 500000),
+}
+
+# answers with more digits are not amounts, and would not fit in an int64
+MAX_DIGITS = 12
+
+_NOISE = ('kr', 'KR', 'Kr', ',-', '_', ' ', '\xa0', '\t', '\n')
+
+
+def parse_amounts(answers) -> np.ndarray:
+    """
+    Parses answers like '12 000 kr' or '12_000' in one go
+    :param answers: iterable of answers
+    :return: float array, nan where the answer is not a whole amount of at most MAX_DIGITS digits
+    """
+    text = np.array([answer if isinstance(answer, str) else '' for answer in answers], dtype=str)
+    if not text.size:
+        return np.empty(0)
+    for noise in _NOISE:
+        text = np.char.replace(text, noise, '')
+    amounts = np.full(text.shape, np.nan)
+    valid = np.char.isdecimal(text) & (np.char.str_len(text) <= MAX_DIGITS)
+    amounts[valid] = text[valid].astype(np.int64)
+    return amounts
+
+
+def grouped_stats(groups: np.ndarray, values: np.ndarray, group_count: int, limits: tuple) -> dict:
+    """
+    mean, median, p25, p75 and count of values for every group, without a python loop over groups
+    :param groups: int array, the group of every value
+    :param values: float array
+    :param group_count: number of groups
+    :param limits: (lower, upper), values outside are left out
+    :return: dict of arrays indexed by group, plus 'values' and 'start' to slice the sorted values of a group
+    """
+    lower, upper = limits
+    keep = (values > lower) & (values < upper)
+    groups, values = groups[keep], values[keep]
+    order = np.lexsort((values, groups))
+    groups, values = groups[order], values[order]
+    count = np.bincount(groups, minlength=group_count)
+    total = np.bincount(groups, weights=values, minlength=group_count)
+    start = np.concatenate(([0], np.cumsum(count)[:-1])).astype(np.int64)
+    has_values = count > 0
+
+    def percentile(p):
+        # linear interpolation between the closest ranks, as np.percentile does
+        result = np.full(group_count, np.nan)
+        if not values.size:
+            return result
+        position = start + (count - 1) * p
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        low, high = low[has_values], high[has_values]
+        result[has_values] = values[low] + (values[high] - values[low]) * (position[has_values] - low)
+        return result
+
+    mean = np.full(group_count, np.nan)
+    mean[has_values] = total[has_values] / count[has_values]
+    return {
+        'count': count,
+        'mean': mean,
+        'median': percentile(0.5),
+        'p25': percentile(0.25),
+        'p75': percentile(0.75),
+        'values': values,
+        'start': start,
+    }
+
+
+def _number(value):
+    return None if np.isnan(value) else round(float(value), 2)
+
+
+def _summary(stats: dict, group: int) -> dict:
+    return {
+        'count': int(stats['count'][group]),
+        'mean': _number(stats['mean'][group]),
+        'median': _number(stats['median'][group]),
+        'p25': _number(stats['p25'][group]),
+        'p75': _number(stats['p75'][group]),
+    }
+
+
+def money_statistics(unis, limits: dict = None) -> dict:
+    """
+    :param unis: universities with _id, universitet, land and money from report_stats,
+        money is {'skolepenger': {'samples': {report_id: amount}}, ...}
+    :param limits: money key -> (lower, upper), DEFAULT_LIMITS if None
+    :return: {'unis': [...], 'countries': [...]} with money_stats for every university and country
+    """
+    limits = {**DEFAULT_LIMITS, **(limits or {})}
+    unis = list(unis)
+    countries = sorted({uni.get('land') or '' for uni in unis})
+    country_of = {country: i for i, country in enumerate(countries)}
+    uni_country = np.array([country_of[uni.get('land') or ''] for uni in unis], dtype=np.int64)
+
+    for uni in unis:
+        uni['_id'] = str(uni['_id'])
+        uni['money_stats'] = {}
+    country_stats = [{'land': country, 'money_stats': {}} for country in countries]
+
+    for key, key_limits in limits.items():
+        samples = [list(((uni.get('money') or {}).get(key) or {}).get('samples', {}).values()) for uni in unis]
+        groups = np.repeat(np.arange(len(unis), dtype=np.int64), [len(s) for s in samples])
+        values = np.array([v for s in samples for v in s], dtype=float)
+        per_uni = grouped_stats(groups, values, len(unis), key_limits)
+        per_country = grouped_stats(uni_country[groups], values, len(countries), key_limits)
+        for i, uni in enumerate(unis):
+            summary = _summary(per_uni, i)
+            start, count = per_uni['start'][i], per_uni['count'][i]
+            uni['money_stats'][key] = int(summary['mean']) if summary['mean'] is not None else None
+            uni['money_stats'][f'{key}_liste'] = [int(v) for v in per_uni['values'][start:start + count]]
+            uni['money_stats'][f'{key}_stats'] = summary
+        for i, country in enumerate(country_stats):
+            country['money_stats'][key] = _summary(per_country, i)
+
+    for uni in unis:
+        uni.pop('money', None)
+    return {'unis': unis, 'countries': country_stats}
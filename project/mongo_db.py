@@ -1,29 +1,148 @@
+import base64
 import datetime
+import json
+import logging
+import re
+import threading
+import time
+from functools import wraps
 
 from apistar import Component
 from apistar.http import Response
 from apistar.types import Settings
 from bson import ObjectId
-from pymongo import MongoClient
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, TEXT, IndexModel, MongoClient, UpdateOne
 from pymongo.collection import ReturnDocument
-from weather import Weather, Unit
+from pymongo.errors import ConnectionFailure, OperationFailure
 
-from pprint import pprint as pp
+from project.health import MongoHealth
+from project.cache import NAMES, REPORTS, UNIVERSITIES, Cache, Lease
+from project.facets import FacetIndex
+from project.id_index import UniversityIdIndex
+from project.memo import LRUCache, invalidates, memoize
+from project.metrics import MongoMetrics
+from project.money import money_statistics
+from project.query_plans import MAX_RATIO, SLOW_MS, QueryCapture, explain
+from project.payloads import EncodedPayload
+from project.search_index import AutocompleteIndex, SubjectVocabulary, fold
+from project.spatial import CountryIndex
+from project.top_k import TopK
+from project.weather_job import WeatherJob, WeatherProvider, YahooWeatherProvider
+from project.report_stats import REPORT_FIELDS, combine, mean, rebuild_documents, stats_update
+
+logger = logging.getLogger(__name__)
+
+# scraped fields that are rarely read, stored in the <uni_coll>_raw collection keyed by university id
+COLD_FIELDS = ('raw_html',)
+# projection that keeps the cold fields out of hot queries, also before the migration is run
+LEAN = {field: 0 for field in COLD_FIELDS}
+
+# seconds before the search indexes are rebuilt even if no names changed, picks up the rapporter_antall ranking
+SEARCH_MAX_AGE = 6 * 60 * 60
+# seconds before the facet index is rebuilt, picks up the stars given through other worker processes
+FACETS_MAX_AGE = 5 * 60
+
+# every index the Database methods rely on, by the Database attribute of the collection.
+# init_database creates the missing ones, Database.index_report lists missing and unused indexes
+INDEXES = {
+    '_uni': [
+        # search_by_all
+        IndexModel([('universitet', TEXT), ('land', TEXT), ('by', TEXT)], name='search_text', background=True),
+        # $geoNear in _set_distance_from_ntnu_to_uni
+        IndexModel([('geometry', GEOSPHERE)], name='geometry_2dsphere', background=True),
+        # get_country_list
+        IndexModel([('country_id', ASCENDING), ('rapporter_antall', DESCENDING)], name='country_reports',
+                   background=True),
+        # list_all_uni and get_university_and_score
+        IndexModel([('rapporter_antall', DESCENDING)], name='reports_desc', background=True),
+        # get_top_stared_universities
+        IndexModel([('star_count', DESCENDING)], name='stars_desc', background=True),
+        # update_report finds the university of a report
+        IndexModel([('rapporter', ASCENDING)], name='rapporter', background=True),
+    ],
+    # only queried by _id, listed so index_report covers them
+    '_uni_raw': [],
+    '_country': [],
+    '_country_names': [],
+    '_reports': [],
+    '_report_stats': [],
+    '_users': [],
+}
+
+
+def _find_index(model: IndexModel, existing: dict):
+    """
+    :param existing: from collection.index_information()
+    :return: name of the existing index with the keys of model, None if it is missing
+    """
+    document = model.document
+    if document['name'] in existing:
+        return document['name']
+    keys = list(document['key'].items())
+    for name, info in existing.items():
+        if any(direction == TEXT for _, direction in keys):
+            # text indexes are stored as _fts/_ftsx with the fields as weights
+            if info['key'][0][0] == '_fts' and set(info.get('weights', {})) == {field for field, _ in keys}:
+                return name
+        elif info['key'] == keys:
+            return name
+    return None
+
+
+def _invalid_answers(answers):
+    """400 Response if answers is not a dict of question -> str that can be stored in mongo, else None"""
+    if not isinstance(answers, dict) or not answers:
+        return Response({'reason': 'The body must be a json object of question -> answer'}, status=400)
+    for question, answer in answers.items():
+        if question == '_id' or question.startswith('$') or '.' in question or not isinstance(answer, str):
+            return Response({'reason': f'Invalid answer to {question}'}, status=400)
+    return None
+
+
+def _is_cart_key(key) -> bool:
+    """university, note and link ids are used in paths into the user, never a path or operator themselves"""
+    return bool(key) and re.fullmatch(r'\w+', key) is not None
+
+
+def fail_fast(funk):
+    """
+    Decorator that first checks the shared mongo health state, if the circuit is open return 503
+    instead of waiting for the server selection timeout
+    :param funk: the function to decorate
+    :return: the result of funk or 503 if no connection to mongo
+    """
+
+    @wraps(funk)
+    def wrapper(self, *args, **kwargs):
+        if not self._health.is_available():
+            return Response({'reason': 'Database is down'}, status=503)
+        try:
+            q = funk(self, *args, **kwargs)
+        except ConnectionFailure:
+            self._health.record_failure()
+            return Response({'reason': 'Database is down'}, status=503)
+        self._health.record_success()
+        return q
+
+    return wrapper
 
 
 def serialize_object_id(funk):
     """
-    Decorator that first checks if connected to mongo, if not return 503 else transforms
-    ObjectIds to str because json can NOT serialize ObjectIds,
+    Decorator that fails fast like fail_fast, else
+    transforms ObjectIds to str because json can NOT serialize ObjectIds,
     :param funk: the function to decorate
     :return: query with converted _id or 503 if no connection to mongo
     """
 
+    @wraps(funk)
+    @fail_fast
     def wrapper(self, *args, **kwargs):
         """python magic"""
-        if not self.ping():
-            return Response({'reason': 'Database is down'}, status=503)
         q = funk(self, *args, **kwargs)
+        if isinstance(q, Response):
+            return q
         qq = []
         if isinstance(q, dict):
             q['_id'] = str(q['_id'])
@@ -34,8 +153,6 @@ def serialize_object_id(funk):
                 doc['_id'] = str(doc['_id'])
                 if doc.get('scraped'):
                     doc['scraped'] = str(doc['scraped'])
-                if doc.get('raw_html'):
-                    del doc['raw_html']
                 if doc.get('rapporter'):
                     doc['rapporter'] = [str(i) for i in doc['rapporter']]
                 if doc.get('properties'):
@@ -51,22 +168,49 @@ class Database(Component):
     """
 
     def __init__(self, uri: str, db: str, uni_coll: str, country_coll: str, reports_coll: str,
-                 users_coll: str) -> None:
+                 users_coll: str, money_limits: dict = None, weather_provider: WeatherProvider = None,
+                 client_options: dict = None) -> None:
         """
         Creates connections to the database
         :param uri:  Uri for mongodb e.g "mongodb://localhost:27017/gib"
         :param db: the database in mongodb, e.g. 'gib'
         :param uni_coll: the university collection in the database, e.g. 'uni'
         :param country_coll: the country collection in the database, e.g. 'world_countries'
+        :param money_limits: money key -> (lower, upper), answers outside are left out of the money stats
+        :param weather_provider: where update_weather gets the forecasts, YahooWeatherProvider if None
+        :param client_options: MongoClient keyword arguments, e.g. maxPoolSize and the timeouts
         """
         super().__init__(Database)
-        self._mongo = MongoClient(uri)
+        # fed by pymongo's background heartbeats, used instead of a ping per query
+        self._health = MongoHealth()
+        # only records inside explain()
+        self._queries = QueryCapture()
+        # connect=False, the connection pool is opened by the first query and not before a fork
+        self._mongo = MongoClient(uri, connect=False, event_listeners=[self._health, MongoMetrics(), self._queries],
+                                  **(client_options or {}))
         self._db = self._mongo[db]
         self._uni = self._db[uni_coll]
+        self._uni_raw = self._db[f'{uni_coll}_raw']
         self._country = self._db[country_coll]
+        self._country_names = self._db['country_names']
         self._reports = self._db[reports_coll]
         self._users = self._db[users_coll]
-        self._cache = self._db['cache']
+        self._cache = Cache(self._db['cache'])
+        # almost static read results, bounded and invalidated by the write methods
+        self._memo = LRUCache()
+        # structures built from every university: encoded payloads and search indexes
+        self._derived = {}
+        self._rebuilding = set()
+        self._rebuild_lock = threading.Lock()
+        self._report_stats = self._db['report_stats']
+        self._money_limits = money_limits
+        self._weather_provider = weather_provider
+        self._weather_lease = Lease(self._cache.collection, ttl=30 * 60)
+        self._bootstrap_lease = Lease(self._cache.collection, ttl=30 * 60)
+        # every university id in memory, used to validate ids without a round trip
+        self._uni_ids = UniversityIdIndex(lambda: self._uni.distinct('_id'))
+        self._uni_ids.start()
+        self._top_stars = TopK(self._most_stared, 'star_count')
 
     def ping(self) -> bool:
         """
@@ -75,8 +219,10 @@ class Database(Component):
         """
         try:
             self._db.command('ping')  # this method will timeout if no connection found
+            self._health.record_success()
             return True
         except:
+            self._health.record_failure()
             return False
 
     @serialize_object_id
@@ -86,18 +232,17 @@ class Database(Component):
         :param uni_id: string, hex
         :return: dict
         """
-        q = self._uni.find_one({'_id': ObjectId(uni_id)})
+        if uni_id not in self._uni_ids:
+            return Response({'reason': 'University not found'}, status=404)
+        q = self._uni.find_one({'_id': ObjectId(uni_id)}, LEAN)
+        stats = self._report_stats.find_one({'_id': q['_id']}, {'recommend': 1}) or {}
         q['rating'] = {
-            'positive': 0,
-            'negative': 0
+            'positive': stats.get('recommend', {}).get('ja', 0),
+            'negative': stats.get('recommend', {}).get('nei', 0)
         }
-        reports = self.get_reports_for_university(uni_id)
-        for report in reports:
-            q['rating']['positive'] += 1 if report['Vil du anbefale andre å reise til studiestedet?'] == 'ja' else 0
-            q['rating']['negative'] += 1 if report['Vil du anbefale andre å reise til studiestedet?'] == 'nei' else 0
-
         return q
 
+    @memoize(UNIVERSITIES)
     @serialize_object_id
     def get_university_geojson_by_id(self, uni_id) -> list:
         q = list(self._uni.aggregate([{'$match': {'_id': ObjectId(uni_id)}},
@@ -109,12 +254,17 @@ class Database(Component):
                                       }}]))
         return q
 
-    @serialize_object_id
+    @memoize(UNIVERSITIES)
     def list_all_uni(self) -> list:
         """
         returns queries with id and key e.g key=universitet
         :return:  Cursor
         """
+        return self._list_all_uni()
+
+    @serialize_object_id
+    def _list_all_uni(self) -> list:
+        """list_all_uni straight from mongo, for structures that must not be built from a stale memo"""
         q = list(self._uni.aggregate([{'$match': {'_id': {'$exists': True}}},
                                       {
                                           '$project': {
@@ -129,37 +279,273 @@ class Database(Component):
                                       ]))
         return q
 
+    def _rebuild_if_changed(self, name: str, build, datasets=(UNIVERSITIES,), max_age: int = None,
+                            background: bool = False):
+        """
+        Returns the in-memory structure name, rebuilt with build(version) if the version of the
+        datasets has changed since it was built or it is older than max_age seconds. Callers are memoized
+        so the version is only read once per memo ttl. While mongo is down the last built structure is used
+        :param background: rebuild in a thread and serve the old structure meanwhile, only the first build waits
+        :return: the structure or 503 Response
+        """
+        built = self._derived.get(name)
+        # fail fast, the last built structure is served without waiting for the server selection timeout
+        if not self._health.is_available():
+            return built if built is not None else Response({'reason': 'Database is down'}, status=503)
+        try:
+            versions = self._cache.versions()
+            self._health.record_success()
+            version = tuple(versions.get(dataset, 0) for dataset in datasets)
+            if max_age:
+                version += (int(time.time() // max_age),)
+            if built is None or built.version != version:
+                if built is not None and background:
+                    self._rebuild_in_background(name, build, version)
+                else:
+                    built = build(version)
+                    if not isinstance(built, Response):
+                        self._derived[name] = built
+        except ConnectionFailure:
+            self._health.record_failure()
+            if built is None:
+                return Response({'reason': 'Database is down'}, status=503)
+        return built
+
+    def _rebuild_in_background(self, name: str, build, version) -> None:
+        """one rebuild of name at a time, the new structure is served once the memo of the caller expires"""
+        with self._rebuild_lock:
+            if name in self._rebuilding:
+                return
+            self._rebuilding.add(name)
+
+        def rebuild():
+            try:
+                built = build(version)
+                if not isinstance(built, Response):
+                    self._derived[name] = built
+            except ConnectionFailure:
+                self._health.record_failure()
+            finally:
+                with self._rebuild_lock:
+                    self._rebuilding.discard(name)
+
+        threading.Thread(target=rebuild, name=f'rebuild-{name}', daemon=True).start()
+
+    @memoize(UNIVERSITIES)
+    def list_all_uni_payload(self):
+        """
+        list_all_uni as an encoded geojson FeatureCollection, rebuilt in the background when the universities change
+        :return: EncodedPayload or 503 Response
+        """
+        def build(version):
+            # not the memoized list_all_uni, it can be older than version when another worker wrote
+            features = self._list_all_uni()
+            if isinstance(features, Response):
+                return features
+            return EncodedPayload({'type': 'FeatureCollection', 'features': features}, version)
+
+        return self._rebuild_if_changed('list_all_uni', build, background=True)
+
+    @memoize(NAMES)
+    def _autocomplete_index(self):
+        """
+        AutocompleteIndex over universities with geometry, rebuilt in the background when the names change
+        and every SEARCH_MAX_AGE, so report and weather writes do not rebuild it
+        """
+        return self._rebuild_if_changed('autocomplete', lambda version: AutocompleteIndex(
+            self._uni.find({'geometry': {'$exists': 1}},
+                           {field: 1 for field in AutocompleteIndex.FIELDS + ('geometry', 'rapporter_antall')}),
+            version), datasets=(NAMES,), max_age=SEARCH_MAX_AGE, background=True)
+
     @serialize_object_id
-    def search_by_all(self, text: str) -> list:
+    def _search_by_all_page(self, text: str, limit: int, after) -> list:
+        """
+        One page of the full text search, sorted by textScore and then _id
+        :param after: (score, _id) of the last result on the previous page, or None
         """
-        Returns regex match on text in the database
+        pipeline = [{'$match': {'geometry': {'$exists': 1}, '$text': {'$search': text}}},
+                    {'$addFields': {'score': {'$meta': 'textScore'}}},
+                    # only the fields of the response leave mongo
+                    {'$project': {'rapporter': 0, **LEAN}}]
+        if after:
+            score, last_id = after
+            pipeline.append({'$match': {'$or': [{'score': {'$lt': score}},
+                                                {'score': score, '_id': {'$gt': ObjectId(last_id)}}]}})
+        pipeline += [{'$sort': {'score': -1, '_id': 1}},
+                     {'$limit': limit}]
+        return list(self._uni.aggregate(pipeline))
+
+    def search_by_all(self, text: str, limit: int = 20, cursor: str = None):
+        """
+        Full text search on the text index, paginated with a continuation token
         :param text: string of search
-        :return: list of universities
+        :param limit: max universities on the page
+        :param cursor: 'next' from the previous page, None for the first page
+        :return: {'results': list of universities, 'next': cursor for the next page or None}
         """
+        try:
+            after = json.loads(base64.urlsafe_b64decode(cursor.encode())) if cursor else None
+            if after is not None:
+                if not isinstance(after, list):
+                    raise ValueError
+                after = (float(after[0]), str(ObjectId(after[1])))
+        except (ValueError, TypeError, IndexError, KeyError, InvalidId):
+            return Response({'reason': 'Invalid cursor'}, status=400)
+        # one extra to know if there is a next page
+        q = self._search_by_all_page(text, limit + 1, after)
+        if isinstance(q, Response):
+            return q
+        next_cursor = None
+        if len(q) > limit:
+            q = q[:limit]
+            next_cursor = base64.urlsafe_b64encode(json.dumps([q[-1]['score'], q[-1]['_id']]).encode()).decode()
+        return {'results': q, 'next': next_cursor}
 
-        def remove_reports(_q):
-            if _q.get('rapporter'):
-                del _q['rapporter']
-            return _q
+    @memoize(UNIVERSITIES)
+    def _facet_index(self):
+        """
+        FacetIndex over every university, rebuilt in the background when the universities change
+        and every FACETS_MAX_AGE to see the stars given through other worker processes.
+        Stars given through this process are set in place by _add_star_to_university
+        """
+        fields = FacetIndex.DIMENSIONS + ('universitet', 'geometry', 'rapporter_antall', 'star_count')
+        return self._rebuild_if_changed('facets', lambda version: FacetIndex(
+            self._uni.find({}, {field: 1 for field in fields}), version), max_age=FACETS_MAX_AGE, background=True)
 
-        q = [remove_reports(i) for i in self._uni.find({'geometry': {'$exists': 1}, '$text': {'$search': text}},
-                                                       {'score': {'$meta': "textScore"}}
-                                                       ).sort([('score', {'$meta': 'textScore'})])]
-        return q
+    def advanced_search(self, filters: dict, sort: str = 'rapporter_antall', limit: int = 50, cursor: str = None):
+        """
+        Faceted search from the in-memory FacetIndex
+        :param filters: Fagområde, land, by -> list of values, min_reports, min_stars -> int
+        :param sort: rapporter_antall, star_count or universitet
+        :param limit: max universities on the page
+        :param cursor: 'next' from the previous page, None for the first page
+        :return: geojson FeatureCollection of the page with facets, total and next
+        """
+        if sort not in FacetIndex.SORTS:
+            return Response({'reason': f'sort must be one of {", ".join(FacetIndex.SORTS)}'}, status=400)
+        try:
+            after = json.loads(base64.urlsafe_b64decode(cursor.encode())) if cursor else None
+            if after is not None and (not isinstance(after, list) or after[0] != sort
+                                      or not isinstance(after[1], list)):
+                raise ValueError
+        except (ValueError, TypeError, IndexError, KeyError):
+            return Response({'reason': 'Invalid cursor'}, status=400)
+        index = self._facet_index()
+        if isinstance(index, Response):
+            return index
+        try:
+            page = index.search(filters, sort, limit, after[1] if after else None)
+        except TypeError:
+            # sort key of another type than the sort
+            return Response({'reason': 'Invalid cursor'}, status=400)
+        if page['next'] is not None:
+            page['next'] = base64.urlsafe_b64encode(json.dumps([sort, page['next']]).encode()).decode()
+        return {'type': 'FeatureCollection', **page}
+
+    def cache_stats(self) -> dict:
+        """hits and misses of the memo cache and the mongo cache collection"""
+        return {'memo': self._memo.stats(), 'mongo': self._cache.stats()}
+
+    def explain(self, method: str, *args, max_ratio: float = MAX_RATIO, slow_ms: float = SLOW_MS, **kwargs) -> list:
+        """
+        Calls the method and explains every query it sent from this thread
+        :param method: name of a Database method, e.g. 'get_country_list'
+        :param max_ratio: documents examined per document returned before a query is flagged
+        :param slow_ms: execution time before a query is flagged
+        :return: list of plan reports, see query_plans.explain
+        """
+        with self._queries.capture() as commands:
+            getattr(self, method)(*args, **kwargs)
+        return [explain(self._mongo[database], command, max_ratio, slow_ms) for database, command in commands]
+
+    def ensure_indexes(self) -> dict:
+        """
+        Creates the INDEXES that are missing, built in the background so the collections stay usable.
+        Safe to run on every start
+        :return: {'created': [...], 'conflicts': [...]} of 'collection.index'
+        """
+        report = {'created': [], 'conflicts': []}
+        for attribute, models in INDEXES.items():
+            collection = getattr(self, attribute)
+            existing = collection.index_information()
+            for model in models:
+                if _find_index(model, existing):
+                    continue
+                name = f'{collection.name}.{model.document["name"]}'
+                try:
+                    collection.create_indexes([model])
+                    report['created'].append(name)
+                except OperationFailure as e:
+                    # e.g. another text index, only one is allowed per collection
+                    report['conflicts'].append(f'{name}: {e}')
+        return report
+
+    def index_report(self) -> dict:
+        """
+        :return: {'missing': INDEXES not in mongo, 'unregistered': indexes in mongo not in INDEXES,
+                  'unused': indexes without any use since mongod started} of 'collection.index'
+        """
+        report = {'missing': [], 'unregistered': [], 'unused': []}
+        for attribute, models in INDEXES.items():
+            collection = getattr(self, attribute)
+            existing = collection.index_information()
+            registered = set()
+            for model in models:
+                name = _find_index(model, existing)
+                if name:
+                    registered.add(name)
+                else:
+                    report['missing'].append(f'{collection.name}.{model.document["name"]}')
+            report['unregistered'] += [f'{collection.name}.{name}' for name in existing
+                                       if name != '_id_' and name not in registered]
+            try:
+                report['unused'] += [f'{collection.name}.{stats["name"]}'
+                                     for stats in collection.aggregate([{'$indexStats': {}}])
+                                     if stats['name'] != '_id_' and not stats['accesses']['ops']]
+            except OperationFailure:
+                # $indexStats needs mongodb 3.2 and the clusterMonitor role
+                pass
+        return report
+
+    def _find_country(self, country: str):
+        """
+        The country_names entry of country, by exact normalized name,
+        then by the start of the name and then anywhere in the name
+        """
+        name = fold(country)
+        if not name:
+            return None
+        return (self._country_names.find_one({'_id': name})
+                or self._country_names.find_one({'_id': {'$regex': '^' + re.escape(name)}})
+                or self._country_names.find_one({'_id': {'$regex': re.escape(name)}}))
 
     @serialize_object_id
     def get_country_list(self, country):
-        count = self._country.find_one({'properties.name': {'$regex': country, '$options': 'i'}},
-                                       {'geometry': 1, '_id': 0})
-        q = list(self._uni.find({'geometry': {'$geoWithin': {'$geometry': count['geometry']}}}))
-        q = sorted(q, key=lambda x: x.get('rapporter_antall', -1), reverse=True)
+        """universities in country sorted by rapporter_antall, from the assignment stored on the universities"""
+        found = self._find_country(country)
+        if not found:
+            return []
+        q = list(self._uni.find({'country_id': found['country_id']}, LEAN).sort('rapporter_antall', DESCENDING))
         return q
 
+    @memoize(NAMES)
+    def _subject_vocabulary(self):
+        """SubjectVocabulary with the number of universities per Fagområde, rebuilt when the names change"""
+        def build(version):
+            counts = self._uni.aggregate([{'$unwind': '$Fagområde'},
+                                          {'$group': {'_id': '$Fagområde', 'count': {'$sum': 1}}}])
+            return SubjectVocabulary({c['_id']: c['count'] for c in counts if c['_id']}, version)
+        return self._rebuild_if_changed('subjects', build, datasets=(NAMES,), max_age=SEARCH_MAX_AGE)
+
     def get_fagomraader(self, search: str) -> list:
-        q = self._uni.distinct('Fagområde')
-        if search:
-            q = [i for i in q if search.lower() in i.lower()]
-        return q
+        """
+        Fagområder matching search from the in-memory vocabulary, most popular first
+        :param search: str, None returns every Fagområde
+        """
+        vocabulary = self._subject_vocabulary()
+        if isinstance(vocabulary, Response):
+            return vocabulary
+        return vocabulary.search(search)
 
     @serialize_object_id
     def get_reports_for_university(self, university_id: str) -> list:
@@ -176,51 +562,250 @@ class Database(Component):
             q = []
         return q
 
-    def _get_reports_for_universities(self, university_ids) -> list:
-        reports_ids = []
-        for uni in self._uni.find({'_id': {'$in': university_ids}}, {'rapporter': 1, '_id': 0}):
-            if uni.get('rapporter'):
-                reports_ids += uni.get('rapporter')
-        if reports_ids:
-            q = list(self._reports.find({'_id': {'$in': reports_ids}}))
-        else:
-            q = []
-        return q
-
-    @serialize_object_id
     def search_universities(self, search: str):
         """
-        Full text search on universities. Retrieves the top 6 results as geojson
+        Search completion on universitet, land, by and Fagområde from the in-memory
+        autocomplete index. Retrieves the top 6 results as geojson
         :param search: str
         :return: list of universities as geojson
         """
-        def remove_reports(_q):
-            if _q.get('rapporter'):
-                del _q['rapporter']
-            _q['_id'] = str(_q['_id'])
-            del _q['raw_html']
-            return _q
+        index = self._autocomplete_index()
+        if isinstance(index, Response):
+            return index
+        return index.search(search, limit=6)
 
-        q = list(self._uni.aggregate([{'$match': {'geometry': {'$exists': 1}, '$or': [{'universitet': {'$regex': search, '$options': 'i'}}, {'land': {'$regex': search, '$options': 'i'}}, {'by': {'$regex': search, '$options': 'i'}}, {'Fagområde': {'$regex': search, '$options': 'i'}}]}},
-                                      {'$project': {
-                                          'type': 'Feature',
-                                          'properties.university': '$universitet',
-                                          'properties._id': '$_id',
-                                          'geometry': '$geometry'
-                                      }}
-                                      ]))[:6]
+    def _get_universities_by_ids(self, uni_ids) -> list:
+        """
+        Hydrates many universities with their rating in one round trip,
+        the rating is joined in from report_stats inside mongo
+        :param uni_ids: list of str, hex
+        :return: list of universities without rapporter and the cold fields
+        """
+        def count_answer(answer):
+            return {'$ifNull': [{'$arrayElemAt': [f'$stats.recommend.{answer}', 0]}, 0]}
+
+        if not uni_ids:
+            return []
+        q = list(self._uni.aggregate([{'$match': {'_id': {'$in': [ObjectId(i) for i in uni_ids]}}},
+                                      {'$lookup': {
+                                          'from': self._report_stats.name,
+                                          'localField': '_id',
+                                          'foreignField': '_id',
+                                          'as': 'stats'
+                                      }},
+                                      {'$addFields': {
+                                          'rating.positive': count_answer('ja'),
+                                          'rating.negative': count_answer('nei')
+                                      }},
+                                      {'$project': {'stats': 0, 'rapporter': 0, **LEAN}}
+                                      ]))
         return q
 
+    @invalidates(UNIVERSITIES, REPORTS)
+    @fail_fast
+    def insert_report(self, uni_id: str, report: dict):
+        """
+        Stores a new report for the university and updates its report_stats
+        :param uni_id: str, hex
+        :param report: dict with the answers of the report, question -> str
+        :return: str of the report id, 400 or 404 Response
+        """
+        if uni_id not in self._uni_ids:
+            return Response({'reason': 'University not found'}, status=404)
+        invalid = _invalid_answers(report)
+        if invalid:
+            return invalid
+        report_id = self._reports.insert_one(dict(report)).inserted_id
+        self._uni.update_one({'_id': ObjectId(uni_id)},
+                             {'$push': {'rapporter': report_id}, '$inc': {'rapporter_antall': 1}})
+        self._report_stats.update_one({'_id': ObjectId(uni_id)},
+                                      stats_update(new_report={**report, '_id': report_id}), upsert=True)
+        self._cache.bump(UNIVERSITIES, REPORTS)
+        return str(report_id)
+
+    @invalidates(REPORTS)
+    @fail_fast
+    def update_report(self, report_id: str, changes: dict):
+        """
+        Changes answers in a report and moves its contribution in report_stats
+        :param report_id: str, hex
+        :param changes: dict of question -> new answer
+        :return: message, 400 or 404 Response
+        """
+        invalid = _invalid_answers(changes)
+        if invalid:
+            return invalid
+        try:
+            report_id = ObjectId(report_id)
+        except InvalidId:
+            return Response({'reason': 'Report not found'}, status=404)
+        old = self._reports.find_one_and_update({'_id': report_id}, {'$set': changes},
+                                                projection={f: 1 for f in REPORT_FIELDS})
+        if not old:
+            return Response({'reason': 'Report not found'}, status=404)
+        update = stats_update(old, {**old, **changes})
+        uni = self._uni.find_one({'rapporter': old['_id']}, {'_id': 1})
+        if uni and update:
+            self._report_stats.update_one({'_id': uni['_id']}, update, upsert=True)
+        self._cache.bump(REPORTS)
+        return 'ok'
+
+    @invalidates(REPORTS)
+    def rebuild_report_stats(self) -> int:
+        """
+        Recomputes report_stats from every report, used for backfill.
+        The new documents are written to a temporary collection that replaces report_stats,
+        one per run so a rebuild from the startup bootstrap and one from the command do not collide
+        :return: number of universities with stats
+        """
+        unis = self._uni.find({'rapporter': {'$exists': 1}}, {'rapporter': 1})
+        reports = self._reports.find({}, {f: 1 for f in REPORT_FIELDS})
+        documents = rebuild_documents(unis, reports)
+        if documents:
+            rebuild = self._db[f'{self._report_stats.name}_rebuild_{ObjectId()}']
+            try:
+                rebuild.insert_many(documents)
+                rebuild.rename(self._report_stats.name, dropTarget=True)
+            except Exception:
+                rebuild.drop()
+                raise
+        else:
+            self._report_stats.delete_many({})
+        self._cache.bump(REPORTS)
+        return len(documents)
+
+    def bootstrap(self) -> dict:
+        """
+        Builds the derived collections a fresh deploy is missing: report_stats if there are reports but no stats,
+        and the countries of the universities if there are countries but no country_names,
+        or universities without a country_id, e.g. scraped after the last assignment.
+        Run by init_database in a thread, one worker process builds while the others skip it
+        :return: name -> number of documents built
+        """
+        built = {}
+        if not self._report_stats.find_one({}, {'_id': 1}) and self._reports.find_one({}, {'_id': 1}):
+            built['report_stats'] = self._build_once('report_stats', self.rebuild_report_stats)
+        if self._country.find_one({}, {'_id': 1}):
+            if not self._country_names.find_one({}, {'_id': 1}):
+                built['countries'] = self._build_once('countries', self.assign_countries)
+            elif self._uni.find_one({'geometry.type': 'Point', 'country_id': {'$exists': False}}, {'_id': 1}):
+                built['countries'] = self._build_once('countries', lambda: self.assign_countries(missing_only=True))
+        return {name: count for name, count in built.items() if count is not None}
+
+    def _build_once(self, name: str, build):
+        """build() if no other worker process is building name, else None"""
+        if not self._bootstrap_lease.acquire(name):
+            return None
+        try:
+            return build()
+        finally:
+            self._bootstrap_lease.release(name)
+
+    def get_raw_html(self, uni_id: str):
+        """
+        The scraped html of a university, kept out of the university documents
+        :param uni_id: str, hex
+        :return: str or None if the university has no html
+        """
+        if uni_id not in self._uni_ids:
+            return Response({'reason': 'University not found'}, status=404)
+        raw = self._uni_raw.find_one({'_id': ObjectId(uni_id)}, {'raw_html': 1})
+        if raw is None:
+            # not migrated yet
+            raw = self._uni.find_one({'_id': ObjectId(uni_id)}, {'raw_html': 1}) or {}
+        return raw.get('raw_html')
+
+    @invalidates(UNIVERSITIES)
+    def assign_countries(self, batch_size: int = 500, missing_only: bool = False) -> int:
+        """
+        Stores country_id, the str _id of the country, and the normalized country name on every university with a Point geometry,
+        and rebuilds the country_names lookup collection. Run after the universities or countries change.
+        Universities in no country get country_id None, so they are not located again with missing_only
+        :param missing_only: only the universities without a country_id, e.g. scraped after the last run
+        :return: number of universities in a country
+        """
+        countries = list(self._country.find({}, {'properties.name': 1, 'geometry': 1}))
+        index = CountryIndex(countries)
+        names = {}
+        for country in countries:
+            names.setdefault(fold(country['properties']['name']), {'country_id': str(country['_id']),
+                                                                    'name': country['properties']['name']})
+        if names:
+            self._country_names.bulk_write([UpdateOne({'_id': name}, {'$set': entry}, upsert=True)
+                                            for name, entry in names.items()])
+        self._country_names.delete_many({'_id': {'$nin': list(names)}})
+
+        assigned = 0
+        batch = []
+        query = {'geometry.type': 'Point'}
+        if missing_only:
+            query['country_id'] = {'$exists': False}
+        for uni in self._uni.find(query, {'geometry': 1}):
+            key = index.locate(*uni['geometry']['coordinates'][:2])
+            if key is None:
+                batch.append(UpdateOne({'_id': uni['_id']}, {'$set': {'country_id': None},
+                                                             '$unset': {'country': True}}))
+            else:
+                assigned += 1
+                batch.append(UpdateOne({'_id': uni['_id']},
+                                       {'$set': {'country_id': str(countries[key]['_id']),
+                                                 'country': fold(countries[key]['properties']['name'])}}))
+            if len(batch) == batch_size:
+                self._uni.bulk_write(batch, ordered=False)
+                batch = []
+        if batch:
+            self._uni.bulk_write(batch, ordered=False)
+        self._cache.bump(UNIVERSITIES)
+        return assigned
+
+    def move_cold_fields(self, batch_size: int = 100) -> int:
+        """
+        Moves COLD_FIELDS out of the university documents into the <uni_coll>_raw collection.
+        Safe to run again, e.g. after a new scrape. The search indexes of every worker are rebuilt
+        with the scraped names
+        :return: number of universities moved
+        """
+        moved = 0
+        cursor = self._uni.find({'$or': [{field: {'$exists': 1}} for field in COLD_FIELDS]},
+                                {field: 1 for field in COLD_FIELDS})
+        batch = []
+        for uni in cursor:
+            batch.append(uni)
+            if len(batch) == batch_size:
+                moved += self._move_cold_fields_batch(batch)
+                batch = []
+        if batch:
+            moved += self._move_cold_fields_batch(batch)
+        self._cache.bump(NAMES)
+        return moved
+
+    def _move_cold_fields_batch(self, unis) -> int:
+        # written to the side collection before the fields are removed, an interrupted run loses nothing
+        self._uni_raw.bulk_write([UpdateOne({'_id': uni['_id']},
+                                            {'$set': {k: v for k, v in uni.items() if k != '_id'}},
+                                            upsert=True) for uni in unis])
+        self._uni.update_many({'_id': {'$in': [uni['_id'] for uni in unis]}},
+                              {'$unset': {field: True for field in COLD_FIELDS}})
+        return len(unis)
+
     def _add_star_to_university(self, uni_id):
-        """increment the star value of a university"""
-        self._uni.update_one({'_id': ObjectId(uni_id)}, {'$inc': {'star_count': 1}})
+        """increment the star value of a university, returns it without the cold fields"""
+        uni = self._uni.find_one_and_update({'_id': ObjectId(uni_id)}, {'$inc': {'star_count': 1}}, LEAN,
+                                            return_document=ReturnDocument.AFTER)
+        if uni:
+            self._top_stars.offer(uni)
+            facets = self._derived.get('facets')
+            if facets is not None:
+                facets.set_stars(str(uni['_id']), uni['star_count'])
+        return uni
 
+    @fail_fast
     def get_or_create_user(self, email: str):
-        # user exists
-        user = self._users.find_one({'_id': email})
         # validation
         if not email.endswith('@stud.ntnu.no'):
             return {'message': f'{email}: invalid username'}
+        # user exists
+        user = self._users.find_one({'_id': email})
         # create user
         if not user:
             user = self._users.find_one_and_update(
@@ -234,13 +819,10 @@ class Database(Component):
                 },
                 upsert=True,
                 return_document=ReturnDocument.AFTER)
-        uni_ids = user['my_universities'].keys()
-        unis = [self.get_university_by_id(uni) for uni in uni_ids]
+        # every saved university in one round trip, no matter how big the cart is
+        unis = self._get_universities_by_ids(list(user['my_universities'].keys()))
         for uni in unis:
             uni['_id'] = str(uni['_id'])
-            if uni.get('rapporter'):
-                del uni['rapporter']
-            del uni['raw_html']
             user['my_universities'][uni.get('_id')]['university'] = uni
 
         for uni_id in user['my_universities'].keys():
@@ -250,88 +832,118 @@ class Database(Component):
 
         return user
 
-    def add_uni_to_cart(self, email: str, uni_id: str):
-        user = self._users.find_one({'_id': email}, {'my_universities': 1})
-        # no user by that id
+    def _cart_miss(self, email: str, uni_id: str, wanted: bool, missing: str = 'cart changed, try again') -> str:
+        """
+        Why a conditional cart update matched no user, only read when the update failed
+        :param wanted: True if the university had to be in the cart
+        :param missing: message if the user and cart are as wanted, the thing updated is missing
+            or another request changed the cart in between
+        :return: message
+        """
+        user = self._users.find_one({'_id': email}, {f'my_universities.{uni_id}': 1})
         if not user:
             return 'user not found'
+        if (uni_id in user.get('my_universities', {})) != wanted:
+            return 'uni_id not found' if wanted else 'university already added'
+        return missing
+
+    @fail_fast
+    def add_uni_to_cart(self, email: str, uni_id: str):
+        """
+        Saves the university in the cart of the user, one conditional update,
+        the university is starred only if it was not in the cart
+        :param email: id of the user
+        :param uni_id: str, hex
+        :return: delta, {'message': 'ok', 'added': {'uni_id', 'notes', 'links', 'star_count'}}, or a message
+        """
         # no id found
-        if uni_id not in [str(i.get('_id')) for i in self._uni.find({}, {'_id': 1})]:
+        if uni_id not in self._uni_ids:
             return 'university_id not found'
-        # if already added
-        if uni_id in user['my_universities'].keys():
-            return 'university already added'
-
-        self._users.update_one({'_id': email},
-                               {'$set': {
-                                   'last_modified': datetime.datetime.utcnow().isoformat(),
-                                   f'my_universities.{uni_id}.notes': {},
-                                   f'my_universities.{uni_id}.links': {}
-                               }}
-                               )
-        self._add_star_to_university(uni_id)
-        user = self.get_or_create_user(email)
-        return user
+        result = self._users.update_one({'_id': email, f'my_universities.{uni_id}': {'$exists': False}},
+                                        {'$set': {
+                                            'last_modified': datetime.datetime.utcnow().isoformat(),
+                                            f'my_universities.{uni_id}.notes': {},
+                                            f'my_universities.{uni_id}.links': {}
+                                        }})
+        if not result.modified_count:
+            return self._cart_miss(email, uni_id, wanted=False)
+        uni = self._add_star_to_university(uni_id)
+        return {'message': 'ok',
+                'added': {'uni_id': uni_id, 'notes': [], 'links': [], 'star_count': (uni or {}).get('star_count')}}
 
+    @fail_fast
     def remove_uni_from_cart(self, email: str, uni_id: str):
-        user = self._users.update_one({'_id': email,
-                                       f'my_universities.{uni_id}': {'$exists': True}},
-                                      {'$unset': {f'my_universities.{uni_id}': True},
-                                       '$set': {
-                                           'last_modified': datetime.datetime.utcnow().isoformat(),
-                                       }
-                                       })
-        user = self.get_or_create_user(email)
-        return user
+        """
+        :param email: id of the user
+        :param uni_id: str, hex
+        :return: delta, {'message': 'ok', 'removed': {'uni_id'}}, or a message
+        """
+        # not checked against the universities, a university that is gone can still be removed
+        if not _is_cart_key(uni_id):
+            return 'university_id not found'
+        result = self._users.update_one({'_id': email, f'my_universities.{uni_id}': {'$exists': True}},
+                                        {'$unset': {f'my_universities.{uni_id}': True},
+                                         '$set': {
+                                             'last_modified': datetime.datetime.utcnow().isoformat(),
+                                         }})
+        if not result.modified_count:
+            return self._cart_miss(email, uni_id, wanted=True)
+        return {'message': 'ok', 'removed': {'uni_id': uni_id}}
 
+    @fail_fast
     def add_link_or_note(self, email, uni_id, head, note, link):
-        user = self._users.find_one({'_id': email}, {'my_universities': 1})
-        # no user by that id
-        if not user:
-            return 'user not found'
-        # my_uni_id not found
-        if not user['my_universities'].get(uni_id):
+        """
+        Adds a note, or a link if note is empty, to a university in the cart in one conditional update.
+        The id is an ObjectId made here, unique without reading the cart first
+        :return: delta, {'message': 'ok', 'added': {'uni_id', 'notes' or 'links': [[id, {...}]]}}, or a message
+        """
+        # my_uni_id not found, also keeps the id from being a path into the user
+        if uni_id not in self._uni_ids:
             return 'uni_id not found'
         to_update = 'notes' if note else 'links'
         to_update_key = 'note' if note else 'link'
         to_update_value = note if note else link
-        try:
-            next_id = max([int(i) for i in user['my_universities'].get(uni_id).get(
-                to_update).keys()]) + 1
-        except:
-            next_id = 0
-        self._users.update_one({'_id': email},
-                               {
-                                   '$set': {
-                                       f'my_universities.{uni_id}.{to_update}.{next_id}':
-                                           {'head': head,
-                                            f'{to_update_key}': to_update_value},
-                                       'last_modified': datetime.datetime.utcnow().isoformat()
-                                   }
-                                })
-        return 'ok'
+        next_id = str(ObjectId())
+        value = {'head': head, to_update_key: to_update_value}
+        result = self._users.update_one({'_id': email, f'my_universities.{uni_id}': {'$exists': True}},
+                                        {
+                                            '$set': {
+                                                f'my_universities.{uni_id}.{to_update}.{next_id}': value,
+                                                'last_modified': datetime.datetime.utcnow().isoformat()
+                                            }
+                                        })
+        if not result.modified_count:
+            return self._cart_miss(email, uni_id, wanted=True)
+        return {'message': 'ok', 'added': {'uni_id': uni_id, to_update: [[next_id, value]]}}
 
+    @fail_fast
     def remove_link_or_note(self, email, uni_id, note_id, link_id):
-        user = self._users.find_one({'_id': email}, {'my_universities': 1})
-        # no user by that id
-        if not user:
-            return 'user not found'
-        # my_uni_id not found
-        if not user['my_universities'].get(uni_id):
-            return 'uni_id not found'
+        """
+        Removes the note note_id, or the link link_id, in one conditional update
+        :return: delta, {'message': 'ok', 'removed': {'uni_id', 'notes' or 'links': [id]}}, or a message
+        """
         to_update_id = note_id if note_id else link_id
         to_update = 'notes' if note_id else 'links'
-        self._users.update_one({'_id': email},
-                               {
-                                   '$unset': {
-                                       f'my_universities.{uni_id}.{to_update}.{to_update_id}': True
-                                   },
-                                   '$set': {
-                                       'last_modified': datetime.datetime.utcnow().isoformat(),
-                                   }
-                               })
-        return 'ok'
+        missing = 'note_id not found' if note_id else 'link_id not found'
+        # not checked against the universities, notes on a university that is gone can still be removed
+        if not _is_cart_key(uni_id):
+            return 'uni_id not found'
+        # ObjectIds, or numbers for notes added before
+        if not _is_cart_key(to_update_id):
+            return missing
+        path = f'my_universities.{uni_id}.{to_update}.{to_update_id}'
+        result = self._users.update_one({'_id': email, path: {'$exists': True}},
+                                        {
+                                            '$unset': {path: True},
+                                            '$set': {
+                                                'last_modified': datetime.datetime.utcnow().isoformat(),
+                                            }
+                                        })
+        if not result.modified_count:
+            return self._cart_miss(email, uni_id, wanted=True, missing=missing)
+        return {'message': 'ok', 'removed': {'uni_id': uni_id, to_update: [to_update_id]}}
 
+    @memoize(UNIVERSITIES)
     def get_university_and_score(self):
         university_and_score = list(self._uni.find({'rapporter_antall': {'$exists': True}},
                                                    {
@@ -342,80 +954,83 @@ class Database(Component):
         return university_and_score
 
     def _list_all_country_names_with_geo(self):
-        # TODO smarter queries
-        countries = self._country.find({}, {'properties.name': 1, '_id': 0, 'geometry': 1})
+        countries = self._country.find({}, {'properties.name': 1, 'geometry': 1})
         return countries
-    
-    def get_choropleth_countries(self):
-        choropleth = self._cache.find_one({'_id': 'get_choropleth_countries'})
-        if not choropleth:
-            countries = self._list_all_country_names_with_geo()
-            total_reports_count = self._reports.find().count()
-            total_uni_count = self._uni.find().count()
-
-            report_total = 0
-            # report_count = 0
-            university_total = 0
-            # university_count = 0
-
-            choropleth = {
-                'type': 'FeatureCollection',
-                'features': []
+
+    def _compute_choropleth_countries(self) -> dict:
+        """countries as geojson with report, university, social and academic ratings"""
+        countries = list(self._list_all_country_names_with_geo())
+        # grouped by the country stored on the universities by assign_countries
+        unis_by_country = {}
+        for uni in self._uni.find({'country_id': {'$ne': None}}, {'country_id': 1}):
+            unis_by_country.setdefault(uni['country_id'], []).append(uni)
+        stats = {s['_id']: s for s in self._report_stats.find({}, {'money': 0})}
+        total_reports_count = self._reports.find().count()
+        total_uni_count = self._uni.find().count()
+
+        report_total = 0
+        # report_count = 0
+        university_total = 0
+        # university_count = 0
+
+        choropleth = {
+            'type': 'FeatureCollection',
+            'features': []
+        }
+        for country in countries:
+            country_with_unis = unis_by_country.get(str(country.pop('_id')))
+            country['type'] = 'Feature'
+            country['properties'] = {
+                'name': country['properties']['name']
             }
-            for country in countries:
-                country_with_unis = self.get_country_list(country['properties']['name'])
-                country['type'] = 'Feature'
-                country['properties'] = {
-                    'name': country['properties']['name']
-                }
-                if not country_with_unis:
-                    country['properties']['report_rating'] = 0
-                    country['properties']['university_rating'] = 0
-                    country['properties']['social_rating'] = 0
-                    country['properties']['academic_rating'] = 0
-                    choropleth['features'].append(country)
-                    continue
-                # del country['geometry']
-
-                unis_in_country_count = len(country_with_unis)
-                unis_in_country = [uni['_id'] for uni in country_with_unis]
-                university_rating = unis_in_country_count / total_uni_count
-
-                reports_in_country = self._get_reports_for_universities([ObjectId(i) for i in unis_in_country])
-                reports_in_country_count = len(reports_in_country)
-                reports_in_country_rating = reports_in_country_count / total_reports_count
-                # pp([int(r['Hvordan vil du rangere den sosiale opplevelsen?']) for r in reports_in_country])
-                # pp(reports_in_country)
-                social_in_country_rating = (sum([int(r['Hvordan vil du rangere den sosiale opplevelsen?']) for r in reports_in_country]) \
-                                                / reports_in_country_count) if reports_in_country_count else 0
-                academic_in_country_rating = (sum([int(r['Hvordan vil du rangere den akademiske kvaliteten?']) for r in reports_in_country]) \
-                                                / reports_in_country_count) if reports_in_country_count else 0
-
-                # social_rating = sum([uni for uni in country_with_unis['features']['properties']])
-                country['properties']['report_rating'] = reports_in_country_rating
-                report_total += reports_in_country_rating
-                # report_count += 1
-                country['properties']['university_rating'] = university_rating
-                university_total += university_rating
-                # university_count += 1
-                country['properties']['social_rating'] = social_in_country_rating
-                country['properties']['academic_rating'] = academic_in_country_rating
+            if not country_with_unis:
+                country['properties']['report_rating'] = 0
+                country['properties']['university_rating'] = 0
+                country['properties']['social_rating'] = 0
+                country['properties']['academic_rating'] = 0
                 choropleth['features'].append(country)
+                continue
+            # del country['geometry']
+
+            unis_in_country_count = len(country_with_unis)
+            university_rating = unis_in_country_count / total_uni_count if total_uni_count else 0
+
+            stats_in_country = combine(stats[uni['_id']] for uni in country_with_unis if uni['_id'] in stats)
+            reports_in_country_count = stats_in_country.get('reports', 0)
+            reports_in_country_rating = reports_in_country_count / total_reports_count if total_reports_count else 0
+            social_in_country_rating = mean(stats_in_country, 'social') or 0
+            academic_in_country_rating = mean(stats_in_country, 'academic') or 0
+
+            # social_rating = sum([uni for uni in country_with_unis['features']['properties']])
+            country['properties']['report_rating'] = reports_in_country_rating
+            report_total += reports_in_country_rating
+            # report_count += 1
+            country['properties']['university_rating'] = university_rating
+            university_total += university_rating
+            # university_count += 1
+            country['properties']['social_rating'] = social_in_country_rating
+            country['properties']['academic_rating'] = academic_in_country_rating
+            choropleth['features'].append(country)
 
-            for c in choropleth['features']:
+        # 0 while the countries are not assigned yet, the ratings are left at 0
+        for c in choropleth['features']:
+            if report_total:
                 c['properties']['report_rating'] /= report_total
+            if university_total:
                 c['properties']['university_rating'] /= university_total
-            choropleth['_id'] = 'get_choropleth_countries'
-            self._cache.insert_one(dict(choropleth))
-        else:
-            del choropleth['_id']
+        return choropleth
+
+    @fail_fast
+    def get_choropleth_countries(self):
+        choropleth = self._cache.get_or_compute('get_choropleth_countries', self._compute_choropleth_countries,
+                                                datasets=(UNIVERSITIES, REPORTS))
         report_rating = sorted(filter(lambda x: x['properties']['report_rating'] != 0, choropleth['features']), key=lambda x: x['properties']['report_rating'])
-        report_rating_step = len(report_rating) // 4
+        report_rating_step = max(len(report_rating) // 4, 1)
         report_rating_groups = [report_rating[i]['properties']['report_rating'] for i in range(report_rating_step, len(report_rating), report_rating_step)]
         report_rating_groups.insert(0, 0)
 
         university_rating = sorted(filter(lambda x: x['properties']['university_rating'] != 0, choropleth['features']), key=lambda x: x['properties']['university_rating'])
-        university_rating_step = len(university_rating) // 4
+        university_rating_step = max(len(university_rating) // 4, 1)
         university_rating_groups = [university_rating[i]['properties']['university_rating'] for i in range(university_rating_step, len(university_rating), university_rating_step)]
         university_rating_groups.insert(0, 0)
 
@@ -424,73 +1039,64 @@ class Database(Component):
 
         return choropleth
 
+    def _money_statistics(self, match: dict) -> dict:
+        """
+        Money stats for the universities that match, and their countries.
+        The parsed amounts come from report_stats in the same round trip
+        """
+        unis = self._uni.aggregate([{'$match': match},
+                                    {'$project': {'universitet': 1, 'land': 1}},
+                                    {'$lookup': {
+                                        'from': self._report_stats.name,
+                                        'localField': '_id',
+                                        'foreignField': '_id',
+                                        'as': 'stats'
+                                    }},
+                                    {'$project': {
+                                        'universitet': 1,
+                                        'land': 1,
+                                        'money': {'$arrayElemAt': ['$stats.money', 0]}
+                                    }}])
+        return money_statistics(unis, self._money_limits)
+
+    @fail_fast
     def get_money_for_uni(self, uni_id):
         """
         Returns money stats for every university if uni_id is None
         if uni_id is provided only return money stats for that uni
         """
+        if uni_id:
+            if uni_id not in self._uni_ids:
+                return Response({'reason': 'University not found'}, status=404)
+            return self._money_statistics({'_id': ObjectId(uni_id)})['unis']
+        return self._cached_money_statistics()['unis']
 
-        def fix_money(money):
-            try:
-                return int(''.join(money.replace('kr', '').replace('_', '').strip().split()))
-            except:
-                return
+    @fail_fast
+    def get_money_for_countries(self):
+        """Returns money stats for every country with reports"""
+        return self._cached_money_statistics()['countries']
 
-        if uni_id:
-            unis = [self._uni.find_one({'_id': ObjectId(uni_id)}, {'rapporter': 1, 'universitet': 1})]
-            money_stats = False
-        else:
-            money_stats = self._cache.find_one({'_id': 'money_stats'})
-            if not money_stats:
-                unis = list(self._uni.find({'rapporter': {'$exists': 1}}, {'rapporter': 1, 'universitet': 1}))
-            else:
-                return money_stats['unis']
-        if not money_stats:
-            for uni in unis:
-                uni['_id'] = str(uni['_id'])
-                uni['money_stats'] = {
-                    'skolepenger': 0,
-                    'skolepenger_liste': [],
-                    'boligutgifter': 0,
-                    'boligutgifter_liste': [],
-                    'ekstra': 0,
-                    'ekstra_liste': [],
-                }
-                reports = self.get_reports_for_university(uni['_id']) if uni.get('rapporter') else []
-                if reports:
-                    del uni['rapporter']
-                for report in reports:
-                    skolepenger = fix_money(report['Hva var skolepengene pr_ semester?'])
-                    if skolepenger and 300000 > skolepenger is not None:
-                        uni['money_stats']['skolepenger_liste'].append(skolepenger)
-                        uni['money_stats']['skolepenger'] += skolepenger
-                    boligutgifter = fix_money(report['Hva var boligutgiftene pr_ måned (inkludert strøm, internett osv_)?'])
-                    if boligutgifter and 15001 > boligutgifter is not None:
-                        uni['money_stats']['boligutgifter_liste'].append(boligutgifter)
-                        uni['money_stats']['boligutgifter'] += boligutgifter
-                    ekstra = fix_money(report['Hvor mye brukte du i tillegg til pengene fra Lånekassen i løpet av oppholdet?'])
-                    if ekstra and 500000 > ekstra is not None:
-                        uni['money_stats']['ekstra_liste'].append(ekstra)
-                        uni['money_stats']['ekstra'] += ekstra
-                uni['money_stats']['skolepenger'] = uni['money_stats']['skolepenger'] // len(uni['money_stats']['skolepenger_liste']) if uni['money_stats']['skolepenger_liste'] else None
-                uni['money_stats']['boligutgifter'] = uni['money_stats']['boligutgifter'] // len(uni['money_stats']['boligutgifter_liste']) if uni['money_stats']['boligutgifter_liste'] else None
-                uni['money_stats']['ekstra'] = uni['money_stats']['ekstra'] // len(uni['money_stats']['ekstra_liste']) if uni['money_stats']['ekstra_liste'] else None
-            if not uni_id and not money_stats:
-                money_stats = {
-                    '_id': 'money_stats',
-                    'unis': unis,
-                }
-                pp(money_stats)
-                self._cache.insert_one(dict(money_stats))
-        return unis
+    def _cached_money_statistics(self) -> dict:
+        return self._cache.get_or_compute('money_stats',
+                                          lambda: self._money_statistics({'rapporter': {'$exists': 1}}),
+                                          datasets=(UNIVERSITIES, REPORTS))
+
+    def _most_stared(self, k: int) -> list:
+        """the k universities with the highest star_count, sorted by the star_count index"""
+        return list(self._uni.find({'star_count': {'$exists': 1}}, LEAN).sort('star_count', DESCENDING).limit(k))
 
     @serialize_object_id
-    def get_top_stared_universities(self):
-        """Returns the top 4 universities based on star_count"""
-        unis = self._uni.find({'star_count': {'$exists': 1}})
-        top4 = sorted(unis, key=lambda x: -x['star_count'])[:4]
-        return top4
+    def get_top_stared_universities(self, k: int = 4):
+        """
+        Returns the top k universities based on star_count
+        from memory when k is at most TopK.k_max, else with sort and limit in mongo
+        """
+        if k > self._top_stars.k_max:
+            return self._most_stared(k)
+        # copies, serialize_object_id changes the documents
+        return [dict(uni) for uni in self._top_stars.top(k)]
 
+    @invalidates(UNIVERSITIES)
     def _set_distance_from_ntnu_to_uni(self):
         """adds distance to NTNU for every university"""
         a = list(self._uni.aggregate(
@@ -512,28 +1118,86 @@ class Database(Component):
             ]))
         for uni in a:
             self._uni.update_one({'_id': uni['_id']}, {'$set': {'meters_from_ntnu': uni['distance']}})
+        self._cache.bump(UNIVERSITIES)
     
     def update_weather(self):
         """
-        Updates weather today for every university
+        Starts a background refresh of the weather today for every university
         can only run once a day
         """
-        # self._cache.update_one({'_id': 'weather_date'}, {'$set': {'date': datetime.datetime.today()}})
-        last_run = self._cache.find_one({'_id': 'weather_date'})
-        if last_run['date'] < datetime.datetime.today():
-            weather = Weather(unit=Unit.CELSIUS)
-            for uni in list(self._uni.find({'geometry': {'$exists': 1}})):
-                long, lat = uni['geometry']['coordinates']
-                location = weather.lookup_by_latlng(lat, long)
-                self._uni.update_one({'_id': uni['_id']}, {'$set': {'weather': {'min': int(location.forecast[0].low), 'high': int(location.forecast[0].high)}}})
-            self._cache.update_one({'_id': 'weather_date'}, {'$set': {'date': datetime.datetime.today() + datetime.timedelta(days=1)}})
-            return 'updated'
-        else:
+        last_run = self._cache.collection.find_one({'_id': 'weather_date'})
+        if last_run and last_run['date'] >= datetime.datetime.today():
             return 'wait to update'
+        if self._weather_lease.held('weather'):
+            return 'already updating'
+        threading.Thread(target=self._refresh_weather_in_background, name='weather', daemon=True).start()
+        return 'updating'
+
+    def _refresh_weather_in_background(self) -> None:
+        """refresh_weather in the thread of update_weather, errors are logged instead of lost with the thread"""
+        try:
+            self.refresh_weather()
+        except ConnectionFailure:
+            self._health.record_failure()
+            logger.exception('weather refresh failed, mongo is down')
+        except Exception:
+            logger.exception('weather refresh failed')
+
+    @invalidates(UNIVERSITIES)
+    def refresh_weather(self) -> int:
+        """
+        Looks up the weather for every university and writes it in one bulk_write,
+        only one worker process runs it at a time
+        :return: number of universities updated
+        """
+        if not self._weather_lease.acquire('weather'):
+            return 0
+        try:
+            job = WeatherJob(self._weather_provider or YahooWeatherProvider())
+            unis = self._uni.find({'geometry': {'$exists': 1}}, {'geometry': 1, 'land': 1, 'by': 1})
+            updates = job.run(unis)
+            if updates:
+                self._uni.bulk_write(updates, ordered=False)
+            self._cache.collection.update_one({'_id': 'weather_date'},
+                                              {'$set': {'date': datetime.datetime.today() + datetime.timedelta(days=1)}},
+                                              upsert=True)
+            self._cache.bump(UNIVERSITIES)
+            return len(updates)
+        finally:
+            self._weather_lease.release('weather')
+
+
+# MongoClient option -> setting
+CLIENT_SETTINGS = {
+    'maxPoolSize': 'MONGO_MAX_POOL_SIZE',
+    'minPoolSize': 'MONGO_MIN_POOL_SIZE',
+    'maxIdleTimeMS': 'MONGO_MAX_IDLE_TIME_MS',
+    'waitQueueTimeoutMS': 'MONGO_WAIT_QUEUE_TIMEOUT_MS',
+    'connectTimeoutMS': 'MONGO_CONNECT_TIMEOUT_MS',
+    'socketTimeoutMS': 'MONGO_SOCKET_TIMEOUT_MS',
+    'serverSelectionTimeoutMS': 'MONGO_SERVER_SELECTION_TIMEOUT_MS',
+}
+
 
 def init_database(settings: Settings):
-    # TODO
-    return Database(settings['MONGO_URI'], settings['MONGO_DB'], settings['MONGO_UNI_COLL'],
-                    settings['MONGO_COUNTRY_COLL'], settings['MONGO_REPORTS_COLL'],
-                    settings['MONGO_USERS_COLL'])
+    client_options = {option: settings[name] for option, name in CLIENT_SETTINGS.items() if name in settings}
+    database = Database(settings['MONGO_URI'], settings['MONGO_DB'], settings['MONGO_UNI_COLL'],
+                        settings['MONGO_COUNTRY_COLL'], settings['MONGO_REPORTS_COLL'],
+                        settings['MONGO_USERS_COLL'], money_limits=settings.get('MONEY_LIMITS'),
+                        weather_provider=settings.get('WEATHER_PROVIDER'), client_options=client_options)
+    threading.Thread(target=_prepare, args=(database,), daemon=True).start()
+    return database
+
 
+def _prepare(database: Database) -> None:
+    """run in a thread so the api starts while mongo is down, the indexes are built or the bootstrap runs"""
+    try:
+        database.ensure_indexes()
+        database.bootstrap()
+        # built before the first search instead of in it
+        database._autocomplete_index()
+        database._facet_index()
+        database.list_all_uni_payload()
+    except ConnectionFailure:
+        # done on the next start, or with apistar indexes and apistar rebuild_report_stats
+        pass
@@ -0,0 +1,129 @@
+"""
+Query plan inspection: the commands a Database method sends are captured and run again with explain,
+so collection scans and queries that examine many more documents than they return show up.
+"""
+import threading
+from contextlib import contextmanager
+
+from bson import SON
+from pymongo import monitoring
+
+EXPLAINABLE = {'find', 'aggregate', 'count', 'distinct', 'findAndModify', 'update', 'delete'}
+# fields the driver adds to a command that explain does not accept
+_DRIVER_FIELDS = {'lsid', 'txnNumber', 'readConcern', 'writeConcern'}
+# examined documents per returned document before a query is flagged
+MAX_RATIO = 10
+SLOW_MS = 100
+
+
+class QueryCapture(monitoring.CommandListener):
+    """Records the explainable commands sent from the thread inside capture(), does nothing outside"""
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+
+    @contextmanager
+    def capture(self):
+        """
+        with capture() as commands: ... commands is a list of (database name, command)
+        """
+        self._local.commands = []
+        try:
+            yield self._local.commands
+        finally:
+            self._local.commands = None
+
+    def started(self, event):
+        commands = getattr(self._local, 'commands', None)
+        if commands is not None and event.command_name in EXPLAINABLE:
+            commands.append((event.database_name, SON((key, value) for key, value in event.command.items()
+                                                      if not key.startswith('$') and key not in _DRIVER_FIELDS)))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _find(document, key):
+    """first dict in the nested explain output that has key"""
+    if isinstance(document, dict):
+        if key in document:
+            return document
+        children = document.values()
+    elif isinstance(document, list):
+        children = document
+    else:
+        return None
+    for child in children:
+        found = _find(child, key)
+        if found is not None:
+            return found
+    return None
+
+
+def _stages(plan, stages: list, indexes: list) -> None:
+    if isinstance(plan, list):
+        for child in plan:
+            _stages(child, stages, indexes)
+        return
+    if not isinstance(plan, dict):
+        return
+    if 'stage' in plan:
+        stages.append(plan['stage'])
+    if 'indexName' in plan:
+        indexes.append(plan['indexName'])
+    for key in ('queryPlan', 'inputStage', 'inputStages', 'innerStage', 'outerStage', 'shards'):
+        _stages(plan.get(key), stages, indexes)
+
+
+def explain(database, command: SON, max_ratio: float = MAX_RATIO, slow_ms: float = SLOW_MS) -> dict:
+    """
+    :param database: pymongo database the command was sent to
+    :param command: the command, from QueryCapture
+    :param max_ratio: documents examined per document returned before the query is flagged
+    :param slow_ms: execution time before the query is flagged
+    :return: dict with the winning plan, what it examined and flags, a list of 'COLLSCAN', 'ratio' and 'slow'
+    """
+    output = database.command(SON([('explain', command), ('verbosity', 'executionStats')]))
+    planner = (_find(output, 'queryPlanner') or {}).get('queryPlanner', {})
+    stats = (_find(output, 'executionStats') or {}).get('executionStats', {})
+    stages, indexes = [], []
+    _stages(planner.get('winningPlan'), stages, indexes)
+    returned = stats.get('nReturned', 0)
+    examined = stats.get('totalDocsExamined', 0)
+    report = {
+        'command': next(iter(command)),
+        'collection': command[next(iter(command))],
+        'stages': stages,
+        'indexes': indexes,
+        'docs_examined': examined,
+        'keys_examined': stats.get('totalKeysExamined', 0),
+        'returned': returned,
+        'millis': stats.get('executionTimeMillis', 0),
+        'flags': [],
+    }
+    if 'COLLSCAN' in stages:
+        report['flags'].append('COLLSCAN')
+    if examined / max(returned, 1) > max_ratio:
+        report['flags'].append('ratio')
+    if report['millis'] > slow_ms:
+        report['flags'].append('slow')
+    return report
+
+
+def assert_index_backed(db, method: str, *args, max_ratio: float = MAX_RATIO, **kwargs) -> list:
+    """
+    Test helper, fails if a query of the Database method scans a collection or examines
+    more than max_ratio documents per returned document. The in-process caches are cleared first
+    so the method sends its queries
+    :return: the plan reports
+    """
+    db._memo.clear()
+    db._derived.clear()
+    reports = db.explain(method, *args, max_ratio=max_ratio, **kwargs)
+    assert reports, f'{method} sent no queries'
+    flagged = [report for report in reports if {'COLLSCAN', 'ratio'} & set(report['flags'])]
+    assert not flagged, f'{method} is not index backed: {flagged}'
+    return reports
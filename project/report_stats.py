@@ -0,0 +1,152 @@
+"""
+Materialized report aggregates, one document per university in the report_stats collection:
+
+    {
+        '_id': ObjectId of the university,
+        'reports': number of reports,
+        'recommend': {'ja': int, 'nei': int},
+        'social': {'sum': int, 'count': int},
+        'academic': {'sum': int, 'count': int},
+        'money': {'skolepenger': {'samples': {report_id: int}}, ...}
+    }
+
+Money samples are every parsed amount, outliers are left out when the statistics are computed.
+
+Documents are kept up to date with $inc/$set/$unset when a report is inserted or changed,
+rebuild_documents is used for backfill.
+"""
+import math
+
+from project.money import parse_amounts
+
+RECOMMEND = 'Vil du anbefale andre å reise til studiestedet?'
+SOCIAL = 'Hvordan vil du rangere den sosiale opplevelsen?'
+ACADEMIC = 'Hvordan vil du rangere den akademiske kvaliteten?'
+
+# money key -> question in the report
+MONEY = {
+    'skolepenger': 'Hva var skolepengene pr_ semester?',
+    'boligutgifter': 'Hva var boligutgiftene pr_ måned (inkludert strøm, internett osv_)?',
+    'ekstra': 'Hvor mye brukte du i tillegg til pengene fra Lånekassen i løpet av oppholdet?',
+}
+
+REPORT_FIELDS = [RECOMMEND, SOCIAL, ACADEMIC] + list(MONEY.values())
+
+
+def fix_money(money):
+    """'12 000 kr' -> 12000, None if it can not be parsed"""
+    amount = parse_amounts([money])[0]
+    return None if math.isnan(amount) else int(amount)
+
+
+def _rating(value):
+    try:
+        return int(value)
+    except:
+        return
+
+
+def report_values(report, amounts: dict = None) -> dict:
+    """
+    Flattens a report to the counters it contributes to the aggregate
+    :param report: dict, report from the rapporter collection
+    :param amounts: money key -> already parsed amount, parsed from the report if None
+    :return: dict of dotted path -> value
+    """
+    values = {'reports': 1}
+    answer = report.get(RECOMMEND)
+    if answer in ('ja', 'nei'):
+        values[f'recommend.{answer}'] = 1
+    for key, question in (('social', SOCIAL), ('academic', ACADEMIC)):
+        rating = _rating(report.get(question))
+        if rating is not None:
+            values[f'{key}.sum'] = rating
+            values[f'{key}.count'] = 1
+    for key, question in MONEY.items():
+        money = amounts[key] if amounts is not None else fix_money(report.get(question))
+        if money is not None:
+            values[f'money.{key}.samples.{report["_id"]}'] = money
+    return values
+
+
+def stats_update(old_report=None, new_report=None) -> dict:
+    """
+    Creates the update for report_stats when a report goes from old_report to new_report,
+    old_report is None for inserts and new_report is None for deletes
+    :return: mongo update document
+    """
+    inc, set_, unset = {}, {}, {}
+    for report, sign in ((old_report, -1), (new_report, 1)):
+        if not report:
+            continue
+        for path, value in report_values(report).items():
+            if '.samples.' in path:
+                if sign > 0:
+                    set_[path] = value
+                    unset.pop(path, None)
+                else:
+                    unset[path] = True
+            else:
+                inc[path] = inc.get(path, 0) + sign * value
+    update = {'$inc': {k: v for k, v in inc.items() if v}}
+    if set_:
+        update['$set'] = set_
+    if unset:
+        update['$unset'] = unset
+    return {k: v for k, v in update.items() if v}
+
+
+def rebuild_documents(unis, reports) -> list:
+    """
+    Computes every report_stats document from scratch
+    :param unis: iterable of universities with _id and rapporter
+    :param reports: iterable of reports with at least REPORT_FIELDS
+    :return: list of report_stats documents
+    """
+    reports = {report['_id']: report for report in reports}
+    # the money answers of every report are parsed in one batch per question
+    parsed = {key: parse_amounts([report.get(question) for report in reports.values()])
+              for key, question in MONEY.items()}
+    amounts = {report_id: {key: None if math.isnan(parsed[key][i]) else int(parsed[key][i]) for key in MONEY}
+               for i, report_id in enumerate(reports)}
+    documents = []
+    for uni in unis:
+        doc = {'_id': uni['_id']}
+        for report_id in uni.get('rapporter') or []:
+            if report_id not in reports:
+                continue
+            for path, value in report_values(reports[report_id], amounts[report_id]).items():
+                *parents, key = path.split('.')
+                node = doc
+                for parent in parents:
+                    node = node.setdefault(parent, {})
+                node[key] = value if '.samples.' in path else node.get(key, 0) + value
+        documents.append(doc)
+    return documents
+
+
+def combine(stats_list) -> dict:
+    """
+    Sums the counters of many report_stats documents, e.g. every university in a country
+    :param stats_list: iterable of report_stats documents
+    :return: dict on the same form without _id and samples
+    """
+    def add(total, doc):
+        for key, value in doc.items():
+            if key in ('_id', 'samples'):
+                continue
+            if isinstance(value, dict):
+                add(total.setdefault(key, {}), value)
+            else:
+                total[key] = total.get(key, 0) + value
+
+    total = {}
+    for stats in stats_list:
+        add(total, stats)
+    return total
+
+
+def mean(stats: dict, key: str):
+    """mean of social/academic, None without answers"""
+    part = stats.get(key) or {}
+    return part['sum'] / part['count'] if part.get('count') else None
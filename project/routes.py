@@ -23,9 +23,15 @@ routes = [
 
     Route('/advanced_search', 'GET', views.advanced_search, name='advanced_search'),
 
+    Route('/get_raw_html/{uni_id}', 'GET', views.get_raw_html, name='get_raw_html'),
+
     Route('/get_reports_for_university/{_id}', 'GET', views.get_reports_for_university,
           name='get_reports_for_university'),
 
+    Route('/insert_report/{uni_id}', 'POST', views.insert_report, name='insert_report'),
+
+    Route('/update_report/{report_id}', 'POST', views.update_report, name='update_report'),
+
     Route('/search_universities/{search}', 'GET', views.search_universities,
           name='search_universities'),
 
@@ -52,11 +58,16 @@ routes = [
     Route('/get_money_for_uni/{uni_id}', 'GET', views.get_money_for_uni,
           name='get_money_for_uni'),
     
+    Route('/get_money_for_countries', 'GET', views.get_money_for_countries,
+          name='get_money_for_countries'),
+
     Route('/get_top_stared_universities/', 'GET', views.get_top_stared_universities,
           name='get_top_stared_universities'),
 
     Route('/update_weather', 'GET', views.update_weather,
           name='update_weather'),
+
+    Route('/metrics', 'GET', views.get_metrics, name='metrics'),
     
     Include('/', docs_urls),
     Include('/static', static_urls)
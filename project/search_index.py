@@ -0,0 +1,263 @@
+"""
+In-memory search indexes over the universities, rebuilt when the university data changes.
+Text is folded before indexing so 'Tromsø', 'tromso' and 'TROMSØ' match each other.
+"""
+import bisect
+import heapq
+import re
+import unicodedata
+
+# letters NFKD does not decompose
+_FOLD = str.maketrans({'æ': 'ae', 'ø': 'o', 'å': 'a', 'ß': 'ss', 'đ': 'd', 'ł': 'l', 'œ': 'oe'})
+_NOT_WORD = re.compile(r'[^\w]+')
+
+
+def fold(text) -> str:
+    """lower case, accent free version of text used for matching"""
+    text = str(text or '').lower().translate(_FOLD)
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return ' '.join(text.split())
+
+
+def tokens(text: str) -> list:
+    return [token for token in _NOT_WORD.split(text) if token]
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class AutocompleteIndex:
+    """
+    Prefix postings over the words of universitet, land, by and Fagområde
+    and trigram postings for matches inside words.
+
+    Results are ranked by where the search matched:
+    start of a field, start of a word, inside a word; then by field and rapporter_antall.
+    Documents are numbered by rapporter_antall, most reports first, so every posting is in ranking order
+    and a search reads only the start of the postings instead of scoring every candidate
+    """
+    FIELDS = ('universitet', 'by', 'land', 'Fagområde')
+    # max results of a search, and documents kept per prefix and match kind
+    TOP = 50
+    # documents scored for a search of many words, the most popular that match every word
+    CANDIDATES = 200
+    _DOC_BITS = 32
+
+    def __init__(self, unis, version=None) -> None:
+        """
+        :param unis: universities with geometry, rapporter_antall and FIELDS
+        :param version: version of the university data the index was built from
+        """
+        self.version = version
+        unis = sorted(unis, key=lambda uni: -(uni.get('rapporter_antall') or 0))
+        self._features = []
+        self._values = []  # doc -> [(field rank, folded value)]
+        self._tokens = []  # doc -> tokens of every value
+        self._prefixes = {}  # prefix -> [match kind << _DOC_BITS | doc], at most TOP per match kind
+        self._words = {}  # token -> set of docs
+        self._grams = {}  # trigram -> per field rank a list of docs, in doc order
+        kept = {}
+        fields = len(self.FIELDS)
+        for doc, uni in enumerate(unis):
+            self._features.append({
+                '_id': str(uni['_id']),
+                'type': 'Feature',
+                'properties': {'university': uni.get('universitet'), '_id': str(uni['_id'])},
+                'geometry': uni['geometry'],
+            })
+            values = []
+            for rank, field in enumerate(self.FIELDS):
+                field_values = uni.get(field)
+                for value in field_values if isinstance(field_values, list) else [field_values]:
+                    value = fold(value)
+                    if value:
+                        values.append((rank, value))
+            self._values.append(values)
+            self._tokens.append(tuple({token for _, value in values for token in tokens(value)}))
+
+            # best match kind of every prefix in this document, the start of a field before the start of a word
+            best = {}
+            for rank, value in values:
+                for i, token in enumerate(tokens(value)):
+                    kind = (0 if i == 0 and value.startswith(token) else fields) + rank
+                    for end in range(1, len(token) + 1):
+                        prefix = token[:end]
+                        if best.get(prefix, 2 * fields) > kind:
+                            best[prefix] = kind
+                    self._words.setdefault(token, set()).add(doc)
+                for gram in trigrams(value):
+                    postings = self._grams.setdefault(gram, [[] for _ in range(fields)])[rank]
+                    if not postings or postings[-1] != doc:
+                        postings.append(doc)
+            for prefix, kind in best.items():
+                if kept.get((prefix, kind), 0) < self.TOP:
+                    kept[prefix, kind] = kept.get((prefix, kind), 0) + 1
+                    self._prefixes.setdefault(prefix, []).append(kind << self._DOC_BITS | doc)
+        self._sorted_words = sorted(self._words)
+
+    def _starts(self, word: str, limit: int) -> list:
+        """docs with a field or word starting with word, in ranking order"""
+        mask = (1 << self._DOC_BITS) - 1
+        return [entry & mask for entry in sorted(self._prefixes.get(word, ()))[:limit]]
+
+    def _word_prefix(self, word: str) -> list:
+        """every token starting with word"""
+        start = bisect.bisect_left(self._sorted_words, word)
+        end = bisect.bisect_left(self._sorted_words, word[:-1] + chr(ord(word[-1]) + 1))
+        return self._sorted_words[start:end]
+
+    def _starts_all(self, words: list, query: str, limit: int) -> list:
+        """
+        docs where every word starts a word and query is not only found inside words, in ranking order.
+        Only the CANDIDATES most popular matches are scored, found from the rarest word
+        """
+        postings = sorted(((sum(len(docs) for docs in sets), word, sets) for word, sets in
+                           ((word, [self._words[token] for token in self._word_prefix(word)]) for word in words)),
+                          key=lambda posting: posting[0])
+        if not postings[0][0]:
+            return []
+        # the postings of rare words are intersected, common words like 'o' are checked per document
+        docs = set().union(*postings[0][2])
+        common = []
+        for size, word, sets in postings[1:]:
+            if size <= self.CANDIDATES * 50:
+                docs &= set().union(*sets)
+            else:
+                common.append(word)
+        candidates = []
+        for doc in sorted(docs):
+            doc_tokens = self._tokens[doc]
+            if all(any(token.startswith(word) for token in doc_tokens) for word in common):
+                candidates.append(doc)
+                if len(candidates) == self.CANDIDATES:
+                    break
+        scored = ((self._score(doc, query), doc) for doc in candidates)
+        return [doc for _, doc in heapq.nsmallest(limit, ((score, doc) for score, doc in scored if score[0] < 2))]
+
+    def _inside(self, query: str, limit: int, exclude: set) -> list:
+        """
+        docs where query is only found inside words, in ranking order.
+        The postings are read in doc order and the search stops at limit documents
+        """
+        grams = trigrams(query)
+        if not grams:
+            return []
+        found = []
+        for rank in range(len(self.FIELDS)):
+            postings = sorted((self._grams.get(gram, [[]] * len(self.FIELDS))[rank] for gram in grams), key=len)
+            for doc in postings[0]:
+                if doc in exclude or not all(_contains(other, doc) for other in postings[1:]):
+                    continue
+                if self._score(doc, query) == (2, rank):
+                    found.append(doc)
+                    if len(found) == limit:
+                        return found
+        return found
+
+    def _score(self, doc: int, query: str):
+        best = None
+        for rank, value in self._values[doc]:
+            if value.startswith(query):
+                tier = 0
+            elif (' ' + value).find(' ' + query) >= 0:
+                tier = 1
+            elif query in value:
+                tier = 2
+            else:
+                continue
+            if best is None or (tier, rank) < best:
+                best = (tier, rank)
+        if best is None:
+            # the words of the search start words in different fields, e.g. 'oslo norge'
+            if all(any(token.startswith(word) for token in self._tokens[doc]) for word in tokens(query)):
+                best = (1, len(self.FIELDS))
+        return best
+
+    def search(self, search: str, limit: int = 6) -> list:
+        """
+        :param search: str, what is typed in the search box
+        :param limit: max number of results, at most TOP
+        :return: list of universities as geojson features
+        """
+        query = fold(search)
+        if not query:
+            return []
+        limit = min(limit, self.TOP)
+        words = tokens(query)
+        if words == [query]:
+            docs = self._starts(query, limit)
+        elif words:
+            docs = self._starts_all(words, query, limit)
+        else:
+            docs = []
+        if len(docs) < limit:
+            docs += self._inside(query, limit - len(docs), set(docs))
+        return [self._features[doc] for doc in docs]
+
+
+def _contains(postings: list, doc: int) -> bool:
+    """doc in a sorted list of docs"""
+    i = bisect.bisect_left(postings, doc)
+    return i < len(postings) and postings[i] == doc
+
+
+class SubjectVocabulary:
+    """
+    Every Fagområde with the number of universities that have it.
+    Sorted folded names for prefix search and n-gram postings for substring search,
+    results are ranked by where the search matched and then by number of universities
+    """
+    GRAM = 3
+
+    def __init__(self, counts: dict, version=None) -> None:
+        """
+        :param counts: Fagområde -> number of universities
+        :param version: version of the university data the vocabulary was built from
+        """
+        self.version = version
+        self._subjects = sorted(counts, key=lambda subject: (-counts[subject], subject))
+        self._counts = counts
+        self._folded = [fold(subject) for subject in self._subjects]
+        self._sorted = sorted((folded, doc) for doc, folded in enumerate(self._folded))
+        self._grams = {}
+        for doc, folded in enumerate(self._folded):
+            for size in range(1, self.GRAM + 1):
+                for i in range(len(folded) - size + 1):
+                    self._grams.setdefault(folded[i:i + size], set()).add(doc)
+
+    def _prefix(self, query: str) -> set:
+        start = bisect.bisect_left(self._sorted, (query,))
+        docs = set()
+        for folded, doc in self._sorted[start:]:
+            if not folded.startswith(query):
+                break
+            docs.add(doc)
+        return docs
+
+    def _substring(self, query: str) -> set:
+        if len(query) <= self.GRAM:
+            return self._grams.get(query, set())
+        grams = {query[i:i + self.GRAM] for i in range(len(query) - self.GRAM + 1)}
+        postings = sorted((self._grams.get(gram, set()) for gram in grams), key=len)
+        return {doc for doc in set.intersection(*postings) if query in self._folded[doc]}
+
+    def search(self, search: str = None) -> list:
+        """
+        :param search: str, part of a Fagområde, every subject if empty
+        :return: list of Fagområde, most popular first among equal matches
+        """
+        query = fold(search)
+        if not query:
+            return list(self._subjects)
+        prefix = self._prefix(query)
+
+        def tier(doc):
+            if doc in prefix:
+                return 0
+            return 1 if (' ' + self._folded[doc]).find(' ' + query) >= 0 else 2
+        # docs are numbered by popularity, so the doc breaks ties
+        return [self._subjects[doc] for doc in sorted(prefix | self._substring(query), key=lambda d: (tier(d), d))]
+
+    def count(self, subject: str) -> int:
+        return self._counts.get(subject, 0)
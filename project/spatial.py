@@ -0,0 +1,114 @@
+"""
+In-memory spatial join of university points to country polygons.
+Bounding boxes are packed in a Sort-Tile-Recursive R-tree, candidates are confirmed
+with a ray casting point in polygon test. Coordinates are GeoJSON [longitude, latitude].
+"""
+import math
+
+
+def polygons(geometry) -> list:
+    """
+    Polygon/MultiPolygon as a list of polygons, each a list of rings where the first is the outer ring
+    :param geometry: GeoJSON geometry
+    :return: list of polygons
+    """
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    return []
+
+
+def bounding_box(ring) -> tuple:
+    xs = [point[0] for point in ring]
+    ys = [point[1] for point in ring]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def point_in_ring(x: float, y: float, ring) -> bool:
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i][0], ring[i][1]
+        xj, yj = ring[j][0], ring[j][1]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def point_in_polygon(x: float, y: float, polygon) -> bool:
+    """inside the outer ring and not inside any of the holes"""
+    outer, *holes = polygon
+    return point_in_ring(x, y, outer) and not any(point_in_ring(x, y, hole) for hole in holes)
+
+
+class STRtree:
+    """
+    Static R-tree over bounding boxes, packed with Sort-Tile-Recursive.
+    Nodes are tuples of (minx, miny, maxx, maxy, children, is_leaf)
+    """
+
+    def __init__(self, items, node_capacity: int = 8) -> None:
+        """
+        :param items: iterable of (minx, miny, maxx, maxy, payload)
+        :param node_capacity: max children per node
+        """
+        self.node_capacity = node_capacity
+        level = [(minx, miny, maxx, maxy, payload, True) for minx, miny, maxx, maxy, payload in items]
+        while len(level) > node_capacity:
+            level = self._pack(level)
+        self.root = self._node(level) if level else None
+
+    @staticmethod
+    def _node(children) -> tuple:
+        return (min(c[0] for c in children), min(c[1] for c in children),
+                max(c[2] for c in children), max(c[3] for c in children), children, False)
+
+    def _pack(self, entries) -> list:
+        capacity = self.node_capacity
+        node_count = math.ceil(len(entries) / capacity)
+        slice_size = math.ceil(math.sqrt(node_count)) * capacity
+        entries = sorted(entries, key=lambda e: e[0] + e[2])
+        nodes = []
+        for start in range(0, len(entries), slice_size):
+            vertical_slice = sorted(entries[start:start + slice_size], key=lambda e: e[1] + e[3])
+            for i in range(0, len(vertical_slice), capacity):
+                nodes.append(self._node(vertical_slice[i:i + capacity]))
+        return nodes
+
+    def query_point(self, x: float, y: float) -> list:
+        """payloads whose bounding box contains the point"""
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            for entry in stack.pop()[4]:
+                if entry[0] <= x <= entry[2] and entry[1] <= y <= entry[3]:
+                    if entry[5]:
+                        found.append(entry[4])
+                    else:
+                        stack.append(entry)
+        return found
+
+
+class CountryIndex:
+    """Finds the country a point is in"""
+
+    def __init__(self, countries) -> None:
+        """
+        :param countries: list of GeoJSON features with geometry, the position in the list is the country key
+        """
+        items = []
+        for key, country in enumerate(countries):
+            for polygon in polygons(country['geometry']):
+                items.append((*bounding_box(polygon[0]), (key, polygon)))
+        self._tree = STRtree(items)
+
+    def locate(self, x: float, y: float):
+        """
+        :return: position of the country in the list given to the index, None if in no country
+        """
+        for key, polygon in self._tree.query_point(x, y):
+            if point_in_polygon(x, y, polygon):
+                return key
+        return None
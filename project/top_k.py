@@ -0,0 +1,65 @@
+import heapq
+import threading
+import time
+
+
+class TopK:
+    """
+    The k_max documents with the highest score, kept in memory and updated on increments.
+    Scores only go up, so a document outside the top can only enter it through offer,
+    and the kept top stays exact. Reloaded after ttl seconds to see increments
+    made by other worker processes.
+    """
+
+    def __init__(self, load, key: str, k_max: int = 50, ttl: float = 60.0) -> None:
+        """
+        :param load: callable(k) returning the k documents with the highest score
+        :param key: the score field of the documents
+        :param k_max: number of documents kept
+        :param ttl: seconds before the top is reloaded
+        """
+        self.load = load
+        self.key = key
+        self.k_max = k_max
+        self.ttl = ttl
+        self._docs = None  # _id -> document
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def _min(self):
+        return min(self._docs.values(), key=lambda doc: doc[self.key])
+
+    def _ensure_loaded(self) -> None:
+        if self._docs is None or self._expires < time.monotonic():
+            docs = {doc['_id']: doc for doc in self.load(self.k_max)}
+            with self._lock:
+                self._docs = docs
+                self._expires = time.monotonic() + self.ttl
+
+    def offer(self, doc: dict) -> None:
+        """
+        :param doc: document with its new score
+        """
+        with self._lock:
+            if self._docs is None:
+                return
+            if doc['_id'] in self._docs or len(self._docs) < self.k_max:
+                self._docs[doc['_id']] = doc
+            else:
+                lowest = self._min()
+                if doc[self.key] > lowest[self.key]:
+                    del self._docs[lowest['_id']]
+                    self._docs[doc['_id']] = doc
+
+    def top(self, k: int) -> list:
+        """
+        :param k: number of documents, at most k_max
+        :return: the k documents with the highest score, highest first
+        """
+        self._ensure_loaded()
+        with self._lock:
+            return heapq.nlargest(min(k, self.k_max), self._docs.values(), key=lambda doc: doc[self.key])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._docs = None
@@ -1,7 +1,9 @@
 from functools import wraps
 
-from apistar.http import Response, QueryParams
+from apistar.http import Header, Response, QueryParams, RequestData
 
+from project import metrics
+from project.metrics import measured
 from project.mongo_db import Database
 
 
@@ -18,8 +20,12 @@ def allow_cross_origin(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
         data = func(*args, **kwargs)
-        return Response(data, headers={"Access-Control-Allow-Origin": '*'}
-                        ) if LOCALHOST else data
+        if not LOCALHOST:
+            return data
+        if isinstance(data, Response):
+            data.headers['Access-Control-Allow-Origin'] = '*'
+            return data
+        return Response(data, headers={"Access-Control-Allow-Origin": '*'})
     return wrapper
 
 
@@ -42,6 +48,7 @@ def as_geojson(func):
     return wrapper
 
 
+@measured
 @allow_cross_origin
 def get_university_by_id(db: Database, _id: str):
     """
@@ -54,6 +61,7 @@ def get_university_by_id(db: Database, _id: str):
     return q
 
 
+@measured
 @allow_cross_origin
 @as_geojson
 def get_university_geojson_by_id(db: Database, uni_id: str):
@@ -67,6 +75,7 @@ def get_university_geojson_by_id(db: Database, uni_id: str):
     return q
 
 
+@measured
 @allow_cross_origin
 def ping_database(db: Database):
     """
@@ -81,30 +90,45 @@ def ping_database(db: Database):
     return data
 
 
+@measured
 @allow_cross_origin
-@as_geojson
-def list_all_uni_as_geo_json(db: Database):
+def list_all_uni_as_geo_json(db: Database, accept_encoding: Header, if_none_match: Header):
     """
+    Serves the pre-encoded payload, compressed with brotli or gzip if the client accepts it
     :param db: Server side parameter
+    :param accept_encoding: Accept-Encoding header
+    :param if_none_match: If-None-Match header
     :return: GeoJson with every universities
     """
-    q = db.list_all_uni()
-    return q
+    payload = db.list_all_uni_payload()
+    if isinstance(payload, Response):
+        return payload
+    return payload.response(accept_encoding, if_none_match)
 
 
+@measured
 @allow_cross_origin
-def search_by_all(db: Database, text):
+def search_by_all(db: Database, qp: QueryParams, text):
     """
     Full text search in "land", "by" and "universitet" in mongo,
-    returns GeoJson of universities sorted by textScore
+    returns a page of universities sorted by textScore
+    E.g: /search_by_all/oslo?limit=20&cursor=<next from the previous page>
     :param db: Server side parameter
+    :param qp: params to the request
+        :qp limit: int, universities per page, max 100
+        :qp cursor: str, next from the previous page
     :param text: str of search
-    :return: GeoJson with every universities
+    :return: {'results': list of universities, 'next': cursor or null on the last page}
     """
-    q = db.search_by_all(text.encode('latin-1').decode('utf-8'))
+    try:
+        limit = min(max(int(qp.get('limit', 20)), 1), 100)
+    except ValueError:
+        return Response({'reason': 'limit must be an integer'}, status=400)
+    q = db.search_by_all(text.encode('latin-1').decode('utf-8'), limit, qp.get('cursor'))
     return q
 
 
+@measured
 @allow_cross_origin
 @as_geojson
 def uni_in_country(db: Database, country):
@@ -129,6 +153,7 @@ def uni_in_country(db: Database, country):
     return qq
 
 
+@measured
 @allow_cross_origin
 def get_fagomraader(db: Database, search: str):
     """
@@ -143,6 +168,22 @@ def get_fagomraader(db: Database, search: str):
     return q
 
 
+@measured
+@allow_cross_origin
+def get_raw_html(db: Database, uni_id: str):
+    """
+    Returns the scraped html of the university, not included in the other responses
+    :param db: Server side parameter
+    :param uni_id: str of university id
+    :return: {'raw_html': str or null}
+    """
+    raw_html = db.get_raw_html(uni_id)
+    if isinstance(raw_html, Response):
+        return raw_html
+    return {'raw_html': raw_html}
+
+
+@measured
 @allow_cross_origin
 def get_reports_for_university(db: Database, _id: str):
     """
@@ -155,35 +196,91 @@ def get_reports_for_university(db: Database, _id: str):
     return q
 
 
+@measured
 @allow_cross_origin
-def advanced_search(params: QueryParams):
+def insert_report(db: Database, uni_id: str, report: RequestData):
     """
-    TODO
-    :param params:
-        :params fagområde:
-        :params land:
-        :params by:
-        :params :
-    :return:
+    Stores a new report for the university, the ratings and money stats are updated right away
+    E.g: POST /insert_report/<uni_id> with {"Vil du anbefale andre å reise til studiestedet?": "ja", ...}
+    :param db: Server side parameter
+    :param uni_id: str of university id
+    :param report: json object of question -> answer
+    :return: {'report_id': str}
+    """
+    report_id = db.insert_report(uni_id, report)
+    if isinstance(report_id, Response):
+        return report_id
+    return {'report_id': report_id}
+
+
+@measured
+@allow_cross_origin
+def update_report(db: Database, report_id: str, changes: RequestData):
+    """
+    Changes answers in a report
+    E.g: POST /update_report/<report_id> with {"Hvordan vil du rangere den sosiale opplevelsen?": "4"}
+    :param db: Server side parameter
+    :param report_id: str of report id
+    :param changes: json object of question -> new answer
+    :return: message
+    """
+    message = db.update_report(report_id, changes)
+    if isinstance(message, Response):
+        return message
+    return {'message': message}
+
+
+@measured
+@allow_cross_origin
+def advanced_search(db: Database, params: QueryParams):
     """
-    return params.keys()
+    Faceted search, the map can load only the matching universities
+    E.g: /advanced_search?land=Norge&land=Sverige&fagområde=Teknologi&min_reports=2&sort=star_count
+    :param db: Server side parameter
+    :param params:
+        :params fagområde: any of the given, can be repeated
+        :params land: any of the given, can be repeated
+        :params by: any of the given, can be repeated
+        :params min_reports: int, minimum rapporter_antall
+        :params min_stars: int, minimum star_count
+        :params sort: rapporter_antall (default), star_count or universitet
+        :params limit: int, universities per page, max 500
+        :params cursor: str, next from the previous page
+    :return: GeoJson FeatureCollection with facets, the counts of every fagområde, land and by,
+        total and next
+    """
+    filters = {
+        'Fagområde': params.get_list('fagområde') + params.get_list('fagomraade'),
+        'land': params.get_list('land'),
+        'by': params.get_list('by'),
+    }
+    try:
+        for name in ('min_reports', 'min_stars'):
+            filters[name] = int(params.get(name, 0))
+        limit = min(max(int(params.get('limit', 50)), 1), 500)
+    except ValueError:
+        return Response({'reason': 'min_reports, min_stars and limit must be integers'}, status=400)
+    q = db.advanced_search(filters, params.get('sort', 'rapporter_antall'), limit, params.get('cursor'))
+    return q
 
 
+@measured
 @allow_cross_origin
 @as_geojson
 def search_universities(db: Database, search: str):
     """
     Used for search completion,
-    Uses full text search to match the search, then return the
-    top five result.
+    Matches the search in the in-memory autocomplete index, then return the
+    top six result.
     :param db: Server side parameter
     :param search: str of search (country, city or university)
     :return: List of universities
     """
-    q = db.search_universities(search)
+    q = db.search_universities(search.encode('latin-1').decode('utf-8'))
     return q
 
 
+@measured
 @allow_cross_origin
 def create_or_get_user(db: Database, email: str):
     """
@@ -196,6 +293,7 @@ def create_or_get_user(db: Database, email: str):
     return user
 
 
+@measured
 @allow_cross_origin
 def add_uni_to_cart(db: Database, email: str, uni_id: str):
     """
@@ -203,12 +301,14 @@ def add_uni_to_cart(db: Database, email: str, uni_id: str):
     :param db: Server side parameter
     :param email: str
     :param uni_id: str of the university id
-    :return: updated user
+    :return: what changed, {'message': 'ok', 'added': {'uni_id', 'notes', 'links', 'star_count'}},
+        or {'message': reason}
     """
-    user = db.add_uni_to_cart(email, uni_id)
-    return user
+    delta = db.add_uni_to_cart(email, uni_id)
+    return delta if isinstance(delta, (dict, Response)) else {'message': delta}
 
 
+@measured
 @allow_cross_origin
 def remove_uni_from_cart(db: Database, email: str, uni_id: str):
     """
@@ -216,12 +316,13 @@ def remove_uni_from_cart(db: Database, email: str, uni_id: str):
     :param db: Server side parameter
     :param email: str
     :param uni_id: str of university id
-    :return: updated user
+    :return: what changed, {'message': 'ok', 'removed': {'uni_id'}}, or {'message': reason}
     """
-    user = db.remove_uni_from_cart(email, uni_id)
-    return user
+    delta = db.remove_uni_from_cart(email, uni_id)
+    return delta if isinstance(delta, (dict, Response)) else {'message': delta}
 
 
+@measured
 @allow_cross_origin
 def add_link_or_note(db: Database, qp: QueryParams, email: str):
     """
@@ -235,16 +336,18 @@ def add_link_or_note(db: Database, qp: QueryParams, email: str):
         :qp note: str
         :qp link: str
     :param email: str
-    :return: message
+    :return: what changed, {'message': 'ok', 'added': {'uni_id', 'notes' or 'links': [[id, {...}]]}},
+        or {'message': reason}
     """
     uni_id = qp.get('uni_id')
     head = qp.get('head')
     note = qp.get('note')
     link = qp.get('link')
-    message = db.add_link_or_note(email, uni_id, head, note, link)
-    return {'message': message}
+    delta = db.add_link_or_note(email, uni_id, head, note, link)
+    return delta if isinstance(delta, (dict, Response)) else {'message': delta}
 
 
+@measured
 @allow_cross_origin
 def remove_link_or_note(db: Database, qp: QueryParams, email: str):
     """
@@ -255,15 +358,17 @@ def remove_link_or_note(db: Database, qp: QueryParams, email: str):
         :qp note_id: str
         :qp link_id: str
     :param email: str
-    :return: message
+    :return: what changed, {'message': 'ok', 'removed': {'uni_id', 'notes' or 'links': [id]}},
+        or {'message': reason}
     """
     uni_id = qp.get('uni_id')
     note_id = qp.get('note_id')
     link_id = qp.get('link_id')
-    message = db.remove_link_or_note(email, uni_id, note_id, link_id)
-    return {'message': message}
+    delta = db.remove_link_or_note(email, uni_id, note_id, link_id)
+    return delta if isinstance(delta, (dict, Response)) else {'message': delta}
 
 
+@measured
 @allow_cross_origin
 def get_university_and_score(db: Database):
     """
@@ -278,6 +383,7 @@ def get_university_and_score(db: Database):
     return universities_and_score
 
 
+@measured
 @allow_cross_origin
 def get_choropleth_countries(db: Database):
     """
@@ -289,6 +395,7 @@ def get_choropleth_countries(db: Database):
     return countries
 
 
+@measured
 @allow_cross_origin
 def get_money_for_uni(db: Database, uni_id):
     """
@@ -301,18 +408,49 @@ def get_money_for_uni(db: Database, uni_id):
     return unis
 
 
+@measured
+@allow_cross_origin
+def get_money_for_countries(db: Database):
+    """
+    Returns a list of every country with mean, median, p25, p75 and count of
+        skolepenger
+        boligutgifter
+        ekstra
+    """
+    countries = db.get_money_for_countries()
+    return countries
+
+
+@measured
 @allow_cross_origin
-def get_top_stared_universities(db: Database):
+def get_top_stared_universities(db: Database, qp: QueryParams):
     """
-    Returns top4 universities based on star count
+    Returns the top k universities based on star count
+    E.g: /get_top_stared_universities/?k=10
+    :param db: Server side parameter
+    :param qp: params to the request
+        :qp k: int, number of universities, default 4, max 100
     """
-    top4 = db.get_top_stared_universities()
-    return top4
+    try:
+        k = min(max(int(qp.get('k', 4)), 1), 100)
+    except ValueError:
+        return Response({'reason': 'k must be an integer'}, status=400)
+    top = db.get_top_stared_universities(k)
+    return top
 
 
+@measured
 def update_weather(db: Database):
     """
-    Update the weather for today, can only be run once a day
+    Starts updating the weather for today in the background, can only be run once a day
     """
     message = db.update_weather()
     return {'message': message}
+
+
+@measured
+def get_metrics(db: Database):
+    """
+    Latency of the views, mongo commands and cache hits of this process in the Prometheus text format
+    """
+    return Response(metrics.render(db.cache_stats()).encode('utf-8'), content_type='text/plain; version=0.0.4')
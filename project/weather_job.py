@@ -0,0 +1,167 @@
+"""
+Weather refresh for every university, run as a background job.
+Universities in the same city or grid cell share one provider lookup, lookups run on a bounded
+thread pool with a timeout and retries, and the results are written with one bulk_write.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from pymongo import UpdateOne
+
+from project.search_index import fold
+
+logger = logging.getLogger(__name__)
+
+
+class WeatherProvider:
+    """Looks up the forecast for today at a location"""
+
+    def forecast(self, lat: float, lng: float) -> tuple:
+        """
+        :return: (low, high) in celsius, raises on failure
+        """
+        raise NotImplementedError
+
+
+class YahooWeatherProvider(WeatherProvider):
+    """Forecast from the weather-api package"""
+
+    def __init__(self) -> None:
+        # imported here so the api runs without the package when another provider is used
+        from weather import Weather, Unit
+        self._weather = Weather(unit=Unit.CELSIUS)
+
+    def forecast(self, lat: float, lng: float) -> tuple:
+        today = self._weather.lookup_by_latlng(lat, lng).forecast[0]
+        return int(today.low), int(today.high)
+
+
+class StubWeatherProvider(WeatherProvider):
+    """Fixed forecast without network calls, for tests and benchmarks"""
+
+    def __init__(self, low: int = 5, high: int = 15, delay: float = 0.0) -> None:
+        """
+        :param delay: seconds every lookup takes
+        """
+        self.low = low
+        self.high = high
+        self.delay = delay
+        self.calls = 0
+
+    def forecast(self, lat: float, lng: float) -> tuple:
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self.low, self.high
+
+
+class WeatherJob:
+
+    def __init__(self, provider: WeatherProvider, max_workers: int = 8, timeout: float = 10.0,
+                 retries: int = 2, grid: float = 0.1) -> None:
+        """
+        :param provider: where the forecasts come from
+        :param max_workers: max number of lookups at the same time
+        :param timeout: seconds a lookup can run before it is retried
+        :param retries: number of retries of a failed or timed out lookup
+        :param grid: size in degrees of the grid cells universities without a city are grouped by
+        """
+        self.provider = provider
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.grid = grid
+
+    def locations(self, unis) -> dict:
+        """
+        Groups the universities that can share a lookup
+        :param unis: universities with geometry, land and by
+        :return: location key -> {'lat', 'lng', 'ids'}
+        """
+        locations = {}
+        for uni in unis:
+            try:
+                lng, lat = uni['geometry']['coordinates'][:2]
+            except (KeyError, TypeError, ValueError):
+                logger.warning('university %s has no point geometry', uni.get('_id'))
+                continue
+            city = fold(uni.get('by'))
+            if city:
+                key = ('city', fold(uni.get('land')), city)
+            else:
+                key = ('cell', round(lat / self.grid), round(lng / self.grid))
+            location = locations.setdefault(key, {'lat': lat, 'lng': lng, 'ids': []})
+            location['ids'].append(uni['_id'])
+        return locations
+
+    def fetch(self, locations: dict) -> dict:
+        """
+        Looks up every location, lookups that keep failing are left out.
+        A timed out lookup can not be stopped, it keeps its thread until the provider returns,
+        so at most max_workers lookups run at the same time, timed out or not
+        :param locations: from locations()
+        :return: location key -> (low, high)
+        """
+        forecasts = {}
+        attempts = dict.fromkeys(locations, 0)
+        queue = deque(locations)
+        pending = {}  # future -> (key, started)
+        slots = threading.Semaphore(self.max_workers)
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        def lookup(key):
+            try:
+                return self.provider.forecast(locations[key]['lat'], locations[key]['lng'])
+            finally:
+                slots.release()
+
+        def retry(key):
+            if attempts[key] <= self.retries:
+                queue.append(key)
+
+        try:
+            while queue or pending:
+                while queue and slots.acquire(blocking=False):
+                    key = queue.popleft()
+                    attempts[key] += 1
+                    pending[pool.submit(lookup, key)] = (key, time.monotonic())
+                if not pending:
+                    # every thread is stuck in a timed out lookup
+                    if not slots.acquire(timeout=self.timeout):
+                        logger.warning('weather lookups are stuck, %d locations left out', len(queue))
+                        break
+                    slots.release()
+                    continue
+                first = min(started for _, started in pending.values())
+                done, _ = wait(pending, timeout=max(first + self.timeout - time.monotonic(), 0),
+                               return_when=FIRST_COMPLETED)
+                now = time.monotonic()
+                for future, (key, started) in list(pending.items()):
+                    if future in done:
+                        del pending[future]
+                        try:
+                            forecasts[key] = future.result()
+                        except Exception:
+                            logger.warning('weather lookup of %s failed', key, exc_info=True)
+                            retry(key)
+                    elif now - started > self.timeout:
+                        # the late result is ignored
+                        del pending[future]
+                        retry(key)
+        finally:
+            pool.shutdown(wait=False)
+        return forecasts
+
+    def run(self, unis) -> list:
+        """
+        :param unis: universities with geometry, land and by
+        :return: UpdateOne operations setting weather on the universities
+        """
+        locations = self.locations(unis)
+        forecasts = self.fetch(locations)
+        return [UpdateOne({'_id': uni_id}, {'$set': {'weather': {'min': low, 'high': high}}})
+                for key, (low, high) in forecasts.items()
+                for uni_id in locations[key]['ids']]
@@ -0,0 +1,14 @@
+import pytest
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """
+    Database on an in-memory mongomock server, a new server per test
+    """
+    mongomock = pytest.importorskip('mongomock')
+    from project import mongo_db
+
+    server = mongomock.MongoClient()
+    monkeypatch.setattr(mongo_db, 'MongoClient', lambda *args, **kwargs: server)
+    return mongo_db.Database('mongodb://localhost:27017/', 'gib_test', 'uni', 'world_countries', 'rapporter', 'users')
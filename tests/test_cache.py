@@ -0,0 +1,165 @@
+import datetime
+import threading
+import time
+
+import pytest
+
+from project.cache import Cache, Lease, SingleFlight
+
+mongomock = pytest.importorskip('mongomock')
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().db.cache
+
+
+class Computation:
+    def __init__(self, *values) -> None:
+        self.values = list(values)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.values[min(self.calls, len(self.values)) - 1]
+
+
+def wait_for(condition, timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def run_concurrently(flight: SingleFlight, compute, callers: int = 8) -> list:
+    """
+    Calls flight.do('key', compute) from callers threads while the first call is running
+    :return: the result or the exception of every caller
+    """
+    started, release = threading.Event(), threading.Event()
+    results = [None] * callers
+
+    def blocking_compute():
+        started.set()
+        release.wait(2)
+        return compute()
+
+    def call(i):
+        try:
+            results[i] = flight.do('key', blocking_compute)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(0,))]
+    threads[0].start()
+    started.wait(2)
+    threads += [threading.Thread(target=call, args=(i,)) for i in range(1, callers)]
+    for thread in threads[1:]:
+        thread.start()
+    # the waiters are blocked on the running call before it finishes
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+    return results
+
+
+def test_single_flight_shares_one_computation():
+    compute = Computation(object())
+    results = run_concurrently(SingleFlight(), compute)
+    assert compute.calls == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_single_flight_raises_the_error_in_every_caller():
+    error = ValueError('mongo said no')
+
+    def compute():
+        raise error
+
+    flight = SingleFlight()
+    results = run_concurrently(flight, compute)
+    assert all(result is error for result in results)
+    # the failed call is forgotten, the next caller computes again
+    assert flight.do('key', lambda: 'retried') == 'retried'
+
+
+def test_get_or_compute_stores_the_value_once(collection):
+    cache = Cache(collection)
+    compute = Computation(42)
+    assert cache.get_or_compute('answer', compute, datasets=('uni',)) == 42
+    assert cache.get_or_compute('answer', compute, datasets=('uni',)) == 42
+    assert compute.calls == 1
+    assert cache.stats() == {'hits': 1, 'stale_hits': 0, 'misses': 1}
+    assert collection.find_one({'_id': 'answer'})['versions'] == {'uni': 0}
+
+
+def test_bump_serves_the_stale_value_while_it_is_recomputed(collection):
+    cache = Cache(collection)
+    compute = Computation(1, 2)
+    cache.get_or_compute('count', compute, datasets=('uni', 'reports'))
+    cache.bump('reports')
+    assert cache.versions() == {'reports': 1}
+    # stale while revalidate, the old value right away and the new one computed in the background
+    assert cache.get_or_compute('count', compute, datasets=('uni', 'reports')) == 1
+    wait_for(lambda: collection.find_one({'_id': 'count'})['value'] == 2)
+    assert collection.find_one({'_id': 'count'})['versions'] == {'uni': 0, 'reports': 1}
+    assert cache.get_or_compute('count', compute, datasets=('uni', 'reports')) == 2
+    assert compute.calls == 2
+    assert cache.stale_hits == 1
+
+
+def test_bump_of_another_dataset_keeps_the_entry_fresh(collection):
+    cache = Cache(collection)
+    compute = Computation(1, 2)
+    cache.get_or_compute('count', compute, datasets=('uni',))
+    cache.bump('reports')
+    assert cache.get_or_compute('count', compute, datasets=('uni',)) == 1
+    assert cache.stats()['stale_hits'] == 0
+
+
+def test_expired_entries_are_refreshed(collection):
+    cache = Cache(collection)
+    compute = Computation(1, 2)
+    cache.get_or_compute('count', compute, ttl=60)
+    collection.update_one({'_id': 'count'}, {'$set': {'expires': datetime.datetime.utcnow()}})
+    assert cache.get_or_compute('count', compute, ttl=60) == 1
+    wait_for(lambda: collection.find_one({'_id': 'count'})['value'] == 2)
+
+
+def test_missing_entry_computed_by_another_worker_is_waited_for(collection):
+    cache = Cache(collection)
+    cache.POLL_INTERVAL = 0.01
+    other = Lease(collection)
+    assert other.acquire('count')
+
+    def other_worker():
+        time.sleep(0.05)
+        Cache(collection).set('count', 7)
+        other.release('count')
+
+    threading.Thread(target=other_worker).start()
+    compute = Computation(1)
+    assert cache.get_or_compute('count', compute) == 7
+    assert compute.calls == 0
+
+
+def test_lease_is_exclusive_until_released_or_expired(collection):
+    first, second = Lease(collection, ttl=60), Lease(collection, ttl=60)
+    assert first.acquire('job')
+    # the live lease makes the upsert a duplicate _id
+    assert not second.acquire('job')
+    assert second.held('job')
+    # only the owner can release it
+    second.release('job')
+    assert not second.acquire('job')
+    first.release('job')
+    assert not first.held('job')
+    assert second.acquire('job')
+
+    # a lease of a crashed worker is taken over when it expires
+    collection.update_one({'_id': 'lease:job'}, {'$set': {'expires': datetime.datetime.utcnow()
+                                                           - datetime.timedelta(seconds=1)}})
+    assert not first.held('job')
+    assert first.acquire('job')
+    assert collection.find_one({'_id': 'lease:job'})['owner'] == first.owner
@@ -0,0 +1,78 @@
+import pytest
+from bson import ObjectId
+
+EMAIL = 'ola@stud.ntnu.no'
+
+
+@pytest.fixture
+def cart(db):
+    """a user and a university with one star, the id of the university"""
+    uni_id = ObjectId()
+    db._uni.insert_one({'_id': uni_id, 'universitet': 'NTNU', 'star_count': 1})
+    db._uni_ids.refresh()
+    db.get_or_create_user(EMAIL)
+    return str(uni_id)
+
+
+def saved(db, uni_id):
+    return db._users.find_one({'_id': EMAIL})['my_universities'].get(uni_id)
+
+
+def test_add_and_remove_a_university(db, cart):
+    assert db.add_uni_to_cart(EMAIL, cart) == {
+        'message': 'ok', 'added': {'uni_id': cart, 'notes': [], 'links': [], 'star_count': 2}}
+    assert saved(db, cart) == {'notes': {}, 'links': {}}
+    assert db.add_uni_to_cart(EMAIL, cart) == 'university already added'
+    assert db._uni.find_one({'_id': ObjectId(cart)})['star_count'] == 2
+
+    assert db.remove_uni_from_cart(EMAIL, cart) == {'message': 'ok', 'removed': {'uni_id': cart}}
+    assert saved(db, cart) is None
+    assert db.remove_uni_from_cart(EMAIL, cart) == 'uni_id not found'
+
+
+def test_cart_messages(db, cart):
+    assert db.add_uni_to_cart(EMAIL, str(ObjectId())) == 'university_id not found'
+    assert db.add_uni_to_cart('kari@stud.ntnu.no', cart) == 'user not found'
+    assert db.remove_uni_from_cart('kari@stud.ntnu.no', cart) == 'user not found'
+    assert db.remove_uni_from_cart(EMAIL, 'a.b') == 'university_id not found'
+    assert db.remove_link_or_note(EMAIL, cart, '0', None) == 'uni_id not found'
+    assert db.add_link_or_note(EMAIL, cart, 'head', 'note', None) == 'uni_id not found'
+
+
+def test_a_university_that_is_gone_can_be_removed(db, cart):
+    db.add_uni_to_cart(EMAIL, cart)
+    note_id = db.add_link_or_note(EMAIL, cart, 'head', 'note', None)['added']['notes'][0][0]
+    db._uni.delete_one({'_id': ObjectId(cart)})
+    db._uni_ids.refresh()
+    assert db.remove_link_or_note(EMAIL, cart, note_id, None) == {
+        'message': 'ok', 'removed': {'uni_id': cart, 'notes': [note_id]}}
+    assert db.remove_uni_from_cart(EMAIL, cart) == {'message': 'ok', 'removed': {'uni_id': cart}}
+
+
+def test_add_and_remove_notes_and_links(db, cart):
+    db.add_uni_to_cart(EMAIL, cart)
+    added = db.add_link_or_note(EMAIL, cart, 'Bolig', 'billig', None)
+    (note_id, note), = added.pop('added').pop('notes')
+    assert added == {'message': 'ok'}
+    assert note == {'head': 'Bolig', 'note': 'billig'}
+    other_id = db.add_link_or_note(EMAIL, cart, 'Mat', 'dyrt', None)['added']['notes'][0][0]
+    assert other_id != note_id
+    added = db.add_link_or_note(EMAIL, cart, 'Side', None, 'https://ntnu.no')
+    (link_id, link), = added['added']['links']
+    assert link == {'head': 'Side', 'link': 'https://ntnu.no'}
+    assert saved(db, cart) == {'notes': {note_id: note, other_id: {'head': 'Mat', 'note': 'dyrt'}},
+                               'links': {link_id: link}}
+
+    assert db.remove_link_or_note(EMAIL, cart, note_id, None) == {
+        'message': 'ok', 'removed': {'uni_id': cart, 'notes': [note_id]}}
+    assert db.remove_link_or_note(EMAIL, cart, note_id, None) == 'note_id not found'
+    assert db.remove_link_or_note(EMAIL, cart, None, '7') == 'link_id not found'
+    assert db.remove_link_or_note(EMAIL, cart, '$set', None) == 'note_id not found'
+    assert list(saved(db, cart)['notes']) == [other_id]
+
+
+def test_numbered_notes_from_before_can_be_removed(db, cart):
+    db.add_uni_to_cart(EMAIL, cart)
+    db._users.update_one({'_id': EMAIL}, {'$set': {f'my_universities.{cart}.notes.0': {'head': 'old'}}})
+    assert db.remove_link_or_note(EMAIL, cart, '0', None) == {
+        'message': 'ok', 'removed': {'uni_id': cart, 'notes': ['0']}}
@@ -0,0 +1,24 @@
+import base64
+import json
+
+import pytest
+from apistar.http import Response
+
+
+def encode(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+INVALID = ['not base64!', encode({}), encode({'a': 1}), encode([]), encode(['x']), encode('text'), encode(1)]
+
+
+@pytest.mark.parametrize('cursor', INVALID + [encode([1.0, 'not an id'])])
+def test_search_by_all_rejects_invalid_cursors(db, cursor):
+    q = db.search_by_all('oslo', 20, cursor)
+    assert isinstance(q, Response) and q.status == 400
+
+
+@pytest.mark.parametrize('cursor', INVALID + [encode(['star_count', [1]]), encode(['rapporter_antall', 1])])
+def test_advanced_search_rejects_invalid_cursors(db, cursor):
+    q = db.advanced_search({}, 'rapporter_antall', 50, cursor)
+    assert isinstance(q, Response) and q.status == 400
@@ -0,0 +1,77 @@
+from bson import ObjectId
+
+from project.facets import FacetIndex
+
+
+UNIS = [
+    {'_id': 1, 'universitet': 'NTNU', 'Fagområde': ['Teknologi', 'Fysikk'], 'land': 'Norge', 'by': 'Trondheim',
+     'rapporter_antall': 5, 'star_count': 1},
+    {'_id': 2, 'universitet': 'KTH', 'Fagområde': 'Teknologi', 'land': 'Sverige', 'by': 'Stockholm',
+     'rapporter_antall': 2},
+    {'_id': 3, 'universitet': 'UiO', 'Fagområde': 'Jus', 'land': 'Norge', 'by': 'Oslo',
+     'rapporter_antall': 8, 'star_count': 4},
+]
+
+
+def names(page):
+    return [feature['properties']['university'] for feature in page['features']]
+
+
+def test_filters_and_facets():
+    """
+    Facet counts of a dimension ignore the filter on that dimension
+    """
+    index = FacetIndex(UNIS)
+    page = index.search({'land': ['norge'], 'min_reports': 3})
+    assert names(page) == ['UiO', 'NTNU']
+    assert page['total'] == 2
+    assert page['facets']['land'] == [{'value': 'Norge', 'count': 2}]
+    page = index.search({'Fagområde': ['Teknologi'], 'land': ['Norge']})
+    assert names(page) == ['NTNU']
+    assert page['facets']['land'] == [{'value': 'Norge', 'count': 1}, {'value': 'Sverige', 'count': 1}]
+    assert index.search({'min_stars': 2})['total'] == 1
+
+
+def test_pages_follow_the_sort():
+    index = FacetIndex(UNIS)
+    first = index.search({}, sort='universitet', limit=2)
+    assert names(first) == ['KTH', 'NTNU']
+    second = index.search({}, sort='universitet', limit=2, after=first['next'])
+    assert names(second) == ['UiO']
+    assert second['next'] is None
+
+
+def test_set_stars_updates_the_filter_sort_and_features():
+    index = FacetIndex(UNIS)
+    page = index.search({}, sort='star_count')
+    assert names(page) == ['UiO', 'NTNU', 'KTH']
+    index.set_stars('2', 5)
+    page = index.search({}, sort='star_count')
+    assert names(page) == ['KTH', 'UiO', 'NTNU']
+    assert page['features'][0]['properties']['star_count'] == 5
+    assert names(index.search({'min_stars': 5})) == ['KTH']
+    assert names(index.search({'min_stars': 2}, sort='star_count')) == ['KTH', 'UiO']
+    # fewer stars again
+    index.set_stars('2', 0)
+    assert names(index.search({'min_stars': 1}, sort='star_count')) == ['UiO', 'NTNU']
+    assert names(index.search({}, sort='star_count')) == ['UiO', 'NTNU', 'KTH']
+    index.set_stars('unknown', 3)
+
+
+def test_set_stars_matches_a_new_index():
+    index = FacetIndex(UNIS)
+    index.set_stars('1', 7)
+    stars = [{**uni, 'star_count': 7} if uni['_id'] == 1 else uni for uni in UNIS]
+    rebuilt = FacetIndex(stars)
+    for minimum in range(9):
+        assert index.search({'min_stars': minimum}, sort='star_count') == \
+            rebuilt.search({'min_stars': minimum}, sort='star_count')
+
+
+def test_a_star_updates_the_facet_index_without_a_rebuild(db):
+    uni_id = ObjectId()
+    db._uni.insert_one({'_id': uni_id, 'universitet': 'NTNU', 'land': 'Norge', 'rapporter_antall': 1})
+    index = db._facet_index()
+    db._add_star_to_university(str(uni_id))
+    assert db._facet_index() is index
+    assert names(index.search({'min_stars': 1})) == ['NTNU']
@@ -0,0 +1,87 @@
+from apistar.http import Response
+from pymongo.errors import ServerSelectionTimeoutError
+
+from project import health
+from project.health import CircuitBreaker, MongoHealth
+from project.mongo_db import fail_fast
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_circuit_opens_half_opens_and_closes(monkeypatch):
+    """
+    closed -> open after failure_threshold failures, half_open after reset_timeout
+    with one trial call, closed again when the trial call succeeds
+    """
+    clock = Clock()
+    monkeypatch.setattr(health.time, 'monotonic', clock)
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.allow() and breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.now += 10
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    # the trial call is running, the next calls still fail fast
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_trial_call_opens_the_circuit_again(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(health.time, 'monotonic', clock)
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10)
+    breaker.trip()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+class Methods:
+    def __init__(self) -> None:
+        self._health = MongoHealth(CircuitBreaker(failure_threshold=1))
+        self.calls = 0
+
+    @fail_fast
+    def read(self):
+        self.calls += 1
+        raise ServerSelectionTimeoutError('no servers')
+
+
+def test_fail_fast_returns_503_without_calling_mongo_while_open():
+    methods = Methods()
+    first = methods.read()
+    assert isinstance(first, Response) and first.status == 503
+    second = methods.read()
+    assert isinstance(second, Response) and second.status == 503
+    assert methods.calls == 1
+
+
+def test_derived_structures_do_not_touch_mongo_while_the_circuit_is_open(db, monkeypatch):
+    db._uni.insert_one({'_id': 1, 'universitet': 'NTNU', 'by': 'Trondheim', 'land': 'Norge',
+                        'geometry': {'type': 'Point', 'coordinates': [10.4, 63.4]}, 'rapporter_antall': 1})
+    index = db._autocomplete_index()
+
+    def versions():
+        raise AssertionError('mongo was read while the circuit is open')
+
+    monkeypatch.setattr(db._cache, 'versions', versions)
+    db._health.breaker.trip()
+    db._memo.clear()
+    assert db._autocomplete_index() is index
+    first = db._facet_index()
+    assert isinstance(first, Response) and first.status == 503
@@ -0,0 +1,81 @@
+from apistar.http import Response
+
+from project import memo
+from project.memo import LRUCache, invalidates, memoize
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(memo.time, 'monotonic', clock)
+    cache = LRUCache(ttl=60)
+    cache.set('key', 'value')
+    clock.now += 60
+    assert cache.get('key') == (True, 'value')
+    clock.now += 1
+    assert cache.get('key') == (False, None)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, 1)
+    assert cache.get('c') == (True, 3)
+    assert cache.stats() == {'size': 2, 'hits': 3, 'misses': 1, 'evictions': 1}
+
+
+def test_invalidate_drops_entries_with_any_of_the_tags():
+    cache = LRUCache()
+    cache.set('unis', 1, tags=('uni',))
+    cache.set('stars', 2, tags=('stars',))
+    cache.set('both', 3, tags=('uni', 'stars'))
+    cache.invalidate('stars', 'reports')
+    assert cache.get('unis') == (True, 1)
+    assert cache.get('stars') == (False, None)
+    assert cache.get('both') == (False, None)
+
+
+class Methods:
+    def __init__(self) -> None:
+        self._memo = LRUCache()
+        self.reads = 0
+        self.down = False
+
+    @memoize('uni')
+    def read(self, key):
+        self.reads += 1
+        if self.down:
+            return Response({'reason': 'Database is down'}, status=503)
+        return {'key': key, 'reads': self.reads}
+
+    @invalidates('uni')
+    def write(self):
+        pass
+
+
+def test_memoize_caches_per_arguments_until_a_write():
+    methods = Methods()
+    assert methods.read(1) is methods.read(1)
+    methods.read(2)
+    assert methods.reads == 2
+    methods.write()
+    assert methods.read(1)['reads'] == 3
+
+
+def test_memoize_does_not_cache_responses():
+    methods = Methods()
+    methods.down = True
+    assert isinstance(methods.read(1), Response)
+    methods.down = False
+    assert methods.read(1) == {'key': 1, 'reads': 2}
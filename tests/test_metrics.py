@@ -0,0 +1,105 @@
+from types import SimpleNamespace
+
+import pytest
+from apistar.http import Response
+
+from project import metrics
+from project.metrics import Counter, Histogram, MongoMetrics, measured
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, 'a')
+    histogram.observe(0.2, 'b')
+    assert histogram.render() == [
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{route="a",le="0.1"} 2',
+        'latency_seconds_bucket{route="a",le="1.0"} 3',
+        'latency_seconds_bucket{route="a",le="+Inf"} 4',
+        'latency_seconds_sum{route="a"} 3.65',
+        'latency_seconds_count{route="a"} 4',
+        'latency_seconds_bucket{route="b",le="0.1"} 0',
+        'latency_seconds_bucket{route="b",le="1.0"} 1',
+        'latency_seconds_bucket{route="b",le="+Inf"} 1',
+        'latency_seconds_sum{route="b"} 0.2',
+        'latency_seconds_count{route="b"} 1',
+    ]
+
+
+def test_counter_and_escaped_labels():
+    counter = Counter('commands_total', 'Commands', ('collection', 'command'))
+    counter.inc('uni', 'find')
+    counter.inc('uni', 'find', amount=2)
+    counter.inc('a"b\\c\nd', 'insert')
+    assert counter.render() == [
+        '# HELP commands_total Commands',
+        '# TYPE commands_total counter',
+        'commands_total{collection="a\\"b\\\\c\\nd",command="insert"} 1',
+        'commands_total{collection="uni",command="find"} 3',
+    ]
+
+
+@pytest.fixture
+def fresh_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, 'REQUEST_SECONDS', Histogram('gib_request_duration_seconds', 'Latency of the views',
+                                                              ('route', 'status')))
+    monkeypatch.setattr(metrics, 'MONGO_SECONDS', Histogram('gib_mongo_command_duration_seconds',
+                                                            'Latency of the mongo commands', ('collection', 'command')))
+    monkeypatch.setattr(metrics, 'MONGO_COMMANDS', Counter('gib_mongo_commands_total', 'Mongo commands',
+                                                           ('collection', 'command', 'outcome')))
+
+
+def test_measured_records_the_status(fresh_metrics):
+    @measured
+    def found():
+        return {}
+
+    @measured
+    def missing():
+        return Response({}, status=404)
+
+    @measured
+    def broken():
+        raise ValueError
+
+    found()
+    missing()
+    with pytest.raises(ValueError):
+        broken()
+    text = metrics.render({})
+    assert 'gib_request_duration_seconds_count{route="found",status="200"} 1' in text
+    assert 'gib_request_duration_seconds_count{route="missing",status="404"} 1' in text
+    assert 'gib_request_duration_seconds_count{route="broken",status="500"} 1' in text
+
+
+def test_mongo_commands_are_counted_by_collection(fresh_metrics):
+    def event(command_name, request_id, **fields):
+        return SimpleNamespace(command_name=command_name, request_id=request_id, connection_id=('host', 1), **fields)
+
+    listener = MongoMetrics()
+    listener.started(event('find', 1, command={'find': 'uni'}))
+    listener.started(event('ping', 2, command={'ping': 1}))
+    listener.succeeded(event('find', 1, duration_micros=2000))
+    listener.failed(event('ping', 2, duration_micros=20))
+    text = metrics.render({})
+    assert 'gib_mongo_commands_total{collection="uni",command="find",outcome="succeeded"} 1' in text
+    assert 'gib_mongo_commands_total{collection="",command="ping",outcome="failed"} 1' in text
+    assert 'gib_mongo_command_duration_seconds_bucket{collection="uni",command="find",le="0.001"}' not in text
+    assert 'gib_mongo_command_duration_seconds_bucket{collection="uni",command="find",le="0.005"} 1' in text
+    assert 'gib_mongo_command_duration_seconds_sum{collection="uni",command="find"} 0.002' in text
+
+
+def test_render_format(fresh_metrics):
+    text = metrics.render({'memo': {'hits': 3, 'misses': 1, 'size': 2}, 'mongo': {'hits': 5, 'misses': 0}})
+    assert text.endswith('\n')
+    lines = text.splitlines()
+    assert lines[lines.index('# TYPE gib_cache_hits_total counter') + 1:][:2] == [
+        'gib_cache_hits_total{cache="memo"} 3',
+        'gib_cache_hits_total{cache="mongo"} 5',
+    ]
+    assert 'gib_cache_misses_total{cache="memo"} 1' in lines
+    assert lines[-2:] == ['# TYPE gib_cache_entries gauge', 'gib_cache_entries{cache="memo"} 2']
+    for line in lines:
+        assert line.startswith(('# HELP ', '# TYPE ')) or line.rsplit(' ', 1)[1].replace('.', '').isdigit()
@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+from project.money import grouped_stats, money_statistics, parse_amounts
+
+
+@pytest.mark.parametrize('answer, amount', [
+    ('12000', 12000),
+    ('12 000', 12000),
+    ('12\xa0000', 12000),
+    ('12_000', 12000),
+    ('12 000 kr', 12000),
+    ('12000KR', 12000),
+    ('Kr 3000', 3000),
+    ('1500,-', 1500),
+    (' 0 \n', 0),
+    # other currencies and anything that is not a whole amount are left out
+    ('€500', None),
+    ('$500', None),
+    ('500 NOK', None),
+    ('500 euro', None),
+    ('1.5', None),
+    ('1,5', None),
+    ('-100', None),
+    ('ca 5000', None),
+    ('5000-6000', None),
+    ('999999999999', 999999999999),
+    ('9999999999999', None),
+    ('99999999999999999999999', None),
+    ('', None),
+    ('kr', None),
+    ('vet ikke', None),
+    (None, None),
+    (5000, None),
+])
+def test_parse_amounts(answer, amount):
+    parsed, = parse_amounts([answer])
+    if amount is None:
+        assert np.isnan(parsed)
+    else:
+        assert parsed == amount
+
+
+def test_parse_amounts_of_nothing():
+    assert parse_amounts([]).size == 0
+
+
+def stats(groups, values, group_count=2, limits=(0, 100)):
+    return grouped_stats(np.array(groups, dtype=np.int64), np.array(values, dtype=float), group_count, limits)
+
+
+@pytest.mark.parametrize('values', [[5], [1, 2], [10, 20, 30], [7, 1, 3, 9, 4], [2, 2, 2, 50]])
+def test_grouped_stats_match_numpy(values):
+    result = stats([0] * len(values), values, group_count=1)
+    assert result['count'][0] == len(values)
+    assert result['mean'][0] == pytest.approx(np.mean(values))
+    for name, p in (('p25', 25), ('median', 50), ('p75', 75)):
+        assert result[name][0] == pytest.approx(np.percentile(values, p))
+
+
+@pytest.mark.parametrize('limits, count, mean', [
+    # the limits themselves are left out
+    ((0, 100), 2, 50),
+    ((10, 100), 1, 90),
+    ((0, 90), 1, 10),
+    ((10, 90), 0, None),
+    ((-1, 101), 4, 50),
+])
+def test_grouped_stats_leave_out_values_outside_the_limits(limits, count, mean):
+    result = stats([0, 0, 0, 0], [0, 10, 90, 100], group_count=1, limits=limits)
+    assert result['count'][0] == count
+    if mean is None:
+        assert np.isnan(result['mean'][0]) and np.isnan(result['median'][0])
+    else:
+        assert result['mean'][0] == mean
+
+
+def test_grouped_stats_are_per_group_and_sorted():
+    result = stats([1, 0, 1, 1, 0], [30, 2, 10, 20, 1], group_count=3)
+    assert list(result['count']) == [2, 3, 0]
+    assert list(result['mean'][:2]) == [1.5, 20]
+    assert np.isnan(result['mean'][2])
+    start, count = result['start'][1], result['count'][1]
+    assert list(result['values'][start:start + count]) == [10, 20, 30]
+
+
+def test_grouped_stats_without_values():
+    result = stats([], [], group_count=2)
+    assert list(result['count']) == [0, 0]
+    assert np.isnan(result['p25']).all()
+
+
+def test_money_statistics_ignores_garbage_and_groups_countries():
+    unis = [
+        {'_id': 1, 'universitet': 'A', 'land': 'Norge',
+         'money': {'boligutgifter': {'samples': {'r1': 4000, 'r2': 6000, 'r3': 99999}}}},
+        {'_id': 2, 'universitet': 'B', 'land': 'Norge', 'money': {'boligutgifter': {'samples': {'r4': 5000}}}},
+        {'_id': 3, 'universitet': 'C', 'land': None, 'money': None},
+    ]
+    result = money_statistics(unis)
+    a, b, c = result['unis']
+    assert a['money_stats']['boligutgifter'] == 5000
+    assert a['money_stats']['boligutgifter_liste'] == [4000, 6000]
+    assert c['money_stats']['boligutgifter'] is None and c['money_stats']['skolepenger_liste'] == []
+    assert 'money' not in a
+    countries = {country['land']: country['money_stats'] for country in result['countries']}
+    assert countries['Norge']['boligutgifter'] == {'count': 3, 'mean': 5000, 'median': 5000, 'p25': 4500, 'p75': 5500}
+    assert countries['']['skolepenger']['count'] == 0
+
+
+def test_money_statistics_limits_override_the_defaults():
+    unis = [{'_id': 1, 'land': 'Norge', 'money': {'ekstra': {'samples': {'r1': 100, 'r2': 900}}}}]
+    uni, = money_statistics(unis, {'ekstra': (0, 500)})['unis']
+    assert uni['money_stats']['ekstra_liste'] == [100]
+
+
+def test_an_answer_too_long_for_an_amount_does_not_break_the_others():
+    assert list(parse_amounts(['99999999999999999999999', '12 000'])[1:]) == [12000]
@@ -0,0 +1,72 @@
+import gzip
+import json
+import threading
+
+import pytest
+
+from project.cache import UNIVERSITIES
+from project.payloads import EncodedPayload, accepted_encodings
+
+DATA = {'type': 'FeatureCollection', 'features': [{'properties': {'university': 'NTNU'}}] * 50}
+
+
+def test_accepted_encodings_leaves_out_q_zero():
+    assert accepted_encodings('gzip, deflate, br') == {'gzip', 'deflate', 'br'}
+    assert accepted_encodings('br;q=0, GZIP;q=0.5, identity;q=bad') == {'gzip'}
+    assert accepted_encodings(None) == set()
+
+
+def test_gzip_when_accepted_else_identity():
+    payload = EncodedPayload(DATA)
+    response = payload.response('gzip, deflate')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.content)) == DATA
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert payload.response('*').headers['Content-Encoding'] == 'gzip'
+    for accept_encoding in (None, 'deflate', 'gzip;q=0'):
+        response = payload.response(accept_encoding)
+        assert 'Content-Encoding' not in response.headers
+        assert json.loads(response.content) == DATA
+
+
+def test_brotli_is_preferred_over_gzip():
+    brotli = pytest.importorskip('brotli')
+    response = EncodedPayload(DATA).response('gzip, br')
+    assert response.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(response.content)) == DATA
+
+
+def test_not_modified_when_the_etag_matches():
+    payload = EncodedPayload(DATA)
+    etag = payload.response().headers['ETag']
+    assert etag.startswith('W/"')
+    for if_none_match in (etag, f'W/"old", {etag}'):
+        response = payload.response('gzip', if_none_match)
+        assert response.status == 304
+        assert response.content == b''
+        assert response.headers['ETag'] == etag
+    assert payload.response('gzip', 'W/"old"').status == 200
+    assert EncodedPayload({**DATA, 'features': []}).etag != etag
+
+
+def test_payload_is_rebuilt_from_mongo_and_not_from_a_stale_memo(db):
+    """
+    Another worker wrote and bumped the version while this worker still memoizes list_all_uni
+    """
+    db._uni.insert_one({'_id': 'ntnu', 'universitet': 'NTNU', 'geometry': {'type': 'Point', 'coordinates': [10.4, 63.4]}})
+    first = db.list_all_uni_payload()
+    assert len(json.loads(first.identity)['features']) == 1
+    db.list_all_uni()
+    db._uni.insert_one({'_id': 'kth', 'universitet': 'KTH', 'geometry': {'type': 'Point', 'coordinates': [18.1, 59.3]}})
+    db._cache.bump(UNIVERSITIES)
+    # the memoized payload of this worker expires before its list_all_uni
+    db._memo._entries.pop(('list_all_uni_payload', (), ()))
+    # served while the new payload is built
+    assert db.list_all_uni_payload() is first
+    for thread in threading.enumerate():
+        if thread.name == 'rebuild-list_all_uni':
+            thread.join()
+    db._memo._entries.pop(('list_all_uni_payload', (), ()))
+    second = db.list_all_uni_payload()
+    assert len(json.loads(second.identity)['features']) == 2
+    assert second.etag != first.etag
@@ -0,0 +1,46 @@
+"""
+Index checks against a mongod loaded with the synthetic dataset,
+run with MONGO_TEST_URI=mongodb://localhost:27017/ pytest
+"""
+import os
+
+import pytest
+
+from project.query_plans import assert_index_backed
+
+MONGO_TEST_URI = os.environ.get('MONGO_TEST_URI')
+pytestmark = pytest.mark.skipif(not MONGO_TEST_URI, reason='needs a mongod, set MONGO_TEST_URI')
+
+
+@pytest.fixture(scope='module')
+def db():
+    from pymongo import MongoClient
+
+    from benchmarks.synthetic import generate, load
+    from project.mongo_db import Database
+
+    data = generate(2000, seed=3)
+    load(MongoClient(MONGO_TEST_URI)['gib_query_plans'], data)
+    database = Database(MONGO_TEST_URI, 'gib_query_plans', 'uni', 'world_countries', 'rapporter', 'users')
+    database.ensure_indexes()
+    database.rebuild_report_stats()
+    database.assign_countries()
+    # loaded here so the id index does not load inside an explained method
+    database._uni_ids.refresh()
+    database.data = data
+    return database
+
+
+def test_lookups_by_id_are_index_backed(db):
+    uni = db.data['uni'][0]
+    assert_index_backed(db, 'get_university_by_id', str(uni['_id']))
+    most_reports = max(db.data['uni'], key=lambda u: u['rapporter_antall'])
+    assert_index_backed(db, 'get_reports_for_university', str(most_reports['_id']))
+    assert_index_backed(db, 'get_or_create_user', db.data['users'][0]['_id'])
+
+
+def test_listings_are_index_backed(db):
+    country = db.data['uni'][0]['land']
+    assert_index_backed(db, 'get_country_list', country)
+    assert_index_backed(db, '_most_stared', 10)
+    assert_index_backed(db, 'search_by_all', db.data['uni'][0]['by'])
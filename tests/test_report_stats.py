@@ -0,0 +1,154 @@
+from bson import ObjectId
+
+from project.report_stats import ACADEMIC, MONEY, RECOMMEND, SOCIAL, combine, mean, rebuild_documents, stats_update
+
+SCHOOL_FEES = MONEY['skolepenger']
+
+
+def test_stats_update_of_an_insert():
+    update = stats_update(new_report={'_id': 'r1', RECOMMEND: 'ja', SOCIAL: '4', ACADEMIC: 'bra',
+                                      SCHOOL_FEES: '12 000 kr'})
+    assert update == {
+        '$inc': {'reports': 1, 'recommend.ja': 1, 'social.sum': 4, 'social.count': 1},
+        '$set': {'money.skolepenger.samples.r1': 12000},
+    }
+
+
+def test_stats_update_moves_a_changed_answer():
+    """
+    Counters that are unchanged are left out, samples that can no longer be parsed are removed
+    """
+    old = {'_id': 'r1', RECOMMEND: 'ja', SOCIAL: '4', SCHOOL_FEES: '12000'}
+    new = {**old, RECOMMEND: 'nei', SOCIAL: '2', SCHOOL_FEES: 'vet ikke'}
+    assert stats_update(old, new) == {
+        '$inc': {'recommend.ja': -1, 'recommend.nei': 1, 'social.sum': -2},
+        '$unset': {'money.skolepenger.samples.r1': True},
+    }
+    assert stats_update(old, old) == {'$set': {'money.skolepenger.samples.r1': 12000}}
+
+
+def test_rebuild_documents_sums_the_reports_of_every_university():
+    r1, r2, r3 = ObjectId(), ObjectId(), ObjectId()
+    reports = [
+        {'_id': r1, RECOMMEND: 'ja', SOCIAL: '5', ACADEMIC: '3', SCHOOL_FEES: '1000'},
+        {'_id': r2, RECOMMEND: 'nei', SOCIAL: '3', SCHOOL_FEES: ''},
+        {'_id': r3, RECOMMEND: 'ja'},
+    ]
+    unis = [{'_id': 1, 'rapporter': [r1, r2]}, {'_id': 2, 'rapporter': [r3, ObjectId()]}, {'_id': 3}]
+    documents = rebuild_documents(unis, reports)
+    assert documents == [
+        {'_id': 1, 'reports': 2, 'recommend': {'ja': 1, 'nei': 1}, 'social': {'sum': 8, 'count': 2},
+         'academic': {'sum': 3, 'count': 1}, 'money': {'skolepenger': {'samples': {str(r1): 1000}}}},
+        {'_id': 2, 'reports': 1, 'recommend': {'ja': 1}},
+        {'_id': 3},
+    ]
+
+
+def test_rebuild_documents_equals_the_inserts():
+    """
+    Backfill and the incremental updates give the same counters
+    """
+    reports = [{'_id': 'r1', RECOMMEND: 'ja', SOCIAL: '5'}, {'_id': 'r2', RECOMMEND: 'ja', SOCIAL: '1'}]
+    inc = {}
+    for report in reports:
+        for path, value in stats_update(new_report=report)['$inc'].items():
+            inc[path] = inc.get(path, 0) + value
+    document = rebuild_documents([{'_id': 1, 'rapporter': ['r1', 'r2']}], reports)[0]
+    assert inc == {'reports': 2, 'recommend.ja': 2, 'social.sum': 6, 'social.count': 2}
+    assert document == {'_id': 1, 'reports': 2, 'recommend': {'ja': 2}, 'social': {'sum': 6, 'count': 2}}
+
+
+def test_combine_sums_counters_without_samples():
+    stats = [
+        {'_id': 1, 'reports': 2, 'recommend': {'ja': 2}, 'social': {'sum': 8, 'count': 2},
+         'money': {'skolepenger': {'samples': {'r1': 1000}}}},
+        {'_id': 2, 'reports': 1, 'recommend': {'ja': 1, 'nei': 1}, 'social': {'sum': 1, 'count': 1}},
+    ]
+    total = combine(stats)
+    assert total == {'reports': 3, 'recommend': {'ja': 3, 'nei': 1}, 'social': {'sum': 9, 'count': 3},
+                     'money': {'skolepenger': {}}}
+    assert mean(total, 'social') == 3
+    assert mean(total, 'academic') is None
+    assert combine([]) == {}
+
+
+def add_university(db, reports=()):
+    uni_id = db._uni.insert_one({'universitet': 'NTNU', 'rapporter': [report['_id'] for report in reports],
+                                 'rapporter_antall': len(reports)}).inserted_id
+    if reports:
+        db._reports.insert_many(reports)
+    db._uni_ids.refresh()
+    return str(uni_id)
+
+
+def test_a_huge_amount_is_left_out_of_the_stats(db):
+    uni_id = add_university(db)
+    report_id = db.insert_report(uni_id, {RECOMMEND: 'ja', SCHOOL_FEES: '99999999999999999999999'})
+    stats = db._report_stats.find_one({'_id': ObjectId(uni_id)})
+    assert stats['reports'] == 1 and 'money' not in stats
+    assert db.rebuild_report_stats() == 1
+    assert isinstance(report_id, str)
+
+def test_insert_and_update_report_keep_report_stats_current(db):
+    uni_id = add_university(db)
+    report_id = db.insert_report(uni_id, {RECOMMEND: 'ja', SOCIAL: '4', SCHOOL_FEES: '5000'})
+    stats = db._report_stats.find_one({'_id': ObjectId(uni_id)})
+    assert stats['reports'] == 1 and stats['recommend'] == {'ja': 1}
+    assert stats['money']['skolepenger']['samples'] == {report_id: 5000}
+    assert db._uni.find_one({'_id': ObjectId(uni_id)})['rapporter_antall'] == 1
+
+    assert db.update_report(report_id, {RECOMMEND: 'nei', SOCIAL: '2'}) == 'ok'
+    stats = db._report_stats.find_one({'_id': ObjectId(uni_id)})
+    assert stats['recommend'] == {'ja': 0, 'nei': 1}
+    assert stats['social'] == {'sum': 2, 'count': 1}
+    assert stats == {**rebuild_documents(db._uni.find(), db._reports.find())[0], 'recommend': {'ja': 0, 'nei': 1}}
+
+
+def test_invalid_reports_are_rejected(db):
+    uni_id = add_university(db)
+    assert db.insert_report(str(ObjectId()), {RECOMMEND: 'ja'}).status == 404
+    assert db.insert_report(uni_id, {'$where': 'ja'}).status == 400
+    assert db.insert_report(uni_id, {RECOMMEND: 5}).status == 400
+    assert db.insert_report(uni_id, []).status == 400
+    assert db.update_report('not an id', {RECOMMEND: 'ja'}).status == 404
+    assert db.update_report(str(ObjectId()), {RECOMMEND: 'ja'}).status == 404
+    assert db._reports.find_one() is None
+
+
+def test_bootstrap_builds_missing_report_stats(db):
+    uni_id = add_university(db, [{'_id': ObjectId(), RECOMMEND: 'ja'}])
+    assert db.bootstrap() == {'report_stats': 1}
+    assert db._report_stats.find_one({'_id': ObjectId(uni_id)})['recommend'] == {'ja': 1}
+    # built already
+    assert db.bootstrap() == {}
+
+
+def test_bootstrap_skips_report_stats_another_worker_builds(db):
+    add_university(db, [{'_id': ObjectId(), RECOMMEND: 'ja'}])
+    assert db._bootstrap_lease.acquire('report_stats')
+    db._bootstrap_lease.owner = 'another worker'
+    assert db.bootstrap() == {}
+    assert not db._report_stats.find_one()
+
+
+def test_rebuilds_write_their_own_temporary_collection(db, monkeypatch):
+    """
+    a rebuild running while another one writes does not drop or collide with its collection
+    """
+    uni_id = add_university(db)
+    db.insert_report(uni_id, {RECOMMEND: 'ja'})
+    insert_many = db._db['x'].insert_many.__func__
+    written = []
+
+    def insert_many_and_rebuild(collection, documents, *args, **kwargs):
+        written.append(collection.name)
+        result = insert_many(collection, documents, *args, **kwargs)
+        if len(written) == 1:
+            assert db.rebuild_report_stats() == 1
+        return result
+
+    monkeypatch.setattr(type(db._db['x']), 'insert_many', insert_many_and_rebuild)
+    assert db.rebuild_report_stats() == 1
+    assert len(set(written)) == 2
+    assert db._report_stats.find_one({'_id': ObjectId(uni_id)})['reports'] == 1
+    assert [name for name in db._db.list_collection_names() if '_rebuild' in name] == []
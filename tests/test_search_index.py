@@ -0,0 +1,97 @@
+import threading
+
+from project.cache import NAMES, REPORTS, UNIVERSITIES
+from project.search_index import AutocompleteIndex, SubjectVocabulary, fold
+
+
+UNIS = [
+    {'_id': 1, 'universitet': 'Universitetet i Tromsø', 'by': 'Tromsø', 'land': 'Norge',
+     'Fagområde': 'Teknologi', 'geometry': {'type': 'Point', 'coordinates': [18.9, 69.6]}, 'rapporter_antall': 3},
+    {'_id': 2, 'universitet': 'Technische Universität München', 'by': 'München', 'land': 'Tyskland',
+     'Fagområde': ['Teknologi', 'Fysikk'], 'geometry': {'type': 'Point', 'coordinates': [11.5, 48.1]},
+     'rapporter_antall': 10},
+    {'_id': 3, 'universitet': 'University of Oslo', 'by': 'Oslo', 'land': 'Norge',
+     'Fagområde': 'Jus', 'geometry': {'type': 'Point', 'coordinates': [10.7, 59.9]}, 'rapporter_antall': 1},
+]
+
+
+def names(features):
+    return [feature['properties']['university'] for feature in features]
+
+
+def test_fold():
+    """
+    Norwegian letters and accents are folded
+    """
+    assert fold('Ærlig TROMSØ på München') == 'aerlig tromso pa munchen'
+
+
+def test_search_matches_folded_prefixes():
+    index = AutocompleteIndex(UNIS)
+    assert names(index.search('tromsø')) == ['Universitetet i Tromsø']
+    assert names(index.search('munchen')) == ['Technische Universität München']
+    assert names(index.search('oslo norge')) == ['University of Oslo']
+
+
+def test_search_matches_inside_words():
+    index = AutocompleteIndex(UNIS)
+    assert set(names(index.search('versit'))) == {u['universitet'] for u in UNIS}
+
+
+def test_search_ranks_by_match_then_reports():
+    """
+    Equal matches are ranked by rapporter_antall
+    """
+    index = AutocompleteIndex(UNIS)
+    assert names(index.search('tek')) == ['Technische Universität München', 'Universitetet i Tromsø']
+    assert len(index.search('u', limit=2)) == 2
+    assert index.search('') == []
+
+
+def test_subjects_ranked_by_match_then_popularity():
+    vocabulary = SubjectVocabulary({'Teknologi': 2, 'Bioteknologi': 5, 'Økonomi og ledelse': 1})
+    assert vocabulary.search(None) == ['Bioteknologi', 'Teknologi', 'Økonomi og ledelse']
+    assert vocabulary.search('tek') == ['Teknologi', 'Bioteknologi']
+    assert vocabulary.search('okonomi') == ['Økonomi og ledelse']
+    assert vocabulary.search('le') == ['Økonomi og ledelse']
+    assert vocabulary.count('Bioteknologi') == 5
+
+
+def test_search_returns_the_most_reported_of_many_prefix_matches():
+    """
+    only the TOP most reported universities are kept per prefix, the ranking is unchanged
+    """
+    unis = [{'_id': i, 'universitet': f'University {i}', 'by': 'Oslo', 'land': 'Norge', 'Fagområde': 'Jus',
+             'geometry': {'type': 'Point', 'coordinates': [10.7, 59.9]}, 'rapporter_antall': i}
+            for i in range(AutocompleteIndex.TOP * 3)]
+    index = AutocompleteIndex(unis)
+    expected = [f'University {i}' for i in range(len(unis) - 1, len(unis) - 7, -1)]
+    assert names(index.search('univ')) == expected
+    assert names(index.search('university os')) == expected
+    assert names(index.search('niversity 14')) == ['University 149', 'University 148', 'University 147',
+                                                   'University 146', 'University 145', 'University 144']
+
+
+def wait_for_rebuild(name):
+    for thread in threading.enumerate():
+        if thread.name == f'rebuild-{name}':
+            thread.join()
+
+
+def test_autocomplete_is_rebuilt_in_the_background_only_when_the_names_change(db):
+    db._uni.insert_many(UNIS)
+    first = db._autocomplete_index()
+    assert names(first.search('oslo')) == ['University of Oslo']
+
+    db._uni.update_one({'_id': 3}, {'$set': {'universitet': 'Universitetet i Oslo'}})
+    db._cache.bump(UNIVERSITIES, REPORTS)
+    db._memo.clear()
+    assert db._autocomplete_index() is first
+
+    db._cache.bump(NAMES)
+    db._memo.clear()
+    # the old index is served while the new one is built
+    assert db._autocomplete_index() is first
+    wait_for_rebuild('autocomplete')
+    db._memo.clear()
+    assert names(db._autocomplete_index().search('oslo')) == ['Universitetet i Oslo']
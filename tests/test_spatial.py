@@ -0,0 +1,77 @@
+import random
+
+from project.spatial import CountryIndex, STRtree
+
+
+def square(x0, y0, size):
+    return [[x0, y0], [x0 + size, y0], [x0 + size, y0 + size], [x0, y0 + size], [x0, y0]]
+
+
+def test_strtree_finds_the_same_boxes_as_a_scan():
+    rnd = random.Random(1)
+    boxes = []
+    for i in range(500):
+        x, y = rnd.uniform(-180, 170), rnd.uniform(-80, 70)
+        boxes.append((x, y, x + rnd.uniform(0, 10), y + rnd.uniform(0, 10), i))
+    tree = STRtree(boxes, node_capacity=4)
+    for _ in range(200):
+        x, y = rnd.uniform(-180, 180), rnd.uniform(-80, 80)
+        expected = {i for minx, miny, maxx, maxy, i in boxes if minx <= x <= maxx and miny <= y <= maxy}
+        assert set(tree.query_point(x, y)) == expected
+
+
+def test_strtree_without_items():
+    assert STRtree([]).query_point(0, 0) == []
+
+
+def test_country_index_locates_points_in_polygons_with_holes_and_islands():
+    countries = [
+        # a lake in the middle
+        {'geometry': {'type': 'Polygon', 'coordinates': [square(0, 0, 10), square(4, 4, 2)]}},
+        # an island inside the lake, and one more far away
+        {'geometry': {'type': 'MultiPolygon', 'coordinates': [[square(4.5, 4.5, 1)], [square(20, 20, 1)]]}},
+    ]
+    index = CountryIndex(countries)
+    assert index.locate(1, 1) == 0
+    assert index.locate(5, 5) == 1
+    assert index.locate(4.2, 4.2) is None
+    assert index.locate(20.5, 20.5) == 1
+    assert index.locate(15, 15) is None
+
+
+def test_bootstrap_assigns_the_countries_once(db):
+    db._country.insert_one({'properties': {'name': 'Norway'},
+                            'geometry': {'type': 'Polygon', 'coordinates': [square(0, 0, 10)]}})
+    db._uni.insert_many([{'_id': 'inside', 'geometry': {'type': 'Point', 'coordinates': [5, 5]}},
+                         {'_id': 'outside', 'geometry': {'type': 'Point', 'coordinates': [50, 50]}}])
+    # requests do not assign the countries
+    assert db.get_country_list('Norway') == []
+    assert db.bootstrap() == {'countries': 1}
+    assert [uni['_id'] for uni in db.get_country_list('norway')] == ['inside']
+    assert db.bootstrap() == {}
+
+
+def test_choropleth_before_the_countries_are_assigned(db):
+    db._country.insert_one({'properties': {'name': 'Norway'},
+                            'geometry': {'type': 'Polygon', 'coordinates': [square(0, 0, 10)]}})
+    db._uni.insert_one({'_id': 'inside', 'geometry': {'type': 'Point', 'coordinates': [5, 5]}})
+    choropleth = db.get_choropleth_countries()
+    assert choropleth['features'][0]['properties']['report_rating'] == 0
+    assert choropleth['features'][0]['properties']['university_rating'] == 0
+    assert choropleth['report_rating_groups'] == [0]
+
+
+def test_bootstrap_assigns_universities_scraped_after_the_assignment(db):
+    db._country.insert_one({'properties': {'name': 'Norway'},
+                            'geometry': {'type': 'Polygon', 'coordinates': [square(0, 0, 10)]}})
+    db._uni.insert_one({'_id': 'first', 'geometry': {'type': 'Point', 'coordinates': [5, 5]}})
+    assert db.bootstrap() == {'countries': 1}
+    db._uni.insert_many([{'_id': 'scraped', 'geometry': {'type': 'Point', 'coordinates': [6, 6]}},
+                         {'_id': 'at sea', 'geometry': {'type': 'Point', 'coordinates': [50, 50]}}])
+    assert db.bootstrap() == {'countries': 1}
+    assert sorted(uni['_id'] for uni in db.get_country_list('norway')) == ['first', 'scraped']
+    assert db._uni.find_one({'_id': 'at sea'})['country_id'] is None
+    # universities in no country are not located again
+    assert db.bootstrap() == {}
+    choropleth = db.get_choropleth_countries()
+    assert choropleth['features'][0]['properties']['university_rating'] == 1
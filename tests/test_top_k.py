@@ -0,0 +1,90 @@
+from project import top_k
+from project.top_k import TopK
+
+
+class Store:
+    """the documents in mongo, load returns the k highest star_count"""
+    def __init__(self, **stars) -> None:
+        self.docs = {_id: {'_id': _id, 'star_count': count} for _id, count in stars.items()}
+        self.loads = 0
+
+    def load(self, k: int) -> list:
+        self.loads += 1
+        return sorted((dict(doc) for doc in self.docs.values()), key=lambda doc: -doc['star_count'])[:k]
+
+    def star(self, _id: str) -> dict:
+        self.docs[_id]['star_count'] += 1
+        return dict(self.docs[_id])
+
+
+def ids(docs) -> list:
+    return [doc['_id'] for doc in docs]
+
+
+def test_top_is_loaded_once_and_sorted():
+    store = Store(a=1, b=5, c=3)
+    top = TopK(store.load, 'star_count', k_max=2)
+    assert ids(top.top(2)) == ['b', 'c']
+    assert ids(top.top(1)) == ['b']
+    assert store.loads == 1
+
+
+def test_offer_replaces_the_lowest_and_reorders():
+    store = Store(a=1, b=5, c=3, d=2)
+    top = TopK(store.load, 'star_count', k_max=2)
+    top.top(2)
+    # d is outside the top and still lower than c
+    top.offer(store.star('d'))
+    assert ids(top.top(2)) == ['b', 'c']
+    top.offer(store.star('d'))
+    assert ids(top.top(2)) == ['b', 'd']
+    # a member going up is updated in place
+    for _ in range(3):
+        top.offer(store.star('d'))
+    assert ids(top.top(2)) == ['d', 'b']
+    assert store.loads == 1
+
+
+def test_offer_before_the_first_load_is_ignored():
+    store = Store(a=1, b=5)
+    top = TopK(store.load, 'star_count', k_max=1)
+    top.offer(store.star('a'))
+    assert ids(top.top(1)) == ['b']
+
+
+def test_offer_fills_a_top_smaller_than_k_max():
+    store = Store(a=1)
+    top = TopK(store.load, 'star_count', k_max=3)
+    top.top(3)
+    top.offer({'_id': 'b', 'star_count': 1})
+    assert sorted(ids(top.top(3))) == ['a', 'b']
+
+
+def test_k_is_clamped_to_k_max():
+    store = Store(**{f'u{i}': i for i in range(10)})
+    top = TopK(store.load, 'star_count', k_max=3)
+    assert ids(top.top(100)) == ['u9', 'u8', 'u7']
+
+
+def test_top_is_reloaded_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(top_k.time, 'monotonic', lambda: now[0])
+    store = Store(a=1, b=5)
+    top = TopK(store.load, 'star_count', k_max=1, ttl=60)
+    assert ids(top.top(1)) == ['b']
+    # an increment made by another worker process
+    store.docs['a']['star_count'] = 10
+    now[0] += 59
+    assert ids(top.top(1)) == ['b']
+    now[0] += 2
+    assert ids(top.top(1)) == ['a']
+    assert store.loads == 2
+
+
+def test_clear_reloads():
+    store = Store(a=1)
+    top = TopK(store.load, 'star_count', k_max=1)
+    top.top(1)
+    top.clear()
+    top.top(1)
+    assert store.loads == 2
@@ -0,0 +1,117 @@
+import threading
+import time
+
+from project.weather_job import StubWeatherProvider, WeatherJob
+
+
+def uni(_id, lng, lat, by=None, land='Norge'):
+    return {'_id': _id, 'geometry': {'type': 'Point', 'coordinates': [lng, lat]}, 'by': by, 'land': land}
+
+
+def locations(count: int) -> dict:
+    return {('cell', i, 0): {'lat': i, 'lng': 0, 'ids': [i]} for i in range(count)}
+
+
+class FlakyProvider(StubWeatherProvider):
+    """fails the first failures lookups"""
+
+    def __init__(self, failures: int) -> None:
+        super().__init__()
+        self.failures = failures
+
+    def forecast(self, lat: float, lng: float) -> tuple:
+        forecast = super().forecast(lat, lng)
+        if self.calls <= self.failures:
+            raise ConnectionError('weather service is down')
+        return forecast
+
+
+class HangingProvider(StubWeatherProvider):
+    """lookups hang until released, counts the lookups running at the same time"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.released = threading.Event()
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def forecast(self, lat: float, lng: float) -> tuple:
+        with self._lock:
+            self.calls += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        self.released.wait(5)
+        with self._lock:
+            self.running -= 1
+        return self.low, self.high
+
+
+def test_universities_in_a_city_or_cell_share_a_lookup():
+    provider = StubWeatherProvider(low=-3, high=4)
+    job = WeatherJob(provider, grid=1)
+    unis = [uni(1, 10.4, 63.4, by='Trondheim'), uni(2, 10.5, 63.5, by='trondheim'),
+            uni(3, 20.1, 50.1), uni(4, 20.2, 50.2), uni(5, 30, 40),
+            {'_id': 6, 'geometry': {'type': 'Polygon', 'coordinates': [[]]}}]
+    updates = job.run(unis)
+    assert provider.calls == 3
+    assert sorted(update._filter['_id'] for update in updates) == [1, 2, 3, 4, 5]
+    assert updates[0]._doc == {'$set': {'weather': {'min': -3, 'high': 4}}}
+
+
+def test_failed_lookups_are_retried_then_left_out():
+    provider = FlakyProvider(failures=2)
+    assert WeatherJob(provider, max_workers=1, retries=2).fetch(locations(1)) == {('cell', 0, 0): (5, 15)}
+    provider = FlakyProvider(failures=3)
+    assert WeatherJob(provider, max_workers=1, retries=2).fetch(locations(1)) == {}
+    assert provider.calls == 3
+
+
+def test_timed_out_lookups_keep_their_thread_and_are_bounded():
+    """
+    the hanging lookups are not stopped, no more than max_workers run, and fetch gives up
+    instead of queueing behind them
+    """
+    provider = HangingProvider()
+    job = WeatherJob(provider, max_workers=2, timeout=0.05, retries=1)
+    started = time.monotonic()
+    try:
+        assert job.fetch(locations(10)) == {}
+        assert time.monotonic() - started < 1
+        assert provider.max_running == 2
+        assert provider.calls == 2
+    finally:
+        provider.released.set()
+
+
+def test_lookups_beyond_max_workers_wait_for_a_free_thread():
+    provider = StubWeatherProvider(delay=0.01)
+    job = WeatherJob(provider, max_workers=3, timeout=1)
+    assert len(job.fetch(locations(10))) == 10
+    assert provider.calls == 10
+
+
+def join_weather_thread():
+    for thread in threading.enumerate():
+        if thread.name == 'weather':
+            thread.join()
+
+
+def test_update_weather_refreshes_in_the_background_once_a_day(db):
+    db._weather_provider = StubWeatherProvider(low=1, high=2)
+    db._uni.insert_one(uni('a', 10.4, 63.4, by='Trondheim'))
+    assert db.update_weather() == 'updating'
+    join_weather_thread()
+    assert db._uni.find_one({'_id': 'a'})['weather'] == {'min': 1, 'high': 2}
+    assert db.update_weather() == 'wait to update'
+
+
+def test_errors_in_the_weather_thread_are_logged(db, monkeypatch, caplog):
+    def refresh_weather():
+        raise RuntimeError('bulk_write failed')
+
+    monkeypatch.setattr(db, 'refresh_weather', refresh_weather)
+    db.update_weather()
+    join_weather_thread()
+    assert 'weather refresh failed' in caplog.text
+    assert 'bulk_write failed' in caplog.text